@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+import astropy.units as u
+from astropy.time import Time,TimeDelta
+from astropy.coordinates import SkyCoord,EarthLocation,ITRS
+import pulsarAnalysis.GPs.pulseCatalog as pc
+
+# Largest difference in seconds between corrected pulse times for
+# pulses to be taken as the same event
+tolerance=1e-4
+
+# Fixed offset in seconds added to the light travel time, GMRT minus
+# Jodrell Bank (clock offsets, and dispersion delays if the two are
+# dedispersed to different frequencies)
+fixedOffset=0.
+
+# Telescope locations and the Crab pulsar position
+siteDict={
+    'Jodrell Bank':EarthLocation.from_geodetic(-2.30715*u.deg,53.23625*u.deg,
+                                               77.*u.m),
+    'GMRT':EarthLocation.from_geodetic(74.04967*u.deg,19.09650*u.deg,
+                                       650.*u.m)
+    }
+crab=SkyCoord('05h34m31.94s','+22d00m52.2s',frame='icrs')
+
+# Spacing in seconds of the times at which the light travel time is
+# found exactly. It is interpolated in between, good to well below a
+# microsecond.
+delayStep=60.
+
+def getGeometricDelay(times,site1='Jodrell Bank',site2='GMRT'):
+    # Light travel time in seconds from 'site1' to 'site2' for the
+    # Crab at 'times', ie how much later a pulse reaches 'site2'.
+    # Found on a grid of 'delayStep' and interpolated, so the cost
+    # hardly grows with the number of pulses.
+
+    sec=(times-times.min()).sec
+    grid=np.arange(0,sec.max()+2*delayStep,delayStep)
+    gridTimes=times.min()+TimeDelta(grid,format='sec')
+    s=crab.transform_to(ITRS(obstime=gridTimes)).cartesian.xyz.value
+    s/=np.sqrt((s*s).sum(0))
+    b=(siteDict[site2].get_itrs().cartesian.xyz-
+       siteDict[site1].get_itrs().cartesian.xyz).to(u.m).value
+    delay=-np.dot(b,s)/299792458.
+    return np.interp(sec,grid,delay)
+
+def matchTimes(t1,t2,tolerance=tolerance):
+    # Pairs up times in 't1' and 't2' (seconds) that are closer than
+    # 'tolerance', keeping only pairs where each is the nearest to the
+    # other. Uses sorted search, so the cost is O(N log N). Returns
+    # the indices of the matched times in 't1' and in 't2'.
+
+    if len(t1)==0 or len(t2)==0:
+        return np.zeros(0,dtype=int),np.zeros(0,dtype=int)
+    order2=np.argsort(t2,kind='mergesort')
+    sorted2=t2[order2]
+
+    def nearest(t,sortedTimes):
+        # Index of the nearest of 'sortedTimes' to each of 't'
+        if len(sortedTimes)==1:
+            return np.zeros(len(t),dtype=int)
+        k=np.clip(np.searchsorted(sortedTimes,t),1,len(sortedTimes)-1)
+        left=np.abs(t-sortedTimes[k-1])<=np.abs(sortedTimes[k]-t)
+        return np.where(left,k-1,k)
+
+    order1=np.argsort(t1,kind='mergesort')
+    sorted1=t1[order1]
+    near2=nearest(t1,sorted2)
+    near1=nearest(sorted2,sorted1)
+
+    # Keep mutual nearest neighbours within the tolerance
+    idx1=np.arange(len(t1))
+    mutual=order1[near1[near2]]==idx1
+    close=np.abs(t1-sorted2[near2])<=tolerance
+    keep=mutual&close
+    return idx1[keep],order2[near2[keep]]
+
+def matchCatalogs(catalog1,catalog2,tolerance=tolerance,
+                  fixedOffset=fixedOffset):
+    # Finds pulses in 'catalog2' (eg GMRT) coincident with pulses in
+    # 'catalog1' (eg Jodrell Bank), after taking the light travel time
+    # between the telescopes and 'fixedOffset' off the times of
+    # 'catalog2'. Returns the indices of matched pulses in each catalog
+    # and the remaining time differences in seconds.
+
+    if len(catalog1)==0 or len(catalog2)==0:
+        return np.zeros(0,dtype=int),np.zeros(0,dtype=int),np.zeros(0)
+    refTime=pc.getTimes(catalog1[:1])[0]
+    t1=pc.getSeconds(catalog1,refTime)
+    t2=pc.getSeconds(catalog2,refTime)
+    delay=getGeometricDelay(pc.getTimes(catalog2),catalog1['telescope'][0],
+                            catalog2['telescope'][0])
+    t2=t2-delay-fixedOffset
+    idx1,idx2=matchTimes(t1,t2,tolerance)
+    return idx1,idx2,t2[idx2]-t1[idx1]
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: %s catalog1.npy [catalog2.npy ...]" % sys.argv[0]
+        # Run the code as eg: ./coincidence.py catalog.npy, with pulses
+        # from both Jodrell Bank and GMRT in one or more catalogs
+        sys.exit(1)
+    catalog=np.concatenate([pc.loadCatalog(i) for i in sys.argv[1:]])
+    jb=catalog[catalog['telescope']=='Jodrell Bank']
+    gmrt=catalog[catalog['telescope']=='GMRT']
+    if len(jb)==0 or len(gmrt)==0:
+        print "Error, pulses from both Jodrell Bank and GMRT are needed."
+        sys.exit(1)
+    idx1,idx2,residual=matchCatalogs(jb,gmrt)
+
+    times=pc.getTimes(jb)
+    print "\n"+str(len(idx1))+" coincident pulses from "+str(len(jb))+\
+        " Jodrell Bank and "+str(len(gmrt))+" GMRT pulses:\n"
+    for i in range(len(idx1)):
+        print str(i+1)+'.\t'+times[idx1[i]].iso+'\t'+\
+            str(round(jb['height'][idx1[i]],1))+' / '+\
+            str(round(gmrt['height'][idx2[i]],1))+' sigma\t'+\
+            str(round(residual[i]*1e6,2))+' microseconds'
+    if len(idx1):
+        print "\nMedian residual: ", np.median(residual)*1e6, "microseconds"
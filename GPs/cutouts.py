@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import numpy as np
+import pulsarAnalysis.GPs.pulseFinder as pf
+import pulsarAnalysis.GPs.pulseCatalog as pc
+import pulsarAnalysis.GPs.inspectFiles as inf
+from pulsarAnalysis.Misc import prefetch
+
+# Time to cut out before pulse peak in seconds
+leadWidth=0.0005
+
+# Time to cut out after pulse peak in seconds
+trailWidth=0.0015
+
+def openFile(path):
+    # Memory maps a foldspec (with its icount) or waterfall file,
+    # without reading any data
+
+    if 'foldspec' in os.path.basename(path):
+        return (prefetch.loadMmap(path),
+                np.load(path.replace('foldspec','icount'),mmap_mode='r'))
+    return np.load(path,mmap_mode='r')
+
+def tryOpenFile(path):
+    # Opens a file with openFile, printing an error and returning None
+    # if it is missing or unreadable
+
+    try:
+        return openFile(path)
+    except (IOError,OSError,ValueError) as e:
+        print "Error, could not open "+path+": "+str(e)
+        return None
+
+def getNBins(data):
+    # Number of time bins in a file opened with openFile
+
+    if isinstance(data,tuple):
+        return data[0].shape[2]
+    return data.shape[0]
+
+def readWindow(data,start,stop):
+    # Reads time bins 'start' to 'stop' of a file opened with
+    # openFile, with axes (frequency, time[, pol]) as in
+    # pulseFinder.loadFiles. Bins outside the file are nan.
+
+    nBins=getNBins(data)
+    lo=max(start,0)
+    hi=min(stop,nBins)
+    if isinstance(data,tuple):
+        f,ic=data
+        shape=(f.shape[1],stop-start)+f.shape[3:]
+        fw=f[:,:,lo:hi,...].sum(0,dtype=np.float64)
+        icw=ic[:,:,lo:hi].sum(0,dtype=np.float64)
+        if f.ndim==4:
+            icw=icw[...,np.newaxis]
+        w=fw/icw
+    else:
+        shape=(data.shape[1],stop-start)+data.shape[2:]
+        w=np.swapaxes(data[lo:hi,...],0,1)
+    cutout=np.empty(shape,dtype=pf.floatType)
+    cutout.fill(np.nan)
+    if hi>lo:
+        cutout[:,lo-start:hi-start,...]=w
+    return cutout
+
+def getCutout(data,index,leadBins,trailBins):
+    # Returns the pulse window 'leadBins' before to 'trailBins' after
+    # 'index', and the background window just before it, with one read
+
+    start=index-2*leadBins-trailBins
+    window=readWindow(data,start,index+trailBins)
+    return (window[:,leadBins+trailBins:,...],
+            window[:,:leadBins+trailBins,...])
+
+def getBins(binWidth,leadWidth=leadWidth,trailWidth=trailWidth):
+    return int(leadWidth/binWidth),int(trailWidth/binWidth)
+
+def getShape(data,nBins):
+    # Shape (frequency, time[, pol]) of a window of 'nBins' bins read
+    # from a file opened with openFile
+
+    if isinstance(data,tuple):
+        return (data[0].shape[1],nBins)+data[0].shape[3:]
+    return (data.shape[1],nBins)+data.shape[2:]
+
+def getIndex(path,time):
+    # Time bin of 'time' in file 'path'
+
+    entry=inf.inspectFile(path)
+    offset=(time-entry['startTime']).sec
+    return int(round(offset/inf.getBinWidth(entry)))
+
+def groupCatalog(catalog,dataDir,leadWidth=leadWidth,trailWidth=trailWidth):
+    # Groups the pulses in 'catalog' by the shape of their cut-outs,
+    # found from the file headers without reading any data, so pulses
+    # from different telescopes or resolutions can be cut out
+    # separately. Returns a list of (shape, catalog rows) sorted by
+    # telescope and the rows of pulses whose files cannot be opened.
+
+    groups={}
+    missing=[]
+    for iFile in np.unique(catalog['file']):
+        rows=np.flatnonzero(catalog['file']==iFile)
+        data=tryOpenFile(os.path.join(dataDir,iFile))
+        if data is None:
+            missing.append(rows)
+            continue
+        for i in rows:
+            shape=getShape(data,sum(getBins(catalog['binWidth'][i],
+                                            leadWidth,trailWidth)))
+            key=(catalog['telescope'][i],shape)
+            groups.setdefault(key,[]).append(i)
+    missing=np.concatenate(missing) if missing else np.zeros(0,dtype=int)
+    return ([(key[1],np.sort(groups[key])) for key in sorted(groups)],
+            missing)
+
+def getCutouts(catalog,dataDir,leadWidth=leadWidth,trailWidth=trailWidth):
+    # Cuts out every pulse in 'catalog' (see pulseCatalog) from its
+    # file, found in 'dataDir' unless stored with an absolute path.
+    # Returns stacked pulse and background windows with axes (pulse,
+    # frequency, time[, pol]), in catalog order, or None if no file can
+    # be read. Pulses are read file by file so each file is opened
+    # once. The cut-outs of pulses whose files cannot be opened, or
+    # whose shape differs from the first (see groupCatalog), are nan.
+
+    pulses=None
+    failed=[]
+    order=np.argsort(catalog['file'],kind='mergesort')
+    lastFile=None
+    for i in order:
+        if catalog['file'][i]!=lastFile:
+            lastFile=catalog['file'][i]
+            data=tryOpenFile(os.path.join(dataDir,lastFile))
+        if data is None:
+            failed.append(i)
+            continue
+        leadBins,trailBins=getBins(catalog['binWidth'][i],leadWidth,
+                                   trailWidth)
+        pulse,background=getCutout(data,catalog['index'][i],leadBins,
+                                   trailBins)
+        if pulses is None:
+            pulses=np.empty((len(catalog),)+pulse.shape,dtype=pulse.dtype)
+            backgrounds=np.empty_like(pulses)
+        elif pulse.shape!=pulses.shape[1:]:
+            print "Error, cut-out shape mismatch for pulse in file:"
+            print lastFile
+            failed.append(i)
+            continue
+        pulses[i]=pulse
+        backgrounds[i]=background
+    if pulses is None:
+        return None,None
+    pulses[failed]=np.nan
+    backgrounds[failed]=np.nan
+    return pulses,backgrounds
+
+def getOutputPaths(path,groups,catalog):
+    # Output file for each group of cut-outs from groupCatalog: 'path'
+    # for a single group, otherwise named after the telescope, and
+    # numbered if a telescope has more than one group
+
+    if len(groups)==1:
+        return [path]
+    root=path[:-4] if path.endswith('.npz') else path
+    telescopes=[catalog['telescope'][rows[0]] for shape,rows in groups]
+    paths=[]
+    for k,telescope in enumerate(telescopes):
+        name=root+'_'+telescope.replace(' ','')
+        if telescopes.count(telescope)>1:
+            name+='_'+str(telescopes[:k].count(telescope)+1)
+        paths.append(name+'.npz')
+    return paths
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print "Usage: %s catalog.npy dataDir cutouts.npz [telescope]" % \
+            sys.argv[0]
+        # Run the code as eg: ./cutouts.py catalog.npy /data/session/
+        # cutouts.npz. Pulses whose cut-outs differ in shape (eg from
+        # different telescopes) are saved to separate files, named
+        # after their telescope. Give a telescope to cut out only its
+        # pulses.
+        sys.exit(1)
+    catalog=pc.loadCatalog(sys.argv[1])
+    if len(sys.argv) > 4:
+        catalog=catalog[catalog['telescope']==sys.argv[4]]
+    if len(catalog)==0:
+        print "Error, no pulses in catalog."
+        sys.exit(1)
+    groups,missing=groupCatalog(catalog,sys.argv[2])
+    if len(missing):
+        print "Skipping "+str(len(missing))+" pulses in unreadable files."
+    if len(groups)==0:
+        print "Error, no pulses could be cut out."
+        sys.exit(1)
+    paths=getOutputPaths(sys.argv[3],groups,catalog)
+    for (shape,rows),path in zip(groups,paths):
+        part=catalog[rows]
+        pulses,backgrounds=getCutouts(part,sys.argv[2])
+        np.savez(path,pulses=pulses,backgrounds=backgrounds,catalog=part)
+        print "Saved "+str(len(part))+" cut-outs from "+\
+            part['telescope'][0]+" to "+path
+        print "\tShape: ", pulses.shape[1:]
+        print "\tSize: ", round(2*pulses.nbytes/1e6,1), "MB"
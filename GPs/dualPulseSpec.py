@@ -3,8 +3,11 @@
 import sys
 import numpy as np
 import matplotlib.pylab as plt
+from multiprocessing.pool import ThreadPool
 import pulsarAnalysis.GPs.pulseFinder as pf
 import pulsarAnalysis.GPs.pulseSpec as ps
+from pulsarAnalysis.Misc import layout
+from pulsarAnalysis.GPs import stokes
 
 # Time to display before pulse peak in seconds
 leadWidth=0.0001
@@ -19,199 +22,232 @@ searchRes=1.0/10000
 # Use same intensity color scale
 sameColorScale=False
 
-if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print "Usage: %s foldspec1 foldspec2" % sys.argv[0]
-        # Run the code as eg: ./dualPulseSpec.py foldspec1.npy foldspec2.py.
-        sys.exit(1)
-    
-    # Declare observation list, and dynamic spectra, frequency band,
-    # pulse time, and RFI-free channel dictionaries
-    obsList=[]
-    dynamicSpec={}
-    freqBand={}
-    pulseTimes={}
-    cleanChans={}
-    tRange={}
+# Number of files to load and search in parallel
+nThreads=4
+
+# Interpolation weights already found, by input and output grid
+_weightCache={}
 
-    # Loop through JB and GMRT files
-    for ifilename in sys.argv[1:]:
-        
-        # Folded spectrum axes: time, frequency, phase, pol=4 (XX, XY, YX, YY).
+def loadObservation(ifilename):
+    # Loads one file, finds its largest giant pulse and returns a
+    # dictionary with the background subtracted dynamic spectrum of
+    # the pulse (axes frequency, time, pol=4), its run information and
+    # the pulse time. Returns None if there is no usable pulse.
 
-        # Get run information
-        deltat=pf.getDeltaT(ifilename)
-        telescope=pf.getTelescope(ifilename)
-        startTime=pf.getStartTime(ifilename)
-        obsList.append((startTime,telescope))
-        freqBand[obsList[-1]]=pf.getFrequencyBand(telescope)
+    # Folded spectrum axes: time, frequency, phase, pol=4 (XX, XY, YX, YY).
 
-        if 'foldspec' in ifilename:
-            f = np.load(ifilename)
-            ic = np.load(ifilename.replace('foldspec', 'icount'))
+    # Get run information
+    deltat=pf.getDeltaT(ifilename)
+    telescope=pf.getTelescope(ifilename)
+    startTime=pf.getStartTime(ifilename)
 
-            # Collapse time axis
-            f=f[0,...]
-            ic=ic[0,...]
+    if 'foldspec' in ifilename:
+        # Sum over the time axis
+        f,ic=pf.readFile(ifilename)
+        w=f/ic[...,np.newaxis]
+        binWidth=deltat/f.shape[1]
 
-            # Find populated bins
-            fullList=np.flatnonzero(ic.sum(0))
-            w=f/ic[...,np.newaxis]
+    elif 'waterfall' in ifilename:
+        w=layout.load(ifilename)
+        binWidth=pf.getWaterfallBinWidth(telescope,w.shape[0])
 
-            binWidth=deltat/f.shape[1]
+    else:
+        print "Error, unrecognized file type:"
+        print ifilename
+        return None
 
-        elif 'waterfall' in ifilename:
-            w=np.load(ifilename)
-            w=np.swapaxes(w,0,1)
-            fullList=range(w.shape[1])
-            binWidth=pf.getWaterfallBinWidth(telescope,w.shape[0])
+    # Check for polarization data
+    if not w.shape[-1]==4:
+        print "Error, polarization data is missing for "+telescope+"."
+        return None
+
+    # Rebin to find giant pulses
+    nSearchBins=min(w.shape[1],int(round(deltat/searchRes)))
+
+    # Find the intensity once, and rebin it rather than all products
+    intensity=stokes.getIntensity(w,pf.pol_select)
+    timeSeries_rebin=pf.getTimeSeries(pf.rebin(intensity,nSearchBins))
+    timeSeries=pf.getTimeSeries(intensity)
+    pulseList=pf.getPulses(timeSeries_rebin,binWidth=searchRes)
+    if nSearchBins<w.shape[1]:
+        pulseList=[(pf.resolvePulse(
+                    timeSeries,int(pos*w.shape[1]/nSearchBins),
+                    binWidth=binWidth,searchRadius=1.0/10000),height)
+                   for (pos,height) in pulseList]
+    try:
+        largestPulse=pulseList[0][0]
+    except IndexError:
+        print "Error, no giant pulse found in "+telescope+" for start time:"
+        print startTime.iso
+        return None
+
+    # Find range of pulse to plot
+    leadBins=int(leadWidth/binWidth)
+    trailBins=int(trailWidth/binWidth)
+    pulseRange=range(largestPulse-leadBins,largestPulse+trailBins)
+    offRange=range(largestPulse-2*leadBins-trailBins,largestPulse-leadBins)
+
+    bg=ps.dynSpec(w,indices=offRange,normChan=False).mean(1,keepdims=True)
+    return {'key':(startTime,telescope),
+            'dynamicSpec':ps.dynSpec(w,indices=pulseRange,normChan=False)-bg,
+            'freqBand':pf.getFrequencyBand(telescope),
+            'pulseTime':(pf.getTime(largestPulse,binWidth,
+                                    startTime).iso[:-3]).split()[-1],
+            'cleanChans':ps.getRFIFreeBins(w.shape[0],telescope),
+            'binWidth':binWidth,
+            'leadBins':leadBins}
+
+def getWeights(xIn,xOut):
+    # Linear interpolation weights from samples at evenly spaced 'xIn'
+    # to 'xOut', as a matrix with axes (out, in). Points within half a
+    # sample of the ends take the end value, and rows for points
+    # outside that are zero. Weights are cached, so observations with
+    # the same setup share them.
+
+    key=(xIn[0],xIn[-1],len(xIn),xOut[0],xOut[-1],len(xOut))
+    if key in _weightCache:
+        return _weightCache[key]
+    step=(xIn[-1]-xIn[0])/max(len(xIn)-1,1)
+    pos=np.clip((xOut-xIn[0])/step,0,len(xIn)-1)
+    k=np.minimum(np.floor(pos).astype(int),len(xIn)-2)
+    frac=pos-k
+    inside=(xOut>=xIn[0]-0.5*step)&(xOut<=xIn[-1]+0.5*step)
+    rows=np.arange(len(xOut))
+    weights=np.zeros((len(xOut),len(xIn)))
+    if len(xIn)==1:
+        weights[inside,0]=1
+    else:
+        weights[rows,k]=np.where(inside,1-frac,0)
+        weights[rows,k+1]=np.where(inside,frac,0)
+    _weightCache[key]=weights
+    return weights
+
+def regrid(dyn,freqIn,timeIn,freqOut,timeOut):
+    # Resamples dynamic spectrum 'dyn' (axes frequency, time[, pol])
+    # from channel and bin centres 'freqIn' and 'timeIn' onto
+    # 'freqOut' and 'timeOut', with one matrix product along each
+    # axis. Points outside the observed band or pulse window are nan.
+
+    wF=getWeights(freqIn,freqOut)
+    wT=getWeights(timeIn,timeOut)
+    out=np.tensordot(wF,dyn,axes=(1,0))
+    out=np.moveaxis(np.tensordot(wT,out,axes=(1,1)),0,1)
+    missing=(wF.sum(1)==0)[:,np.newaxis]|(wT.sum(1)==0)[np.newaxis,:]
+    if out.ndim==3:
+        missing=missing[...,np.newaxis]
+    return np.where(missing,np.nan,out)
+
+def getCleanChans(cleanChans,nChan,freqIn,freqOut):
+    # Channels of 'freqOut' that draw only on the RFI-free channels
+    # 'cleanChans' of 'freqIn'
+
+    wF=getWeights(freqIn,freqOut)
+    dirty=np.ones(nChan,dtype=bool)
+    dirty[cleanChans]=False
+    clean=(wF.sum(1)>0)&(wF[:,dirty].sum(1)==0)
+    return list(np.flatnonzero(clean))
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print "Usage: %s foldspec1 foldspec2 ..." % sys.argv[0]
+        # Run the code as eg: ./dualPulseSpec.py foldspec1.npy
+        # foldspec2.npy foldspec3.npy, with one file per telescope.
+        sys.exit(1)
+
+    # Load and search JB, GMRT and any other files in parallel
+    pool=ThreadPool(min(nThreads,len(sys.argv)-1))
+    try:
+        obsData=pool.map(loadObservation,sys.argv[1:])
+    finally:
+        pool.close()
+        pool.join()
+    failed=[ifile for ifile,i in zip(sys.argv[1:],obsData) if i is None]
+    if failed:
+        print "Error, no usable pulse in:"
+        for ifile in failed:
+            print ifile
+        sys.exit(1)
+
+    # Declare observation list, and frequency band and pulse time
+    # dictionaries
+    obsList=[i['key'] for i in obsData]
+    freqBand=dict([(i['key'],i['freqBand']) for i in obsData])
+    pulseTimes=dict([(i['key'],i['pulseTime']) for i in obsData])
+
+    # Common grid covering all bands at the finest channel width, and
+    # the part of the pulse window seen by all files at the finest time
+    # resolution
+    ymin=min([ifreq[0] for ifreq in freqBand.values()])
+    ymax=max([ifreq[1] for ifreq in freqBand.values()])
+    chanWidth=min([(i['freqBand'][1]-i['freqBand'][0])/
+                   i['dynamicSpec'].shape[0] for i in obsData])
+    nChan=int(round((ymax-ymin)/chanWidth))
+    chanWidth=(ymax-ymin)/nChan
+    freqGrid=ymin+(np.arange(nChan)+0.5)*chanWidth
+    binWidth=min([i['binWidth'] for i in obsData])
+    tStart=max([-i['leadBins']*i['binWidth'] for i in obsData])
+    tStop=min([(i['dynamicSpec'].shape[1]-1-i['leadBins'])*i['binWidth']
+               for i in obsData])
+    timeGrid=np.arange(int(np.ceil(tStart/binWidth-1e-9)),
+                       int(np.floor(tStop/binWidth+1e-9))+1)*binWidth
+    tRange=(timeGrid[0],timeGrid[-1]+binWidth)
+
+    # Resample each observation onto the common grid
+    dynamicSpec={}
+    cleanChans={}
+    for i in obsData:
+        iObs=i['key']
+        nIn,nBins=i['dynamicSpec'].shape[:2]
+        band=i['freqBand']
+        freqIn=band[0]+(np.arange(nIn)+0.5)*(band[1]-band[0])/nIn
+        timeIn=(np.arange(nBins)-i['leadBins'])*i['binWidth']
+        dynamicSpec[iObs]=regrid(i['dynamicSpec'],freqIn,timeIn,freqGrid,
+                                 timeGrid)
+        cleanChans[iObs]=getCleanChans(i['cleanChans'],nIn,freqIn,freqGrid)
+    # Stokes parameters of each observation, all found in one pass
+    stokesSpec=dict([(iObs,stokes.Stokes(dynamicSpec[iObs]))
+                     for iObs in obsList])
+    for iObs in obsList:
+        stokesSpec[iObs].compute()
+    nObs=len(obsList)
 
-        else:
-            print "Error, unrecognized file type."
-            sys.exit()
-
-        # Check for polarization data
-        if not w.shape[-1]==4:
-            print "Error, polarization data is missing for "+telescope+"."
-            sys.exit()
-
-        # Rebin to find giant pulses
-        nSearchBins=min(w.shape[1],int(round(deltat/searchRes)))
-    
-        w_rebin=pf.rebin(w,nSearchBins)
-        timeSeries_rebin=pf.getTimeSeries(w_rebin)
-        timeSeries=pf.getTimeSeries(w)
-        pulseList=pf.getPulses(timeSeries_rebin,binWidth=searchRes)
-        if nSearchBins<w.shape[1]:
-            pulseList=[(pf.resolvePulse(
-                        timeSeries,int(pos*w.shape[1]/nSearchBins),
-                        binWidth=binWidth,searchRadius=1.0/10000),height) 
-                       for (pos,height) in pulseList]
-        try:
-            largestPulse=pulseList[0][0]
-        except IndexError:
-            print "Error, no giant pulse found in "+telescope+" for start time:"
-            print startTime.iso
-            sys.exit
-
-        # Find range of pulse to plot
-        leadBins=int(leadWidth/binWidth)
-        trailBins=int(trailWidth/binWidth)       
-        pulseRange=range(largestPulse-leadBins,largestPulse+trailBins)
-        offRange=range(largestPulse-2*leadBins-trailBins,largestPulse-leadBins)
-        
-        # Add entries to dynamic spectra and frequency band dictionaries
-        bg=ps.dynSpec(w,indices=offRange,normChan=False).mean(1,keepdims=True)
-        dynamicSpec[obsList[-1]]=ps.dynSpec(w,indices=pulseRange,
-                                            normChan=False)-bg
-                                            
-        pulseTimes[obsList[-1]]=(pf.getTime(pulseList[0][0],binWidth,
-                                            startTime).iso[:-3]).split()[-1]
-        cleanChans[obsList[-1]]=ps.getRFIFreeBins(w.shape[0],telescope)
-        tRange[obsList[-1]]=(-binWidth*leadBins,binWidth*trailBins)
-        
     # Determine aspect ratio for plotting
     freqRange=[b-a for (a,b) in freqBand.values()]
     maxFreqRange=max(freqRange)
     aspect=2e6*(leadWidth+trailWidth)/maxFreqRange
 
-
     # Declare max and min z axis values for plotting
-    vmin=[[],[]]
-    vmax=[[],[]]
-    
-    for i in range(4):
+    vmin=[[] for iObs in obsList]
+    vmax=[[] for iObs in obsList]
+
+    for i,param in enumerate('IQUV'):
+        for j,iObs in enumerate(obsList):
+            clean=stokesSpec[iObs].get(param)[cleanChans[iObs],:]
+            vmin[j].append(np.nanmin(clean))
+            vmax[j].append(np.nanmax(clean))
         if sameColorScale:
-            minVal=min([np.amin(dynamicSpec[iObs][cleanChans[iObs],:,i]) 
-                     for iObs in obsList])
-            maxVal=max([np.amax(dynamicSpec[iObs][cleanChans[iObs],:,i]) 
-                     for iObs in obsList])
-            vmin[0].append(minVal)
-            vmax[0].append(maxVal)
-            vmin[1].append(minVal)
-            vmax[1].append(maxVal)
-        else:
-            for j,iObs in enumerate(obsList):
-                vmin[j].append(np.amin(dynamicSpec[iObs][cleanChans[iObs],:,i]))
-                vmax[j].append(np.amax(dynamicSpec[iObs][cleanChans[iObs],:,i]))
-    if sameColorScale:
-        minVal_sum=min([np.amin(
-                    dynamicSpec[iObs][cleanChans[iObs],:,(0,3)].sum(-1)) 
-                      for iObs in obsList])
-        maxVal_sum=max([np.amax(
-                    dynamicSpec[iObs][cleanChans[iObs],:,(0,3)].sum(-1)) 
-                      for iObs in obsList])
-        vmin_sum=[minVal_sum,minVal_sum]
-        vmax_sum=[maxVal_sum,maxVal_sum]
-    else:
-        vmin_sum=[np.amin((dynamicSpec[iObs][cleanChans[iObs],...])[...,(0,3)].sum(-1)) for iObs in obsList]
-        vmax_sum=[np.amax((dynamicSpec[iObs][cleanChans[iObs],...])[...,(0,3)].sum(-1)) for iObs in obsList]
-
-    # Find difference in frequency range and channel widths
-    upperDiff=freqBand[obsList[0]][1]-freqBand[obsList[1]][1]
-    lowerDiff=freqBand[obsList[0]][0]-freqBand[obsList[1]][0]
-    chanWidth=[]
-    chanWidth.append(
-        (freqBand[obsList[0]][1]-freqBand[obsList[0]][0])/
-        dynamicSpec[obsList[0]].shape[0])
-    chanWidth.append(
-        (freqBand[obsList[0]][1]-freqBand[obsList[0]][0])/
-        dynamicSpec[obsList[0]].shape[0])
-
-    if not chanWidth[0]==chanWidth[1]:
-        print "Warning, channel widths are not equal."
-
-    # Pad smaller image with constant values to maintain aspect ratio
-    if upperDiff>0:
-        nBinsUpper=int(round(upperDiff/chanWidth[1]))
-        dynamicSpec[obsList[1]]=np.pad(dynamicSpec[obsList[1]],
-                                       ((0,nBinsUpper),(0,0),(0,0)),
-                                       mode='constant',
-                                       constant_values=
-                                       ((0,vmin[1]),(0,0),(0,0)))
-    elif upperDiff<0:
-        nBinsUpper=int(round(-upperDiff/chanWidth[0]))
-        dynamicSpec[obsList[0]]=np.pad(dynamicSpec[obsList[0]],
-                                       ((0,nBinsUpper),(0,0),(0,0)),
-                                       mode='constant',
-                                       constant_values=
-                                       ((0,vmin[0]),(0,0),(0,0)))
-    if lowerDiff<0:
-        nBinsLower=int(round(-lowerDiff/chanWidth[1]))
-        dynamicSpec[obsList[1]]=np.pad(dynamicSpec[obsList[1]],
-                                       ((nBinsLower,0),(0,0),(0,0)),
-                                       mode='constant',
-                                       constant_values=
-                                       ((vmin[1],0),(0,0),(0,0)))
-        cleanChans[obsList[1]]=[i+nBinsLower for i in cleanChans[obsList[1]]]
-    elif lowerDiff>0:
-        nBinsLower=int(round(lowerDiff/chanWidth[0]))
-        dynamicSpec[obsList[0]]=np.pad(dynamicSpec[obsList[0]],
-                                       ((nBinsLower,0),(0,0),(0,0)),
-                                       mode='constant',
-                                       constant_values=
-                                       ((vmin[0],0),(0,0),(0,0)))
-        cleanChans[obsList[0]]=[i+nBinsLower for i in cleanChans[obsList[1]]]
-
-    # Loop through polarisations to plot
-    for i in range(4):
-
-        fig,axes = plt.subplots(nrows=1,ncols=2)
-            
-        ymin=min([ifreq[0] for ifreq in freqBand.values()])
-        ymax=max([ifreq[1] for ifreq in freqBand.values()])
+            minVal=min([vmin[j][i] for j in range(nObs)])
+            maxVal=max([vmax[j][i] for j in range(nObs)])
+            for j in range(nObs):
+                vmin[j][i]=minVal
+                vmax[j][i]=maxVal
+
+    # Loop through Stokes parameters to plot
+    for i,param in enumerate('IQUV'):
+
+        fig,axes = plt.subplots(nrows=1,ncols=nObs)
 
         # Loop through telescopes
         for j,jobs in enumerate(obsList):
 
-            # Plot image and set titles
-            im=axes.flat[j].imshow(dynamicSpec[jobs][:,:,i],origin='lower',
-                       interpolation='nearest',cmap=plt.get_cmap('Greys'),
-                       extent=[tRange[jobs][0]*1e6,tRange[jobs][1]*1e6,
-                               ymin,ymax],
+            # Plot image and set titles, with intensity in colour
+            im=axes.flat[j].imshow(stokesSpec[jobs].get(param),
+                       origin='lower',interpolation='nearest',
+                       cmap=None if param=='I' else plt.get_cmap('Greys'),
+                       extent=[tRange[0]*1e6,tRange[1]*1e6,ymin,ymax],
                        aspect=aspect,vmin=vmin[j][i],vmax=vmax[j][i])
             axes.flat[j].set_title(pulseTimes[jobs]+'\n'+jobs[1]+
-                                   ' ( Pol '+str(i)+' )')
+                                   ' ( Stokes '+param+' )')
             axes.flat[j].set_xlabel('Time (microseconds)')
             axes.flat[j].set_ylabel('Frequency (MHz)')
             # Plot color bar on each subplot if color scales are different
@@ -225,45 +261,15 @@ if __name__ == "__main__":
             fig.colorbar(im,cax=cax)
         else:
             plt.tight_layout()
-        
-        plt.show()
 
-    fig,axes = plt.subplots(nrows=1,ncols=2)
-
-    # Loop through telescopes
-    for j,jobs in enumerate(obsList):
-        
-        # Plot image and set titles
-        im=axes.flat[j].imshow(dynamicSpec[jobs][:,:,(0,3)].sum(-1),
-                               origin='lower',
-                               interpolation='nearest',
-                               #cmap=plt.get_cmap('Greys'),
-                               extent=[tRange[jobs][0]*1e6,tRange[jobs][1]*1e6,
-                                       ymin,ymax],
-                               aspect=aspect,
-                               vmin=vmin_sum[j],
-                               vmax=vmax_sum[j])
-        axes.flat[j].set_title(pulseTimes[jobs]+'\n'+jobs[1]+
-                               ' ( Intensity )')
-        axes.flat[j].set_xlabel('Time (microseconds)')
-        axes.flat[j].set_ylabel('Frequency (MHz)')
-        if not sameColorScale:
-            plt.colorbar(im,ax=axes.flat[j])
-    if sameColorScale:
-        cax = fig.add_axes([0.9,0.1,0.03,0.8])
-        fig.colorbar(im,cax=cax)
-    else:
-        plt.tight_layout()
-    
-    plt.show()
+        plt.show()
 
     # Plot Spectra
     freqList=[]
     for j,jObs in enumerate(obsList):
-        spectrum=(dynamicSpec[jObs][cleanChans[jObs],...])[...,(0,3)].sum(-1).sum(1)     
+        spectrum=stokesSpec[jObs].I[cleanChans[jObs],:].sum(1)
         spectrum=(spectrum-np.mean(spectrum))/np.std(spectrum)
-        chanWidth=(ymax-ymin)/dynamicSpec[jObs].shape[0]
-        freqList.append([ymin+chanWidth*i for i in cleanChans[jObs]])
+        freqList.append(freqGrid[cleanChans[jObs]])
         # Plot image and set titles
         plt.plot(freqList[-1],spectrum,label=jObs[1])
     xmin=max([min(i) for i in freqList])
@@ -277,9 +283,9 @@ if __name__ == "__main__":
     # Plot Profile
     timeList=[]
     for j,jObs in enumerate(obsList):
-        profile=(dynamicSpec[jObs][cleanChans[jObs],...])[...,(0,3)].sum(-1).sum(0)     
+        profile=stokesSpec[jObs].I[cleanChans[jObs],:].sum(0)
         profile=(profile-np.mean(profile))/np.std(profile)
-        timeList.append(np.linspace(tRange[jObs][0],tRange[jObs][1],len(profile))*1e6)
+        timeList.append(timeGrid*1e6)
         # Plot image and set titles
         plt.plot(timeList[-1],profile,label=jObs[1])
     xmin=max([min(i) for i in timeList])
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import json
+from astropy.time import Time
+import pulsarAnalysis.GPs.inspectFiles as inf
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir=None
+
+# Name of the index file kept in each indexed directory
+indexName='.pulsarIndex.json'
+
+# Increase when the entry layout changes, so old indices are rebuilt
+indexVersion=1
+
+def listDir(path):
+    # Returns (name, mtime, size) for each file in 'path', using
+    # scandir where available to avoid a stat call per file
+
+    if scandir is None:
+        fileList=[]
+        for name in os.listdir(path):
+            fullPath=os.path.join(path,name)
+            if os.path.isfile(fullPath):
+                stat=os.stat(fullPath)
+                fileList.append((name,stat.st_mtime,stat.st_size))
+        return fileList
+    return [(i.name,i.stat().st_mtime,i.stat().st_size)
+            for i in scandir(path) if i.is_file()]
+
+def makeEntry(path,mtime,size):
+    # Reads the file name and .npy header of one file
+
+    entry=inf.inspectFile(path)
+    startTime=entry.get('startTime')
+    return {'kind':entry['kind'],'telescope':entry.get('telescope'),
+            'startTime':startTime.isot if startTime is not None else None,
+            'mjd':startTime.mjd if startTime is not None else None,
+            'deltat':entry.get('deltat'),
+            'shape':list(entry['shape']) if 'shape' in entry else None,
+            'dtype':entry['dtype'].str if 'dtype' in entry else None,
+            'mtime':mtime,'size':size}
+
+def loadIndex(path):
+    # Reads the index of directory 'path', returning an empty index
+    # if there is none or it is out of date
+
+    indexPath=os.path.join(path,indexName)
+    if not os.path.exists(indexPath):
+        return {}
+    try:
+        with open(indexPath) as f:
+            index=json.load(f)
+    except ValueError:
+        print "Error, could not read "+indexPath+", rebuilding."
+        return {}
+    if index.get('version')!=indexVersion:
+        return {}
+    return index['files']
+
+def saveIndex(path,files):
+    # Writes the index of directory 'path', replacing the old index
+    # only once the new one is completely written
+
+    indexPath=os.path.join(path,indexName)
+    tmpPath=indexPath+'.tmp'
+    try:
+        with open(tmpPath,'w') as f:
+            json.dump({'version':indexVersion,'files':files},f)
+        os.rename(tmpPath,indexPath)
+    except (IOError,OSError):
+        # Read only directories are indexed on every run instead
+        pass
+
+def updateIndex(path):
+    # Returns the index of directory 'path', a dictionary of file name
+    # to entry. Only files that are new or whose size or modification
+    # time changed are read; entries for removed files are dropped.
+
+    oldFiles=loadIndex(path)
+    files={}
+    changed=False
+    for name,mtime,size in listDir(path):
+        if name==indexName or name.startswith(indexName):
+            continue
+        entry=oldFiles.get(name)
+        if entry is None or entry['mtime']!=mtime or entry['size']!=size:
+            if inf.getKind(name) is None:
+                continue
+            entry=makeEntry(os.path.join(path,name),mtime,size)
+            changed=True
+        files[name]=entry
+    if changed or len(files)!=len(oldFiles):
+        saveIndex(path,files)
+    return files
+
+def query(dirList,telescope=None,kind=None,start=None,end=None):
+    # Returns the paths of indexed files in 'dirList' from 'telescope'
+    # of 'kind' (eg. 'GMRT', 'foldspec') that overlap the times
+    # 'start' to 'end', sorted by start time. Arguments left as None
+    # are not used to select files.
+
+    startMJD=start.mjd if start is not None else None
+    endMJD=end.mjd if end is not None else None
+    found=[]
+    for iDir in dirList:
+        for name,entry in updateIndex(iDir).items():
+            if kind is not None and entry['kind']!=kind:
+                continue
+            if telescope is not None and entry['telescope']!=telescope:
+                continue
+            if startMJD is not None or endMJD is not None:
+                if entry['mjd'] is None:
+                    continue
+                fileEnd=entry['mjd']+(entry['deltat'] or 0.)/86400.
+                if startMJD is not None and fileEnd<startMJD:
+                    continue
+                if endMJD is not None and entry['mjd']>endMJD:
+                    continue
+            found.append((entry['mjd'],os.path.join(iDir,name)))
+    found.sort(key=lambda x: (x[0] is None,x[0],x[1]))
+    return [path for _,path in found]
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: %s dir [telescope kind start end]" % sys.argv[0]
+        # Run the code as eg: ./fileIndex.py /data/session/ GMRT foldspec
+        # 2015-04-27T13:30:00 2015-04-27T14:00:00
+        sys.exit(1)
+    args=sys.argv[2:]+[None]*4
+    start=Time(args[2],format='isot',scale='utc') if args[2] else None
+    end=Time(args[3],format='isot',scale='utc') if args[3] else None
+    for path in query([sys.argv[1]],args[0],args[1],start,end):
+        print path
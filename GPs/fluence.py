@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+import sys
+import multiprocessing
+import numpy as np
+from pulsarAnalysis.GPs import stokes
+from pulsarAnalysis.GPs.scattering import getProfiles,matchedFilter
+
+# System equivalent flux density in Jy of each telescope. With the
+# default of 1, fluences are in units of the off-pulse level times
+# seconds.
+sefdDict={'Jodrell Bank':1.,'GMRT':1.}
+
+# Lower cut-off of the fitted distributions. Either a fluence, or 'ks'
+# to choose the cut-off giving the smallest Kolmogorov-Smirnov
+# distance between the data above it and the fitted power law.
+cutoff='ks'
+
+# Fewest pulses to fit above a cut-off, and on either side of a break
+minTail=50
+minSegment=10
+
+# Number of trial cut-offs and break fluences
+nCandidates=100
+
+# Number of points, log spaced from each trial cut-off, at which the
+# Kolmogorov-Smirnov distance is measured. The distance is largest near
+# the cut-off, where the points are densest.
+nKSPoints=1000
+
+# Grid of power law indices searched for the broken power law, before
+# refining around the best point
+indexGrid=np.linspace(0.,6.,241)
+
+# Number of bootstrap resamples, the coarser index grid used to fit
+# them, and processes to fit them with
+nBootstrap=100
+bootstrapGrid=np.linspace(0.,6.,61)
+nProcs=4
+
+def getSEFD(telescopes,sefdDict=sefdDict):
+    # SEFD of each pulse from the telescope it was seen with
+
+    return np.array([sefdDict[i] for i in telescopes],dtype=np.float64)
+
+def getFluences(pulses,backgrounds,binWidth,sefd=1.):
+    # Fluence of each pulse in a file of cut-outs (see cutouts.py),
+    # summed over the best matched filter boxcar of its intensity
+    # profile and scaled by the off-pulse level. 'binWidth' and 'sefd'
+    # are single values or one per pulse. Returns the fluences, boxcar
+    # widths in seconds and signal-to-noise.
+
+    profiles,noise=getProfiles(pulses,backgrounds)
+    level=np.nansum(np.nanmean(stokes.getIntensity(backgrounds),axis=2,
+                               dtype=np.float64),axis=1)
+    width,start,snr=matchedFilter(profiles,noise)
+    fluences=snr*noise*np.sqrt(width)/level*binWidth*sefd
+    return fluences,width*binWidth,snr
+
+def fitPowerLaw(x,xmin):
+    # Maximum likelihood index of a power law p(x) ~ x^-alpha for the
+    # values of 'x' at or above 'xmin'. Returns the index, its
+    # uncertainty, the number of values used and the log likelihood.
+    # fitDistribution passes only the tail the cut-off was chosen for.
+
+    tail=x[x>=xmin]
+    n=len(tail)
+    logSum=np.log(tail/xmin).sum()
+    alpha=1+n/logSum
+    logL=n*np.log((alpha-1)/xmin)-alpha*logSum
+    return alpha,(alpha-1)/np.sqrt(n),n,logL
+
+def findCutoff(sortedX,minTail=minTail,nCandidates=nCandidates,
+               nKSPoints=nKSPoints):
+    # Chooses the cut-off of a power law fit to the sorted values
+    # 'sortedX' (as Clauset et al. 2009) from up to 'nCandidates'
+    # values, each leaving at least 'minTail' values from it on. The
+    # index at every candidate comes from one suffix sum of logarithms,
+    # and the Kolmogorov-Smirnov distances of all candidates are found
+    # together at 'nKSPoints' log spaced points of each tail. Returns
+    # the cut-off, the Kolmogorov-Smirnov distance and the position of
+    # the cut-off in 'sortedX'; the tail is sortedX[position:].
+
+    n=len(sortedX)
+    if n<minTail:
+        raise ValueError('only '+str(n)+' values, fewer than '+str(minTail))
+    logX=np.log(sortedX)
+    suffix=np.cumsum(logX[::-1])[::-1]
+    candidates=np.unique(np.linspace(0,n-minTail,nCandidates).astype(int))
+    m=n-candidates
+    alpha=1+m/(suffix[candidates]-m*logX[candidates])
+
+    # Offsets into each tail, axes (candidate, point)
+    offsets=np.unique(np.logspace(0,np.log10(n),nKSPoints).astype(int))-1
+    valid=offsets[np.newaxis,:]<m[:,np.newaxis]
+    idx=np.minimum(candidates[:,np.newaxis]+offsets[np.newaxis,:],n-1)
+    ratio=np.exp(logX[idx]-logX[candidates][:,np.newaxis])
+    model=1-ratio**(1-alpha[:,np.newaxis])
+    empirical=offsets[np.newaxis,:]/m[:,np.newaxis].astype(np.float64)
+    gap=np.maximum(np.abs(model-empirical),
+                   np.abs(model-empirical-1./m[:,np.newaxis]))
+    distance=np.where(valid,gap,0.).max(1)
+
+    best=np.argmin(distance)
+    return sortedX[candidates[best]],distance[best],candidates[best]
+
+def _brokenLogL(a1,a2,nLow,nHigh,logLow,logHigh,xmin,xBreak):
+    # Log likelihood of a continuous broken power law, with index 'a1'
+    # from 'xmin' to 'xBreak' and 'a2' above, from the number of values
+    # and sums of log(x/xBreak) below and above the break. Broadcasts
+    # over all arguments.
+
+    r=xmin/xBreak
+    with np.errstate(divide='ignore',invalid='ignore'):
+        lower=np.where(np.abs(1-a1)>1e-8,(1-r**(1-a1))/(1-a1),-np.log(r))
+        norm=xBreak*(lower+1/(a2-1))
+        logL=-a1*logLow-a2*logHigh-(nLow+nHigh)*np.log(norm)
+    return np.where((a2>1)&(norm>0),logL,-np.inf)
+
+def fitBrokenPowerLaw(x,xmin,minSegment=minSegment,nCandidates=nCandidates,
+                      indexGrid=indexGrid):
+    # Maximum likelihood broken power law for the values of 'x' at or
+    # above 'xmin'. Every trial break (up to 'nCandidates' values, each
+    # with at least 'minSegment' values on either side) and pair of
+    # indices on 'indexGrid' is evaluated at once from sums of
+    # logarithms, then the best point is refined on a grid 40 times
+    # finer.
+    # Returns the lower and upper indices, the break and the log
+    # likelihood.
+
+    tail=np.sort(x[x>=xmin])
+    n=len(tail)
+    if n<2*minSegment:
+        return np.nan,np.nan,np.nan,-np.inf
+    logX=np.concatenate(([0.],np.cumsum(np.log(tail))))
+    k=np.unique(np.linspace(minSegment,n-minSegment,nCandidates).astype(int))
+    xBreak=tail[k]
+    logB=np.log(xBreak)
+    nLow=k.astype(np.float64)
+    nHigh=n-nLow
+    logLow=logX[k]-nLow*logB
+    logHigh=logX[-1]-logX[k]-nHigh*logB
+
+    # Coarse grid, axes (break, a1, a2)
+    a1=indexGrid[np.newaxis,:,np.newaxis]
+    a2=indexGrid[np.newaxis,np.newaxis,:]
+    col=lambda v: v[:,np.newaxis,np.newaxis]
+    logL=_brokenLogL(a1,a2,col(nLow),col(nHigh),col(logLow),col(logHigh),
+                     xmin,col(xBreak))
+    b,i,j=np.unravel_index(np.argmax(logL),logL.shape)
+
+    # Refine around the best grid point
+    step=indexGrid[1]-indexGrid[0]
+    fine=np.linspace(-step,step,41)
+    a1=indexGrid[i]+fine[:,np.newaxis]
+    a2=indexGrid[j]+fine[np.newaxis,:]
+    logL=_brokenLogL(a1,a2,nLow[b],nHigh[b],logLow[b],logHigh[b],xmin,
+                     xBreak[b])
+    p,q=np.unravel_index(np.argmax(logL),logL.shape)
+    return a1[p,0],a2[0,q],xBreak[b],logL[p,q]
+
+def fitDistribution(x,cutoff=cutoff,indexGrid=indexGrid):
+    # Fits power law and broken power law distributions to fluences
+    # 'x' above 'cutoff' (see above). Both are fitted to the same tail
+    # the cut-off was chosen for. Returns a dictionary of results.
+
+    x=np.sort(x[np.isfinite(x)&(x>0)])
+    if cutoff=='ks':
+        xmin,distance,start=findCutoff(x)
+    else:
+        xmin,distance=cutoff,np.nan
+        start=np.searchsorted(x,xmin)
+    tail=x[start:]
+    alpha,alphaError,n,logL=fitPowerLaw(tail,xmin)
+    alpha1,alpha2,xBreak,logLBroken=fitBrokenPowerLaw(tail,xmin,
+                                                      indexGrid=indexGrid)
+    return {'xmin':xmin,'distance':distance,'n':n,'alpha':alpha,
+            'alphaError':alphaError,'logL':logL,'alpha1':alpha1,
+            'alpha2':alpha2,'xBreak':xBreak,'logLBroken':logLBroken}
+
+def _bootstrapPart(args):
+    # Fits 'nSamples' resamples of 'x' drawn with random seed 'seed'
+
+    x,cutoff,nSamples,seed=args
+    rng=np.random.RandomState(seed)
+    return [fitDistribution(x[rng.randint(len(x),size=len(x))],cutoff,
+                            bootstrapGrid)
+            for i in range(nSamples)]
+
+def bootstrap(x,cutoff=cutoff,nBootstrap=nBootstrap,nProcs=nProcs,seed=0):
+    # Refits 'nBootstrap' resamples of the fluences 'x' (with the
+    # cut-off chosen afresh each time if 'cutoff' is 'ks') in a process
+    # pool, on the coarser 'bootstrapGrid'. Returns a dictionary with
+    # the array of each fitted value.
+
+    x=x[np.isfinite(x)&(x>0)]
+    sizes=[len(i) for i in np.array_split(np.arange(nBootstrap),nProcs)]
+    jobs=[(x,cutoff,size,seed+i) for i,size in enumerate(sizes) if size]
+    pool=multiprocessing.Pool(len(jobs))
+    try:
+        parts=pool.map(_bootstrapPart,jobs)
+    finally:
+        pool.close()
+        pool.join()
+    fits=[fit for part in parts for fit in part]
+    return dict([(key,np.array([fit[key] for fit in fits]))
+                 for key in fits[0]])
+
+def getInterval(samples,level=0.68):
+    # Central confidence interval of bootstrap 'samples'
+
+    samples=samples[np.isfinite(samples)]
+    return tuple(np.percentile(samples,[50*(1-level),50*(1+level)]))
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: %s cutouts.npz [cutoff]" % sys.argv[0]
+        # Run the code as eg: ./fluence.py cutouts.npz, with cut-outs
+        # made by cutouts.py. Without a cut-off, one is chosen.
+        sys.exit(1)
+    data=np.load(sys.argv[1])
+    catalog=data['catalog']
+    missing=set(catalog['telescope'])-set(sefdDict.keys())
+    if missing:
+        print "Error, no SEFD for "+', '.join(sorted(missing))+"."
+        sys.exit(1)
+    fluences,widths,snr=getFluences(data['pulses'],data['backgrounds'],
+                                    catalog['binWidth'],
+                                    getSEFD(catalog['telescope']))
+    if np.sum(fluences>0)<minTail:
+        print "Error, fewer than "+str(minTail)+" pulses with fluences."
+        sys.exit(1)
+    cut=float(sys.argv[2]) if len(sys.argv) > 2 else cutoff
+    fit=fitDistribution(fluences,cut)
+    if fit['n']<minTail:
+        print "Error, only "+str(fit['n'])+" pulses above the cut-off."
+        sys.exit(1)
+    samples=bootstrap(fluences,cut)
+
+    print "\nFluence distribution of "+str(len(fluences))+" pulses:\n"
+    print "\tCut-off: ", fit['xmin'], getInterval(samples['xmin'])
+    print "\tPulses above cut-off: ", fit['n']
+    print "\nPower law:"
+    print "\tIndex: ", fit['alpha'], "+/-", fit['alphaError'],
+    print getInterval(samples['alpha'])
+    print "\tLog likelihood: ", fit['logL']
+    print "\nBroken power law:"
+    print "\tLower index: ", fit['alpha1'], getInterval(samples['alpha1'])
+    print "\tUpper index: ", fit['alpha2'], getInterval(samples['alpha2'])
+    print "\tBreak: ", fit['xBreak'], getInterval(samples['xBreak'])
+    print "\tLog likelihood: ", fit['logLBroken']
+    print "\nIntervals are 68% bootstrap intervals from "+str(nBootstrap)+\
+        " resamples."
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import numpy as np
+import pulsarAnalysis.GPs.pulseFinder as pf
+from pulsarAnalysis.Misc import prefetch
+
+# Approximate rates in bytes per second used to estimate run time
+readRate=100e6
+computeRate=200e6
+
+def getKind(fileName):
+    # Returns the type of data in a file based on its name
+
+    name=os.path.basename(fileName)
+    for kind in ('foldspec','icount','waterfall','voltage'):
+        if kind in name:
+            return kind
+    return None
+
+def readHeader(path):
+    # Reads only the header of a .npy file, returning its shape, data
+    # type, byte order and data offset
+
+    with open(path,'rb') as f:
+        version=np.lib.format.read_magic(f)
+        if version==(1,0):
+            shape,fortran,dtype=np.lib.format.read_array_header_1_0(f)
+        else:
+            shape,fortran,dtype=np.lib.format.read_array_header_2_0(f)
+        offset=f.tell()
+    return {'shape':shape,'dtype':dtype,'byteorder':dtype.byteorder,
+            'fortran':fortran,'offset':offset,
+            'nbytes':int(np.prod(shape))*dtype.itemsize}
+
+def inspectFile(path):
+    # Returns header and file name information for one file. Problems
+    # are listed under 'errors' instead of raising.
+
+    entry={'path':path,'kind':getKind(path),'errors':[]}
+    try:
+        entry.update(readHeader(path))
+    except (IOError,ValueError) as e:
+        entry['errors'].append('unreadable header ('+str(e)+')')
+        return entry
+    if entry['kind']=='icount':
+        return entry
+    try:
+        entry['telescope']=pf.getTelescope(path)
+        entry['startTime']=pf.getStartTime(path)
+        entry['deltat']=pf.getDeltaT(path)
+    except (ValueError,IndexError,UnboundLocalError):
+        entry['errors'].append('start time or duration not in file name')
+    return entry
+
+def getLoadedShape(entry,folded=False):
+    # Shape of a file's data as returned by pulseFinder.loadFiles
+
+    shape=entry['shape']
+    if entry['kind']=='foldspec':
+        return shape if folded else shape[1:]
+    elif entry['kind']=='waterfall':
+        return (shape[1],shape[0])+shape[2:]
+    return shape
+
+def getBinWidth(entry,folded=False):
+    # Time bin width as worked out by pulseFinder.loadFiles
+
+    if entry['kind']=='foldspec':
+        return entry['deltat']/entry['shape'][2]
+    return pf.getWaterfallBinWidth(entry['telescope'],entry['shape'][1])
+
+def inspectFiles(fileList,folded=False):
+    # Inspects foldspec and waterfall files and their icounts without
+    # loading any data. Returns a list of entries for the usable files
+    # and a dictionary of file to problem for the rest.
+
+    entries=[]
+    problems={}
+    refShape=None
+    for path in fileList:
+        kind=getKind(path)
+        if not kind in ('foldspec','waterfall'):
+            problems[path]='file name is not recognized'
+            continue
+        entry=inspectFile(path)
+        if kind=='foldspec':
+            icount=path.replace('foldspec','icount')
+            if not os.path.exists(icount):
+                entry['errors'].append('missing icount')
+            else:
+                icEntry=inspectFile(icount)
+                entry['errors']+=icEntry['errors']
+                if 'shape' in icEntry and 'shape' in entry and \
+                        icEntry['shape']!=entry['shape'][:len(icEntry['shape'])]:
+                    entry['errors'].append('icount shape '+str(
+                            icEntry['shape'])+' does not match')
+                entry['icountBytes']=icEntry.get('nbytes',0)
+        if len(entry['errors'])==0:
+            shape=getLoadedShape(entry,folded)
+            if refShape is None:
+                refShape=shape
+            elif shape!=refShape:
+                entry['errors'].append('shape '+str(shape)+
+                                       ' does not match '+str(refShape))
+        if len(entry['errors']):
+            problems[path]=', '.join(entry['errors'])
+        else:
+            entries.append(entry)
+    return entries,problems
+
+def estimateRun(entries,folded=False):
+    # Estimates the peak memory (bytes) and time (seconds) needed to
+    # load and stack 'entries' with pulseFinder.loadFiles
+
+    if len(entries)==0:
+        return 0,0.
+    fileBytes=[i['nbytes']+i.get('icountBytes',0) for i in entries]
+    stackedBytes=int(np.prod(getLoadedShape(entries[0],folded)))*8
+
+    # Files queued, being handed over and in use (see prefetch), plus
+    # the stack and one loaded file
+    memory=(prefetch.queueDepth+2)*max(fileBytes)+2*stackedBytes
+    totalBytes=sum(fileBytes)
+    duration=totalBytes/readRate+totalBytes/computeRate
+    return memory,duration
+
+def printPlan(entries,problems,folded=False):
+    print "\nUsable files:"
+    for entry in entries:
+        print "\t"+os.path.basename(entry['path'])
+        print "\t\tShape: ", entry['shape'], entry['dtype']
+        print "\t\tTelescope: ", entry['telescope']
+        print "\t\tStart time: ", entry['startTime'].iso
+        print "\t\tDuration: ", entry['deltat'], "s"
+    if len(problems):
+        print "\nProblems:"
+        for path in sorted(problems.keys()):
+            print "\t"+path+": "+problems[path]
+    if len(entries):
+        memory,duration=estimateRun(entries,folded)
+        print "\nRun plan:"
+        print "\tStacked shape: ", getLoadedShape(entries[0],folded)
+        print "\tResolution: ", getBinWidth(entries[0],folded), "s"
+        print "\tPeak memory: ", round(memory/1e6,1), "MB"
+        print "\tEstimated time: ", round(duration,1), "s\n"
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: %s foldspec1 foldspec2 ..." % sys.argv[0]
+        # Run the code as eg: ./inspectFiles.py path/to/foldspecs/
+        sys.exit(1)
+    fileList=[]
+    for iPath in sys.argv[1:]:
+        if os.path.isdir(iPath):
+            fileList+=[os.path.join(iPath,i) for i in sorted(os.listdir(iPath))
+                       if getKind(i) in ('foldspec','waterfall')]
+        else:
+            fileList.append(iPath)
+    entries,problems=inspectFiles(fileList)
+    printPlan(entries,problems)
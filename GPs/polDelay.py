@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+from pulsarAnalysis.Misc import fftTools
+from pulsarAnalysis.Misc.delaySolver import refinePeak
+import pulsarAnalysis.GPs.pulseCatalog as pc
+
+# Largest offset between polarizations to search for in seconds
+maxDelay=5e-5
+
+def getProfiles(pulses,backgrounds,chans=None):
+    # Background subtracted profiles, with axes (pulse, time, pol), of
+    # stacked cut-outs with axes (pulse, frequency, time, pol) (see
+    # cutouts.py), summed over channels 'chans' (default all)
+
+    if chans is not None:
+        pulses=pulses[:,chans,...]
+        backgrounds=backgrounds[:,chans,...]
+    bg=np.nanmean(backgrounds,axis=2,dtype=np.float64)
+    return np.nansum(pulses-bg[:,:,np.newaxis,...],axis=1,dtype=np.float64)
+
+def crossCorrelate(a,b):
+    # Normalized cross-correlation of each row of 'a' with the same row
+    # of 'b', using zero padded FFTs of all rows at once. Returns the
+    # lags in bins and the correlation at each lag, normalized by the
+    # number of overlapping bins. A peak at a positive lag means 'a' is
+    # later than 'b'.
+
+    n=a.shape[-1]
+    a=(a-a.mean(-1)[:,np.newaxis])/a.std(-1)[:,np.newaxis]
+    b=(b-b.mean(-1)[:,np.newaxis])/b.std(-1)[:,np.newaxis]
+    nFFT=fftTools.nextFastLen(2*n-1)
+    corr=fftTools.irfft(fftTools.rfft(a,n=nFFT)*
+                        np.conj(fftTools.rfft(b,n=nFFT)),n=nFFT)
+    corr=np.concatenate((corr[:,nFFT-n+1:],corr[:,:n]),axis=1)
+    lags=np.arange(-n+1,n)
+    return lags,corr/(n-np.abs(lags))
+
+def getDelays(profiles,binWidth,maxDelay=maxDelay,pols=(0,3)):
+    # Finds the offset of polarization pols[0] relative to pols[1] in
+    # each of 'profiles' (axes pulse, time, pol) by FFT
+    # cross-correlation, refined below one bin with a parabola through
+    # the peak. 'binWidth' is one bin width for all pulses or one per
+    # pulse. Returns the offsets and their uncertainties in seconds,
+    # and the peak correlation of each pulse. The uncertainty is the
+    # offset over which the fitted peak drops by the noise in the
+    # correlation.
+
+    lags,corr=crossCorrelate(profiles[...,pols[0]],profiles[...,pols[1]])
+    binWidth=np.asarray(binWidth,dtype=np.float64)
+    maxLag=np.maximum(1,(maxDelay/binWidth).astype(int))
+    inRange=np.abs(lags)<=maxLag.max()
+    lags=lags[inRange]
+    corr=corr[:,inRange]
+
+    # Search each pulse only up to its own largest lag
+    allowed=np.abs(lags)[np.newaxis,:]<=maxLag.reshape((-1,1))
+    k=np.argmax(np.where(allowed,corr,-np.inf),axis=1)
+    rows=np.arange(len(k))
+    offset=refinePeak(corr,k)
+    delays=(lags[k]+offset)*binWidth
+
+    # Curvature of the peak and noise of the correlation there
+    n=profiles.shape[1]
+    curvature=np.abs(corr[rows,(k-1)%len(lags)]-2*corr[rows,k]+
+                     corr[rows,(k+1)%len(lags)])
+    noise=1/np.sqrt(n-np.abs(lags[k]))
+    valid=curvature>0
+    errors=np.where(valid,np.sqrt(2*noise/np.where(valid,curvature,1.))*
+                    binWidth,np.inf)
+    return delays,errors,corr[rows,k]
+
+def summarize(delays,errors):
+    # Returns the weighted mean offset and its uncertainty, the median
+    # offset and the robust scatter (1.4826 times the median absolute
+    # deviation) of a set of offsets
+
+    weights=1/errors**2
+    mean=np.sum(weights*delays)/np.sum(weights)
+    meanError=1/np.sqrt(np.sum(weights))
+    median=np.median(delays)
+    scatter=1.4826*np.median(np.abs(delays-median))
+    return mean,meanError,median,scatter
+
+def printOffset(delay,error=None):
+    # Prints an R-L offset given in seconds
+
+    delay=delay*1e9
+    print "\t"+str(delay)+" ns",
+    if error is not None:
+        print "+/- "+str(error*1e9)+" ns",
+    print "~= "+str(int(round(delay/60.)))+' bytes ~=',
+    print str(int(round(299792458*delay*1e-9)))+' m / c.'
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: %s cutouts.npz" % sys.argv[0]
+        # Run the code as eg: ./polDelay.py cutouts.npz, with cut-outs
+        # made by cutouts.py
+        sys.exit(1)
+    data=np.load(sys.argv[1])
+    catalog=data['catalog']
+    if data['pulses'].shape[-1]!=4:
+        print "Error, polarization data is missing."
+        sys.exit(1)
+    profiles=getProfiles(data['pulses'],data['backgrounds'])
+    delays,errors,peaks=getDelays(profiles,catalog['binWidth'])
+
+    times=pc.getTimes(catalog)
+    print "\nOffset (R-L) for "+str(len(delays))+" pulses:\n"
+    for i in range(len(delays)):
+        print str(i+1)+'.\t'+catalog['telescope'][i]+'\t'+times[i].iso
+        printOffset(delays[i],errors[i])
+    mean,meanError,median,scatter=summarize(delays,errors)
+    print "\nWeighted mean:"
+    printOffset(mean,meanError)
+    print "Median:"
+    printOffset(median)
+    print "Scatter:"
+    printOffset(scatter)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import numpy as np
+from astropy.time import Time
+import pulsarAnalysis.GPs.pulseFinder as pf
+
+# Catalog layout, one entry per pulse. 'index' is the pulse's time bin
+# in its file. Pulse times are stored as an integer MJD and seconds
+# into that day to keep full precision.
+catalogDtype=[('telescope','U16'),('file','U256'),('index','i8'),
+              ('mjd','i8'),('sec','f8'),('height','f8'),('binWidth','f8')]
+
+# Longest file path the catalog can hold
+maxPathLength=np.dtype(catalogDtype)['file'].itemsize//np.dtype('U1').itemsize
+
+def newCatalog(n=0):
+    return np.zeros(n,dtype=catalogDtype)
+
+def makeEntries(pulseList,runInfo,fileName):
+    # Makes catalog entries for the (index, height) pairs in
+    # 'pulseList', found in 'fileName' with run information 'runInfo'
+    # (see pulseFinder.loadFiles). The file is stored by its absolute
+    # path, so files of the same name in different directories are
+    # kept apart. Raises ValueError if the path is too long to store.
+
+    path=os.path.abspath(fileName)
+    if len(path)>maxPathLength:
+        raise ValueError('path of '+str(len(path))+' characters is longer'+
+                         ' than the '+str(maxPathLength)+' a catalog holds: '+
+                         path)
+    entries=newCatalog(len(pulseList))
+    if len(pulseList)==0:
+        return entries
+    indices=np.array([i for i,_ in pulseList])
+
+    # Convert indices into the populated bins to file bins
+    fullList=runInfo.get('fullList')
+    if fullList is not None and len(fullList):
+        indices=np.asarray(fullList)[indices]
+    times=pf.getTime(indices,runInfo['binWidth'],runInfo['startTime'])
+    mjd=np.floor(times.mjd).astype(int)
+    sec=(times-Time(mjd,format='mjd',scale='utc')).sec
+
+    entries['telescope']=runInfo['telescope']
+    entries['file']=path
+    entries['index']=indices
+    entries['mjd']=mjd
+    entries['sec']=sec
+    entries['height']=[height for _,height in pulseList]
+    entries['binWidth']=runInfo['binWidth']
+    return entries
+
+def getTimes(catalog):
+    # Returns the pulse times of all catalog entries
+
+    return Time(catalog['mjd'],catalog['sec']/86400.,format='mjd',
+                scale='utc',precision=6)
+
+def getSeconds(catalog,refTime):
+    # Returns the pulse times in seconds after 'refTime'
+
+    refDay=int(np.floor(refTime.mjd))
+    refSec=(refTime-Time(refDay,format='mjd',scale='utc')).sec
+    return (catalog['mjd']-refDay)*86400.+(catalog['sec']-refSec)
+
+def addEntries(catalog,entries):
+    # Adds entries to a catalog, replacing any entries for the same
+    # files, and sorts by time
+
+    catalog=catalog[~np.isin(catalog['file'],np.unique(entries['file']))]
+    catalog=np.concatenate((catalog,entries))
+    return catalog[np.lexsort((catalog['sec'],catalog['mjd']))]
+
+def loadCatalog(path):
+    # Loads a catalog, or returns an empty one if it does not exist
+
+    if not os.path.exists(path):
+        return newCatalog()
+    return np.load(path)
+
+def saveCatalog(path,catalog):
+    # Saves a catalog, replacing the old file only once the new one
+    # is completely written
+
+    tmpPath=path+'.tmp.npy'
+    np.save(tmpPath,catalog)
+    os.rename(tmpPath,path)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: %s catalog" % sys.argv[0]
+        # Run the code as eg: ./pulseCatalog.py catalog.npy.
+        sys.exit(1)
+    catalog=loadCatalog(sys.argv[1])
+    times=getTimes(catalog)
+    print "\n"+str(len(catalog))+" pulses in catalog:\n"
+    for i in range(len(catalog)):
+        print str(i+1)+'.\t'+catalog['telescope'][i]+'\t'+times[i].iso+\
+            '\t'+str(round(catalog['height'][i],1))+' sigma\t'+\
+            catalog['file'][i]
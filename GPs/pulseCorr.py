@@ -7,6 +7,8 @@ import pulsarAnalysis.GPs.pulseFinder as pf
 import pulsarAnalysis.GPs.pulseSpec as ps
 import itertools
 import os
+from pulsarAnalysis.Misc import prefetch
+from pulsarAnalysis.GPs import stokes
 
 # Time to display before pulse peak in seconds
 leadWidth=0.0001
@@ -45,9 +47,10 @@ if __name__ == "__main__":
 
     print "Finding MP Pulses..."
     # Loop through JB and GMRT files
-    for ifilename in os.listdir(sys.argv[1]):
-        if not('foldspec' in ifilename or 'waterfall' in ifilename):
-            continue
+    fileList=[i for i in os.listdir(sys.argv[1])
+              if 'foldspec' in i or 'waterfall' in i]
+    loader=lambda x: pf.readFile(sys.argv[1]+x)
+    for ifilename,data in prefetch.prefetch(fileList,loader):
 
         # Get run information
         deltat=pf.getDeltaT(ifilename)
@@ -55,22 +58,18 @@ if __name__ == "__main__":
         startTime=pf.getStartTime(ifilename)
 
         if 'foldspec' in ifilename:
-            f = np.load(sys.argv[1]+ifilename)
-            ic = np.load(sys.argv[1]+ifilename.replace('foldspec', 'icount'))
-
-            # Collapse time axis
-            f=f[0,...]
-            ic=ic[0,...]
+            # Time axis is summed over by readFile
+            f,ic=data
 
             # Find populated bins
-            fullList=np.flatnonzero(ic.sum(0).sum(0))
+            fullList=np.flatnonzero(ic.sum(0))
             w=f/ic[...,np.newaxis]
 
             binWidth=deltat/f.shape[1]
 
         elif 'waterfall' in ifilename:
-            w=np.load(sys.argv[1]+ifilename)
-            w=np.swapaxes(w,0,1)
+            # Frequency first (see layout.load)
+            w=data
             fullList=range(w.shape[1])
             binWidth=pf.getWaterfallBinWidth(telescope,w.shape[0])
 
@@ -124,9 +123,10 @@ if __name__ == "__main__":
             MPDict[pulseTime]['prof_bg']=MPDict[pulseTime]['dynSpec_bg'].sum(0)
     print "Complete!"
     print "Finding IP Pulses..."
-    for ifilename in os.listdir(sys.argv[2]):
-        if not('foldspec' in ifilename or 'waterfall' in ifilename):
-            continue
+    fileList=[i for i in os.listdir(sys.argv[2])
+              if 'foldspec' in i or 'waterfall' in i]
+    loader=lambda x: pf.readFile(sys.argv[2]+x)
+    for ifilename,data in prefetch.prefetch(fileList,loader):
 
         # Get run information
         deltat=pf.getDeltaT(ifilename)
@@ -134,22 +134,18 @@ if __name__ == "__main__":
         startTime=pf.getStartTime(ifilename)
 
         if 'foldspec' in ifilename:
-            f = np.load(sys.argv[2]+ifilename)
-            ic = np.load(sys.argv[2]+ifilename.replace('foldspec', 'icount'))
-
-            # Collapse time axis
-            f=f[0,...]
-            ic=ic[0,...]
+            # Time axis is summed over by readFile
+            f,ic=data
 
             # Find populated bins
-            fullList=np.flatnonzero(ic.sum(0).sum(0))
+            fullList=np.flatnonzero(ic.sum(0))
             w=f/ic[...,np.newaxis]
 
             binWidth=deltat/f.shape[1]
 
         elif 'waterfall' in ifilename:
-            w=np.load(sys.argv[2]+ifilename)
-            w=np.swapaxes(w,0,1)
+            # Frequency first (see layout.load)
+            w=data
             fullList=range(w.shape[1])
             binWidth=pf.getWaterfallBinWidth(telescope,w.shape[0])
 
@@ -205,6 +201,12 @@ if __name__ == "__main__":
     print "Complete!\n"
     print "Calculating correlations..."
     
+    # Find background subtracted intensity spectra once for each pulse
+    for iDict in (MPDict,IPDict):
+        for i in iDict.keys():
+            iDict[i]['specI']=stokes.getIntensity(iDict[i]['spec']-
+                                                  iDict[i]['spec_bg'])
+
     # Find all pairs of pulses
     MPMPpairs=itertools.combinations(MPDict.keys(),2)
     MPIPpairs=itertools.product(MPDict.keys(),IPDict.keys())
@@ -214,21 +216,13 @@ if __name__ == "__main__":
     MPMPcorrCoef=[]
     for (i,j) in MPMPpairs:
         MPMPdt.append(abs((i-j).sec))
-        spec1=(MPDict[i]['spec'][:,(0,3)]-MPDict[i][
-                'spec_bg'][:,(0,3)]).sum(-1)
-        spec2=(MPDict[j]['spec'][:,(0,3)]-MPDict[j][
-                'spec_bg'][:,(0,3)]).sum(-1)
-        MPMPcorrCoef.append(corr(spec1,spec2))
+        MPMPcorrCoef.append(corr(MPDict[i]['specI'],MPDict[j]['specI']))
 
     MPIPdt=[]
     MPIPcorrCoef=[]
     for (i,j) in MPIPpairs:
         MPIPdt.append(abs((i-j).sec))
-        spec1=(MPDict[i]['spec'][:,(0,3)]-MPDict[i][
-                'spec_bg'][:,(0,3)]).sum(-1)
-        spec2=(IPDict[j]['spec'][:,(0,3)]-IPDict[j][
-                'spec_bg'][:,(0,3)]).sum(-1)
-        MPIPcorrCoef.append(corr(spec1,spec2))
+        MPIPcorrCoef.append(corr(MPDict[i]['specI'],IPDict[j]['specI']))
 
     print "Complete!"
     
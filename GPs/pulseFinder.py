@@ -7,6 +7,8 @@ import matplotlib.pylab as plt
 import string
 from astropy.time import Time,TimeDelta
 import warnings
+from pulsarAnalysis.Misc import prefetch,layout
+from pulsarAnalysis.GPs import stokes
 
 # Crab frequency 
 # Should implement an ephemeris/polynomial based frequency, but this
@@ -29,15 +31,39 @@ nNoiseBins=0
 # Polarizations to sum over
 pol_select = (0, 3)
 
+# Check file headers and file names before loading (see inspectFiles)
+checkFiles=True
+
+# Read unfolded foldspecs one subintegration at a time from a memory
+# map, so only one subintegration is held in memory (see iterSubints)
+streamSubints=True
+
+# Floating point type for loaded data and the arrays derived from it.
+# np.float32 halves memory and bandwidth; sums over channels and time
+# are still accumulated in float64.
+floatType=np.float64
+
+# When using a type other than float64, check on the first file that
+# pulse heights (sigma) and spectra (fractional) stay within these
+# tolerances of the float64 result
+checkPrecision=True
+snrTolerance=0.01
+specTolerance=1e-5
+
 def loadFiles(pathList,folded=False):
     if len(pathList)==0:
         print "Usage: %s foldspec" % sys.argv[0]
         # Run the code as: ./script.py data_foldspec.npy.
         sys.exit(1) 
     runInfo={}
+    fileList=[]
     for i,iPath in enumerate(pathList):
         if os.path.isdir(iPath):
-            iFileList=os.listdir(iPath)
+            # Use the directory's index (see fileIndex) to list its
+            # foldspecs and waterfalls in time order
+            from pulsarAnalysis.GPs import fileIndex
+            iFileList=[os.path.basename(x) for x in fileIndex.query([iPath])
+                       if fileIndex.inf.getKind(x) in ('foldspec','waterfall')]
         else:
             iFileList=[iPath]
         for j,jFile in enumerate(iFileList):
@@ -45,65 +71,84 @@ def loadFiles(pathList,folded=False):
                 iFile=iPath+'/'+jFile
             else:
                 iFile=jFile
-            if i==0 and j==0:
-                deltat=getDeltaT(iFile)
-                telescope=getTelescope(iFile)
-                startTime=getStartTime(iFile)
-            if folded:
-                f=np.load(iFile)
-                ic=np.load(iFile.replace('foldspec', 'icount'))
-                if i==0:
-                    binWidth=deltat/f.shape[2]
+            fileList.append((i,j,iFile))
+
+    if checkFiles:
+        # Check file headers before loading anything, dropping files
+        # that would fail part way through the run
+        from pulsarAnalysis.GPs import inspectFiles
+        entries,problems=inspectFiles.inspectFiles(
+            [iFile for _,_,iFile in fileList],folded)
+        for iFile in sorted(problems.keys()):
+            print "Error, skipping "+iFile+": "+problems[iFile]
+        fileList=[x for x in fileList if not x[2] in problems]
+        if len(fileList)==0:
+            print "Error, no usable files found."
+            sys.exit(1)
+
+    # Read the next file in the background while summing this one.
+    # Up to prefetch.queueDepth+2 whole files are in memory at once.
+    loader=lambda x: readFile(x[2],folded)
+    for k,((i,j,iFile),data) in enumerate(prefetch.prefetch(fileList,loader)):
+        if k==0:
+            deltat=getDeltaT(iFile)
+            telescope=getTelescope(iFile)
+            startTime=getStartTime(iFile)
+        if folded:
+            f,ic=data
+            if k==0:
+                binWidth=deltat/f.shape[2]
+            if f.shape[-1]==4:
+                w=f/ic[...,np.newaxis]
+            else:
+                w=f/ic
+            w=toFloatType(w,k==0)
+        else:
+            if 'foldspec' in iFile:
+                f,ic=data
+                if k==0:
+                    binWidth=deltat/f.shape[1]
                 if f.shape[-1]==4:
                     w=f/ic[...,np.newaxis]
                 else:
                     w=f/ic
+                w=toFloatType(w,k==0)
+            elif 'waterfall' in iFile:
+                # Frequency first (see layout.load)
+                w=data
+                if k==0:
+                    binWidth=getWaterfallBinWidth(telescope,w.shape[0])
+                w=toFloatType(w,k==0)
             else:
-                if 'foldspec' in iFile:
-                    f=np.load(iFile)
-                    ic=np.load(iFile.replace('foldspec', 'icount'))
-                    f=f.sum(0)
-                    ic=ic.sum(0)
-                    if i==0:
-                        binWidth=deltat/f.shape[1]
-                    if f.shape[-1]==4:
-                        w=f/ic[...,np.newaxis]
-                    else:
-                        w=f/ic
-                elif 'waterfall' in iFile:
-                    w=np.load(iFile)
-                    w=np.swapaxes(w,0,1)
-                    if i==0:
-                        binWidth=getWaterfallBinWidth(telescope,w.shape[0])
-                else:
-                    print "Error, the following file name is not recognized:"
-                    print iFile
-            if i==0 and j==0:
-                n=w
-            elif n.shape==w.shape:
-                n=n+w
-            else:
-                print "Error, shape mismatch in file:"
+                print "Error, the following file name is not recognized:"
                 print iFile
+        if k==0:
+            n=w
+        elif n.shape==w.shape:
+            n+=w
+        else:
+            print "Error, shape mismatch in file:"
+            print iFile
 
+    # Remove empty bins, keeping 'n' contiguous
     if folded:
         if n.shape[-1]==4:
             isNotNan=~np.isnan(n.sum(-1).sum(1).sum(0))
             fullList=np.flatnonzero(isNotNan)
-            n=n[:,:,isNotNan,:]
+            n=n.compress(isNotNan,axis=2)
         else:
             isNotNan=~np.isnan(n.sum(1).sum(0))
             fullList=np.flatnonzero(isNotNan)
-            n=n[:,:,isNotNan]
+            n=n.compress(isNotNan,axis=2)
     else:
         if n.shape[-1]==4:
             isNotNan=~np.isnan(n.sum(-1).sum(0))
             fullList=np.flatnonzero(isNotNan)
-            n=n[:,isNotNan,:]
+            n=n.compress(isNotNan,axis=1)
         else:
             isNotNan=~np.isnan(n.sum(0))
             fullList=np.flatnonzero(isNotNan)
-            n=n[:,isNotNan]
+            n=n.compress(isNotNan,axis=1)
     runInfo['binWidth']=binWidth
     runInfo['telescope']=telescope
     runInfo['deltat']=deltat
@@ -111,6 +156,115 @@ def loadFiles(pathList,folded=False):
     runInfo['fullList']=fullList
     return n, runInfo
 
+def toFloatType(w,check=False):
+    # Converts 'w' to 'floatType', first comparing results with the
+    # float64 ones if 'check'
+
+    if check and checkPrecision and np.dtype(floatType)!=np.float64:
+        comparePrecision(w)
+    return np.asarray(w,dtype=floatType)
+
+def comparePrecision(w,dtype=None):
+    # Compares the time series and spectrum of 'w' found in float64
+    # and in 'dtype' (default 'floatType'). Returns the largest
+    # difference in pulse height (sigma) and the largest fractional
+    # difference in the spectrum, warning if either is above tolerance.
+
+    if dtype is None:
+        dtype=floatType
+    w64=np.asarray(w,dtype=np.float64)
+    wLow=np.asarray(w,dtype=dtype)
+    snrError=np.amax(np.abs(getTimeSeries(wLow)-getTimeSeries(w64)))
+
+    spec64=getSpectrum(w64)
+    specError=np.nanmax(np.abs(getSpectrum(wLow)/spec64-1.))
+    if snrError>snrTolerance or specError>specTolerance:
+        print "Warning, "+np.dtype(dtype).name+" results differ from float64:"
+        print "\tPulse height: ", snrError, "sigma"
+        print "\tSpectrum: ", specError
+    return snrError,specError
+
+def getSpectrum(w):
+    # Mean intensity in each channel, accumulated in float64
+
+    w=stokes.getIntensity(w,pol_select)
+    return np.nanmean(w,axis=1,dtype=np.float64)
+
+def readFile(fileName,folded=False):
+    # Reads the arrays in a foldspec (with its icount) or waterfall
+    # file. Unless 'folded', foldspec and icount are summed over their
+    # time axis.
+
+    if folded:
+        return (np.load(fileName),
+                np.load(fileName.replace('foldspec', 'icount')))
+    elif 'foldspec' in fileName:
+        if streamSubints:
+            return sumSubints(fileName)
+        f=np.load(fileName)
+        ic=np.load(fileName.replace('foldspec', 'icount'))
+        return f.sum(0,dtype=np.float64),ic.sum(0,dtype=np.float64)
+    elif 'waterfall' in fileName:
+        return layout.load(fileName)
+    return None
+
+def iterSubints(fileName):
+    # Reads a foldspec and its icount one subintegration (time axis
+    # entry) at a time from a memory map. Only the populated phase bins
+    # of each subintegration are read. Yields (subint, start, f, ic),
+    # with 'f' and 'ic' covering phase bins 'start' onwards.
+
+    f=np.load(fileName,mmap_mode='r')
+    ic=np.load(fileName.replace('foldspec', 'icount'),mmap_mode='r')
+    for k in xrange(f.shape[0]):
+        icSub=np.asarray(ic[k],dtype=np.float64)
+        populated=np.flatnonzero(icSub.reshape(-1,icSub.shape[-1]).sum(0))
+        if len(populated)==0:
+            continue
+        lo=populated[0]
+        hi=populated[-1]+1
+        yield (k,lo,np.asarray(f[k,:,lo:hi,...],dtype=np.float64),
+               icSub[:,lo:hi])
+
+def sumSubints(fileName):
+    # Sums a foldspec and its icount over subintegrations, reading one
+    # at a time
+
+    f=np.load(fileName,mmap_mode='r')
+    fSum=np.zeros(f.shape[1:])
+    icSum=np.zeros(f.shape[1:3])
+    for k,lo,fSub,icSub in iterSubints(fileName):
+        fSum[:,lo:lo+fSub.shape[1],...]+=fSub
+        icSum[:,lo:lo+icSub.shape[1]]+=icSub
+    return fSum,icSum
+
+def findSubintPulses(fileName,threshold=5,searchRes=1.0/10000):
+    # Searches each subintegration of a foldspec for giant pulses,
+    # holding one subintegration in memory at a time. Returns a list of
+    # (subint, index, height), where 'index' is the phase bin in the
+    # file.
+
+    f=np.load(fileName,mmap_mode='r')
+    binWidth=getDeltaT(fileName)/f.shape[2]
+    candidates=[]
+    for k,lo,fSub,icSub in iterSubints(fileName):
+        if fSub.shape[-1]==4:
+            w=fSub/icSub[...,np.newaxis]
+        else:
+            w=fSub/icSub
+        w=np.asarray(w,dtype=floatType)
+
+        # Search only populated bins, as in loadFiles
+        if w.shape[-1]==4:
+            fullList=np.flatnonzero(~np.isnan(w.sum(-1).sum(0)))
+        else:
+            fullList=np.flatnonzero(~np.isnan(w.sum(0)))
+        w=w[:,fullList,...]
+        pulseList=findPulses(w,binWidth,w.shape[1]*binWidth,
+                             threshold=threshold,searchRes=searchRes)
+        candidates+=[(k,fullList[i]+lo,height) for i,height in pulseList]
+    return candidates
+
 def getTelescope(fileName):
     # Gets telescope name based on file name
 
@@ -150,11 +304,11 @@ def rebin(w,nBins=10000):
         return w
 
     nBinsCombine=float(nBinsOld)/nBins
-    binEdges=[i*nBinsCombine for i in range(nBins+1)]
-    w=np.array([w[:,np.floor(binEdges[i]):np.floor(binEdges[i+1]),...].sum(1) for i in range(nBins)])
-    w=np.swapaxes(w,0,1)
-    
-    return w
+    binEdges=np.floor(np.arange(nBins)*nBinsCombine).astype(int)
+
+    # Sum in float64, keeping the type of 'w'
+    return np.add.reduceat(w,binEdges,axis=1,dtype=np.float64).astype(
+        w.dtype,copy=False)
 
 def rms(sequence):
     # Gets root-mean square of sequence
@@ -202,17 +356,14 @@ def getPeriod(pulseLocation,binWidth,endIndex):
 
 def getTimeSeries(w,nNoiseBins=1):
     # Gets profile time series over which to search for giant pulses
-    if w.shape[-1] == 4:
-        n = w[..., pol_select].sum(-1)
-    else:
-        n = w
+    n = stokes.getIntensity(w,pol_select)
         
     # Normalize by median flux in each frequency bin
     n_median = nanMedian(n)
     nn = n / n_median[:,np.newaxis] - 1.
 
-    # Sum over frequency and remove Nan entries
-    timeSeries = nn.sum(0)
+    # Sum over frequency in float64 and remove Nan entries
+    timeSeries = nn.sum(0,dtype=np.float64)
     timeSeries = timeSeries[~np.isnan(timeSeries)]
 
     # Find noise bins, and normlize by noise in each
@@ -221,8 +372,7 @@ def getTimeSeries(w,nNoiseBins=1):
            for i in range(nNoiseBins)]
 
     for i in range(nNoiseBins):
-        for j in range(noiseBins[i],noiseBins[i+1]):
-            timeSeries[j]/=noise[i]
+        timeSeries[noiseBins[i]:noiseBins[i+1]]/=noise[i]
 
     return timeSeries
 
@@ -277,7 +427,44 @@ def getPulses(timeSeries,threshold=5,binWidth=None):
 
     return [(i,pulseDict[i]) for i in pulseList]
 
+def findPulses(w,binWidth,deltat,threshold=5,searchRes=1.0/10000):
+    # Finds pulses in 'w' with at most one bin per 'searchRes' seconds,
+    # then resolves them at the full resolution of 'w'
+
+    nSearchBins=min(w.shape[1],int(round(deltat/searchRes)))
+    w_rebin=rebin(w,nSearchBins)
+    timeSeries_rebin=getTimeSeries(w_rebin)
+    pulseList=getPulses(timeSeries_rebin,threshold=threshold,
+                        binWidth=searchRes)
+    if nSearchBins<w.shape[1]:
+        timeSeries=getTimeSeries(w)
+        pulseList=[(resolvePulse(
+                    timeSeries,int(pos*w.shape[1]/nSearchBins),
+                    binWidth=binWidth,searchRadius=searchRes),height) 
+                   for (pos,height) in pulseList]
+    return pulseList
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1]=='subints':
+        # Search each subintegration of each foldspec separately
+        if len(sys.argv) < 3:
+            print "Usage: %s subints foldspec1 foldspec2 ..." % sys.argv[0]
+            sys.exit(1)
+        for iFile in sys.argv[2:]:
+            if not 'foldspec' in os.path.basename(iFile):
+                print "Error, not a foldspec: "+iFile
+                continue
+            binWidth=getDeltaT(iFile)/np.load(iFile,mmap_mode='r').shape[2]
+            startTime=getStartTime(iFile)
+            candidates=findSubintPulses(iFile,threshold=threshold)
+            print "\n"+str(len(candidates))+" pulses in "+iFile+":\n"
+            for j,(k,index,height) in enumerate(candidates):
+                print str(j+1)+'.\tSubint = '+str(k)+'\tIndex = '+str(index)
+                print '\tTime = '+str(getTime(index,binWidth,startTime).iso)
+                print '\tPeak pulse height = '+str(round(height,1))+\
+                    ' sigma\n'
+        sys.exit(0)
+
     # Load files
     w,runInfo=loadFiles(sys.argv[1:])
 
@@ -5,10 +5,9 @@ import numpy as np
 import matplotlib.pylab as plt
 import pulsarAnalysis.GPs.pulseFinder as pf
 import pulsarAnalysis.GPs.pulseSpec as ps
+from pulsarAnalysis.GPs import stokes,spectralStats
 from math import factorial
 import warnings
-from scipy.special import erfc
-from scipy.optimize import curve_fit
 from scipy.interpolate import lagrange
 # Resolution to use for searching in seconds. Must be larger than or
 # equal to phase bin size.
@@ -19,11 +18,6 @@ pulseWidth=0.0001 # 100 microseconds
 leadWidth=0.0005
 trailWidth=0.0015
 
-def expModGauss(x,sigma):
-    mu=0.0
-    gamma=1.0
-    return (gamma/2.)*np.exp((gamma/2)*(2*mu+gamma*sigma*sigma-2*x))*erfc((mu+gamma*sigma*sigma-x)/(np.sqrt(2)*sigma))
-
 def getPeak(x,w):
     assert len(x)==3
     assert len(w)==3
@@ -73,10 +67,7 @@ if __name__ == "__main__":
     dynamicSpec=ps.dynSpec(w,indices=pulseRange,normChan=False)
     dynamicSpec_BG=ps.dynSpec(w,indices=offRange,normChan=False)
 
-    if w.shape[-1]==4:
-        profile=dynamicSpec[:,:,(0,3)].sum(0).sum(-1)
-    else:
-        profile=dynamicSpec.sum(0)
+    profile=stokes.getIntensity(dynamicSpec).sum(0)
     pulseBins=sorted(range(len(pulseRange)),key=lambda x: profile[x],
                       reverse=True)[:nPulseBins]
 
@@ -116,97 +107,48 @@ if __name__ == "__main__":
         plt.xlabel('Frequency (MHz)')
         plt.show()
         
-    # Plot histogram of spectral noise
+    # Plot histogram of spectral noise, fitting all polarizations at once
     if spec.shape[-1]==4:
-        # Normalize intensity
-        spec1=spec[:,0]/np.mean(spec[:,0])
-        spec2=spec[:,3]/np.mean(spec[:,3])
-                               
-        # Plot histograms and plot if lmfit is found
-        xmin=min(min(spec2),min(spec1))
-        xmax=max(max(spec2),max(spec1))
-        
-        bins=np.linspace(np.floor(xmin),np.ceil(xmax),50)
-        x_fine=np.linspace(np.floor(xmin),np.ceil(xmax),1000)
-
-        f,(ax1,ax2) = plt.subplots(1,2,sharex='col',sharey='row')
-        specHist1=ax1.hist(spec1,normed=True,bins=bins,label='Data')
-        binCenters=np.array([(bins[i+1]+bins[i])/2. for i in range(len(bins)-1)
-                             if not(specHist1[0][i]==0)])
-        binEntries=np.array([i for i in specHist1[0] if not i==0])
-
-        # Plot exponentially modified gaussian with parameters
-        # estimated via fitting, and direct parameter estimation
-        normFactor1=(bins[1]-bins[0])*len(spec1)
-        weights=np.power(binEntries*normFactor1,0.5)/normFactor1
-        popt,pcov=curve_fit(expModGauss,binCenters,binEntries,
-                            sigma=weights,p0=0.1)
-        print "Polarization 0"
-        if np.std(spec1)>1.0:
-            ax1.plot(x_fine,expModGauss(x_fine,np.sqrt(np.var(spec1)-1.0)),label='Estimated')
-            print "Estimated sigma: "+str(np.sqrt(np.var(spec1)-1.0))
-        if popt[0]>0.0:
-            ax1.plot(x_fine,expModGauss(x_fine,popt[0]),label='Fitted')
-            print "Fitted sigma: "+str(popt[0])
-        
-        ax1.legend()
-        ax1.set_xlim(min(bins),max(bins))
-        ax1.set_xlabel("Intensity")
-        ax1.set_title('Polarization 0')
-        specHist2=ax2.hist(spec2,normed=True,bins=bins,label='Data')
-        binCenters=np.array([(bins[i+1]+bins[i])/2. for i in range(len(bins)-1)
-                             if not(specHist2[0][i]==0)])
-        binEntries=np.array([i for i in specHist2[0] if not i==0])
-        # Plot exponentially modified gaussian with parameters
-        # estimated via fitting, and direct parameter estimation
-        normFactor2=(bins[1]-bins[0])*len(spec2)
-        weights=np.power(binEntries*normFactor2,0.5)*len(spec2)
-        popt,pcov=curve_fit(expModGauss,binCenters,binEntries,
-                            sigma=weights,p0=0.1)
-        print "\nPolarization 3"
-        if np.std(spec2)>1.0:
-            ax2.plot(x_fine,expModGauss(x_fine,np.sqrt(np.var(spec2)-1.0)),label='Estimated')
-            print "Estimated sigma: "+str(np.sqrt(np.var(spec2)-1.0))
-        if popt[0]>0.0:
-            ax2.plot(x_fine,expModGauss(x_fine,popt[0]),label='Fitted')
-            print "Fitted sigma: "+str(popt[0])
-        
-        ax2.legend()
-        ax2.set_title('Polarization 3')
-        ax2.set_xlim(min(bins),max(bins))
-        ax2.set_xlabel("Intensity")
-        plt.show()
+        pols=[0,3]
+        specNorm=spec[:,pols].T
     else:
-        # Normalize intensity
-        specNorm=spec/np.mean(spec)
+        pols=[None]
+        specNorm=spec[np.newaxis,:]
+    specNorm=specNorm/np.mean(specNorm,axis=1)[:,np.newaxis]
+
+    bins=np.linspace(np.floor(np.amin(specNorm)),np.ceil(np.amax(specNorm)),50)
+    x_fine=np.linspace(np.floor(np.amin(specNorm)),np.ceil(np.amax(specNorm)),
+                       1000)
+    specHist,counts=spectralStats.histogram(specNorm,bins)
+    estimates=spectralStats.estimateSigma(specNorm)
+    fits,fitErrors=spectralStats.fitSigma(specNorm,bins)
+
+    f,axes=plt.subplots(1,len(pols),sharex='col',sharey='row',squeeze=False)
+    for i,ax in enumerate(axes.flat):
+        ax.bar(bins[:-1],specHist[i],width=np.diff(bins),align='edge',
+               label='Data')
 
-        # Plot histograms and fit if lmfit is found
-        xmin=min(specNorm)
-        xmax=max(specNorm)
-        
-        bins=np.linspace(np.floor(xmin),np.ceil(xmax),50)
-        x_fine=np.linspace(np.floor(xmin),np.ceil(xmax),1000)
-        specHist=plt.hist(specNorm,normed=True,bins=bins,label='Data')
-        binCenters=np.array([(bins[i+1]+bins[i])/2. for i in range(len(bins)-1) if not(specHist[0][i]==0)])
-        binEntries=np.array([i for i in specHist[0] if not i==0])
         # Plot exponentially modified gaussian with parameters
         # estimated via fitting, and direct parameter estimation
-        normFactor=(bins[1]-bins[0])*len(spec)
-        weights=np.power(binEntries*normFactor,0.5)*len(spec)
-        popt,pcov=curve_fit(expModGauss,binCenters,binEntries,
-                            sigma=weights,p0=0.1)
-        if np.std(spec)>1.0:
-            plt.plot(x_fine,expModGauss(x_fine,np.sqrt(np.var(spec)-1.0)),label='Estimated')
-            print "Estimated sigma: "+str(np.sqrt(np.var(spec)-1.0))
-        if popt[0]>0.0:
-            plt.plot(x_fine,expModGauss(x_fine,popt[0]),label='Fitted')
-            print "Fitted sigma: "+str(popt[0])
-        plt.legend()
-        plt.yscale('log')
-        plt.xlim(min(bins),max(bins))
-        plt.xlabel("Intensity")
-        plt.show()
-
+        if pols[i] is not None:
+            print "\nPolarization "+str(pols[i])
+        if estimates[i]>0.0:
+            ax.plot(x_fine,spectralStats.expModGauss(x_fine,estimates[i]),
+                    label='Estimated')
+            print "Estimated sigma: "+str(estimates[i])
+        if fits[i]>0.0:
+            ax.plot(x_fine,spectralStats.expModGauss(x_fine,fits[i]),
+                    label='Fitted')
+            print "Fitted sigma: "+str(fits[i])+" +/- "+str(fitErrors[i])
+
+        ax.legend()
+        ax.set_xlim(min(bins),max(bins))
+        ax.set_xlabel("Intensity")
+        if pols[i] is None:
+            ax.set_yscale('log')
+        else:
+            ax.set_title('Polarization '+str(pols[i]))
+    plt.show()
 
     # Plot fourier transforms of spectra
     if spec.shape[-1]==4:
@@ -5,6 +5,8 @@ import numpy as np
 import matplotlib.pylab as plt
 import pulsarAnalysis.GPs.pulseFinder as pf
 import pulsarAnalysis.GPs.pulseSpec as ps
+import pulsarAnalysis.GPs.polDelay as polDelay
+from pulsarAnalysis.GPs import stokes
 
 # Time to display before pulse peak in seconds
 leadWidth=0.0005
@@ -32,9 +34,9 @@ if __name__ == "__main__":
     # Rebin to find giant pulses, then resolve pulses with finer binning
     nSearchBins=min(w.shape[1],int(round(deltat/searchRes)))
     
-    w_rebin=pf.rebin(w,nSearchBins)
-    timeSeries_rebin=pf.getTimeSeries(w_rebin)
-    timeSeries=pf.getTimeSeries(w)
+    intensity=stokes.getIntensity(w,pf.pol_select)
+    timeSeries_rebin=pf.getTimeSeries(pf.rebin(intensity,nSearchBins))
+    timeSeries=pf.getTimeSeries(intensity)
     pulseList=pf.getPulses(timeSeries_rebin,binWidth=searchRes)
     if nSearchBins<w.shape[1]:
         pulseList=[(pf.resolvePulse(
@@ -67,22 +69,24 @@ if __name__ == "__main__":
     # Plot profiles
     timeList=[(i-largestPulse)*binWidth*1e6 for i in pulseRange]
     if profile.shape[-1]==4:
+        profileStokes=stokes.Stokes(profile)
+        profileStokes.compute()
         f,((ax1,ax2),(ax3,ax4)) = plt.subplots(2,2,sharex='col',sharey='row')
-        ax1.plot(timeList,profile[:,0])
+        ax1.plot(timeList,profileStokes.I)
         ax1.set_ylabel('Intensity')
-        ax1.set_title('Polarization 0')
+        ax1.set_title('Stokes I')
 
-        ax2.plot(timeList,profile[:,3])
-        ax2.set_title('Polarization 3')
+        ax2.plot(timeList,profileStokes.V)
+        ax2.set_title('Stokes V')
 
-        ax3.plot(timeList,profile[:,1])
+        ax3.plot(timeList,profileStokes.Q)
         ax3.set_xlabel('Time (microseconds)')
         ax3.set_ylabel('Intensity')
-        ax3.set_title('Polarization 1') 
+        ax3.set_title('Stokes Q') 
 
-        ax4.plot(timeList,profile[:,2])
+        ax4.plot(timeList,profileStokes.U)
         ax4.set_xlabel('Time (microseconds)')
-        ax4.set_title('Polarization 2')
+        ax4.set_title('Stokes U')
 
         plt.suptitle('Profiles',size=16)
         plt.show()
@@ -96,37 +100,19 @@ if __name__ == "__main__":
     
     if w.shape[-1]==4:
         # Calculate and plot correlation between polarizations
-        normProfile0=(profile[:,0]-np.mean(profile[:,0]))/np.std(profile[:,0])
-        normProfile3=(profile[:,3]-np.mean(profile[:,3]))/np.std(profile[:,3])
-
-        #corr=np.correlate(profile[:,0],profile[:,3],mode='same')
-        corr=np.correlate(normProfile0,normProfile3,mode='same')
-        corr_x=np.arange(-(len(corr)-1)/2,(len(corr)-1)/2+1)
-        corr=np.array([icorr/(profile.shape[0]-abs(corr_x[i])) 
-                       for i,icorr in enumerate(corr)])
-        corr_time=binWidth*corr_x*1e6
-        sortedCorr=sorted(corr,reverse=True)
-        if sortedCorr[0]-sortedCorr[1]<0.05:
-            fitRange=np.arange(np.argmax(corr)-int(0.00002/binWidth),
-                               np.argmax(corr)+int(0.00002/binWidth))
-            fitParams=np.polyfit(corr_time[fitRange],corr[fitRange],2)
-
-            fit=[fitParams[2]+fitParams[1]*i+fitParams[0]*i*i 
-                 for i in corr_time[fitRange]]
-            delay=fitParams[1]/2/fitParams[0]*1e3
-        else:
-            delay=-corr_time[np.argmax(corr)]*1e3
-            
+        lags,corr=polDelay.crossCorrelate(profile[np.newaxis,:,0],
+                                          profile[np.newaxis,:,3])
+        corr=corr[0]
+        corr_time=binWidth*lags*1e6
+        delays,errors,peaks=polDelay.getDelays(profile[np.newaxis],binWidth)
+
         print "Offset (R-L): "
-        print "\t"+str(-delay)+ " ns ~=",
-        print str(-int(round(delay/60.)))+' bytes ~=',
-        print str(int(round(-299792458*delay*1e-9)))+' m / c.'
+        polDelay.printOffset(delays[0],errors[0])
 
         plt.figure()
         plt.xlim(min(corr_time),max(corr_time))
         plt.plot(corr_time,corr)
-        if sortedCorr[0]-sortedCorr[1]<0.05:
-            plt.plot(corr_time[fitRange],fit)
+        plt.axvline(delays[0]*1e6,color='k',linestyle='--')
         plt.ylim(-0.2,1.0)
         plt.ylabel('Correlation')
         plt.xlabel('Time Offset (microseconds)')
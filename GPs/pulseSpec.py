@@ -4,6 +4,7 @@ import sys
 import numpy as np
 import matplotlib.pylab as plt
 import pulsarAnalysis.GPs.pulseFinder as pf
+from pulsarAnalysis.GPs import stokes
 
 # Time to display before pulse peak in seconds
 leadWidth=0.0005
@@ -24,11 +25,9 @@ def dynSpec(w,indices=None,normChan=False):
     if indices==None:
         indices=range(w.shape[1])
 
-    if w.shape[-1]==4:
-        Tsys=w[:,:,(0,3)].sum(-1).mean()
-    else:
-        Tsys=w.mean()
-    n=w[:,indices,...]/Tsys
+    # Average in float64, keeping the type of 'w'
+    Tsys=stokes.getIntensity(w).mean(dtype=np.float64)
+    n=w[:,indices,...]/w.dtype.type(Tsys)
 
     # Normalize flux by noise in each frequency bin
     if normChan:        
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+import pulsarAnalysis.GPs.pulseCatalog as pc
+from pulsarAnalysis.GPs import stokes,spectralStats
+
+# Widest boxcar (in bins) tried by the matched filter used to seed fits
+maxBoxcar=64
+
+# Levenberg-Marquardt iterations, and the fractional change in chi
+# squared at which a fit is taken to have converged
+maxIter=100
+tolerance=1e-8
+
+# Parameter order: amplitude (area), centre of the gaussian, and the
+# logarithms of the gaussian width and the scattering time, all in bins
+paramNames=('area','centre','width','tau')
+
+def getProfiles(pulses,backgrounds):
+    # Background subtracted intensity profiles, with axes (pulse,
+    # time), of stacked cut-outs (see cutouts.py), and the rms noise of
+    # each profile measured in its background window
+
+    bg=stokes.getIntensity(backgrounds)
+    bgMean=np.nanmean(bg,axis=2,dtype=np.float64)[:,:,np.newaxis]
+    profiles=np.nansum(stokes.getIntensity(pulses)-bgMean,axis=1)
+    noise=np.nanstd(np.nansum(bg-bgMean,axis=1),axis=1)
+    return profiles,noise
+
+def model(t,params):
+    # Gaussian convolved with a one-sided exponential, for each row of
+    # 'params' (see paramNames), at times 't' in bins
+
+    area=params[:,0:1]
+    centre=params[:,1:2]
+    width=np.exp(params[:,2:3])
+    tau=np.exp(params[:,3:4])
+    return area/tau*spectralStats.expModGauss((t-centre)/tau,width/tau)
+
+def matchedFilter(profiles,noise,maxBoxcar=maxBoxcar):
+    # Finds the boxcar width (bins) and start giving the highest
+    # signal-to-noise for each profile, using cumulative sums. Returns
+    # widths, starts and signal-to-noise.
+
+    nBins=profiles.shape[1]
+    cumsum=np.concatenate((np.zeros((len(profiles),1)),
+                           np.cumsum(np.nan_to_num(profiles),axis=1)),axis=1)
+    bestSNR=np.empty(len(profiles))
+    bestSNR.fill(-np.inf)
+    bestWidth=np.ones(len(profiles),dtype=int)
+    bestStart=np.zeros(len(profiles),dtype=int)
+    for width in range(1,min(maxBoxcar,nBins)+1):
+        snr=(cumsum[:,width:]-cumsum[:,:-width])/np.sqrt(width)/ \
+            noise[:,np.newaxis]
+        start=np.argmax(snr,axis=1)
+        snr=snr[np.arange(len(snr)),start]
+        better=snr>bestSNR
+        bestSNR[better]=snr[better]
+        bestWidth[better]=width
+        bestStart[better]=start[better]
+    return bestWidth,bestStart,bestSNR
+
+def getJacobian(t,params,f,step=1e-6):
+    # Forward difference Jacobian of 'model' for all rows at once, with
+    # axes (pulse, time, parameter)
+
+    J=np.empty(f.shape+(params.shape[1],))
+    for i in range(params.shape[1]):
+        h=step*np.maximum(np.abs(params[:,i]),1.)
+        shifted=params.copy()
+        shifted[:,i]+=h
+        J[...,i]=(model(t,shifted)-f)/h[:,np.newaxis]
+    return J
+
+def fitProfiles(profiles,noise,maxIter=maxIter):
+    # Fits 'model' to each profile by Levenberg-Marquardt, with all
+    # profiles solved together. Fits are seeded from the matched filter
+    # width. Returns the parameters (see paramNames, with the widths no
+    # longer logarithms), their uncertainties and the reduced chi
+    # squared of each fit, with nan where a fit fails.
+
+    nPulses,nBins=profiles.shape
+    t=np.arange(nBins)[np.newaxis,:]
+    y=np.nan_to_num(profiles)
+    weight=1/noise[:,np.newaxis]**2
+
+    # Seed from the best boxcar
+    width,start,snr=matchedFilter(profiles,noise)
+    rows=np.arange(nPulses)
+    cumsum=np.concatenate((np.zeros((nPulses,1)),np.cumsum(y,axis=1)),axis=1)
+    params=np.empty((nPulses,4))
+    params[:,0]=cumsum[rows,start+width]-cumsum[rows,start]
+    params[:,1]=start+0.25*width
+    params[:,2]=np.log(np.maximum(0.3*width,0.5))
+    params[:,3]=np.log(np.maximum(0.5*width,0.5))
+
+    f=model(t,params)
+    chi2=(weight*(y-f)**2).sum(1)
+    damping=np.ones(nPulses)*1e-3
+    active=np.ones(nPulses,dtype=bool)
+    for iteration in range(maxIter):
+        idx=np.flatnonzero(active)
+        if len(idx)==0:
+            break
+        p=params[idx]
+        J=getJacobian(t,p,f[idx])
+        w=weight[idx][:,:,np.newaxis]
+        JTJ=np.einsum('ntp,ntq->npq',J*w,J)
+        JTr=np.einsum('ntp,nt->np',J*w,y[idx]-f[idx])
+        diag=np.einsum('npp->np',JTJ)
+        A=JTJ+damping[idx][:,np.newaxis,np.newaxis]*np.einsum(
+            'np,pq->npq',diag,np.eye(4))
+        try:
+            delta=np.linalg.solve(A,JTr[...,np.newaxis])[...,0]
+        except np.linalg.LinAlgError:
+            delta=np.array([np.linalg.lstsq(A[i],JTr[i],rcond=None)[0]
+                            for i in range(len(idx))])
+        # Limit steps in the logarithmic widths to a factor of e**2
+        delta[:,2:]=np.clip(delta[:,2:],-2.,2.)
+        trial=p+delta
+        with np.errstate(over='ignore',invalid='ignore',divide='ignore'):
+            fTrial=model(t,trial)
+            chi2Trial=(weight[idx]*(y[idx]-fTrial)**2).sum(1)
+
+        better=np.isfinite(chi2Trial)&(chi2Trial<chi2[idx])
+        change=np.where(better,(chi2[idx]-chi2Trial)/chi2[idx],0.)
+        params[idx[better]]=trial[better]
+        f[idx[better]]=fTrial[better]
+        chi2[idx[better]]=chi2Trial[better]
+        damping[idx]=np.where(better,damping[idx]/10.,damping[idx]*10.)
+        active[idx[(better&(change<tolerance))|(damping[idx]>1e10)]]=False
+
+    # Uncertainties from the covariance of the final fit
+    J=getJacobian(t,params,f)
+    JTJ=np.einsum('ntp,ntq->npq',J*weight[:,:,np.newaxis],J)
+    errors=np.empty((nPulses,4))
+    errors.fill(np.nan)
+    for i in range(nPulses):
+        try:
+            variance=np.diag(np.linalg.inv(JTJ[i]))
+        except np.linalg.LinAlgError:
+            continue
+        if (variance>0).all():
+            errors[i]=np.sqrt(variance)
+
+    # Convert the logarithmic widths
+    params[:,2:]=np.exp(params[:,2:])
+    errors[:,2:]*=params[:,2:]
+    redChi2=chi2/max(nBins-4,1)
+    failed=~np.isfinite(errors).all(1)
+    params[failed]=np.nan
+    return params,errors,redChi2
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: %s cutouts.npz" % sys.argv[0]
+        # Run the code as eg: ./scattering.py cutouts.npz, with
+        # cut-outs made by cutouts.py
+        sys.exit(1)
+    data=np.load(sys.argv[1])
+    catalog=data['catalog']
+    profiles,noise=getProfiles(data['pulses'],data['backgrounds'])
+    params,errors,redChi2=fitProfiles(profiles,noise)
+    binWidth=catalog['binWidth']
+
+    times=pc.getTimes(catalog)
+    print "\nScattering fits of "+str(len(catalog))+" pulses:\n"
+    for i in range(len(catalog)):
+        print str(i+1)+'.\t'+catalog['telescope'][i]+'\t'+times[i].iso
+        print '\tWidth = '+str(params[i,2]*binWidth[i]*1e6)+' +/- '+\
+            str(errors[i,2]*binWidth[i]*1e6)+' microseconds'
+        print '\tTau = '+str(params[i,3]*binWidth[i]*1e6)+' +/- '+\
+            str(errors[i,3]*binWidth[i]*1e6)+' microseconds'
+        print '\tReduced chi squared = '+str(round(redChi2[i],2))+'\n'
+    print "Median tau: ", np.nanmedian(params[:,3]*binWidth)*1e6, \
+        "microseconds"
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+from pulsarAnalysis.Misc import fftTools
+import pulsarAnalysis.GPs.pulseFinder as pf
+import pulsarAnalysis.GPs.pulseCatalog as pc
+from pulsarAnalysis.GPs import stokes
+
+# Widths are fitted to the lags around zero where the ACF stays above
+# this fraction of its value at the first lag
+fitFloor=0.2
+
+def getDynamicSpectra(pulses,backgrounds):
+    # Background subtracted intensity dynamic spectra, with axes
+    # (pulse, frequency, time), of stacked cut-outs (see cutouts.py)
+
+    bg=np.nanmean(stokes.getIntensity(backgrounds),axis=2,dtype=np.float64)
+    return stokes.getIntensity(pulses)-bg[:,:,np.newaxis]
+
+def _autocorrelate(x,nF,nT):
+    # Circular 2-D autocorrelation of each (frequency, time) plane of
+    # 'x', zero padded to (nF, nT)
+
+    spec=fftTools.fft(fftTools.rfft(x,n=nT,axis=2),n=nF,axis=1)
+    power=spec.real**2+spec.imag**2
+    return fftTools.irfft(fftTools.ifft(power,axis=1),n=nT,axis=2)
+
+def _centre(acf,nChan,nBins):
+    # Rearranges lags to run from -(n-1) to n-1 along each axis. The
+    # negative lags start at n-1 from the end of the padded axis, so
+    # none are taken when n is 1.
+
+    nF,nT=acf.shape[1:]
+    acf=np.concatenate((acf[:,nF-nChan+1:,:],acf[:,:nChan,:]),axis=1)
+    return np.concatenate((acf[:,:,nT-nBins+1:],acf[:,:,:nBins]),axis=2)
+
+def getACF(dyn):
+    # 2-D autocorrelation functions of dynamic spectra 'dyn' (axes
+    # pulse, frequency, time), found with zero padded real FFTs of all
+    # pulses at once. Nan values are left out, and each lag is
+    # normalized by the number of overlapping values. Returns the
+    # frequency lags and time lags (in bins) and the ACFs, with axes
+    # (pulse, frequency lag, time lag).
+
+    nPulses,nChan,nBins=dyn.shape
+    mask=~np.isnan(dyn)
+    counts=mask.sum(2).sum(1)
+    mean=np.where(mask,dyn,0.).sum(2).sum(1)/np.maximum(counts,1)
+    dyn=np.where(mask,dyn-mean[:,np.newaxis,np.newaxis],0.)
+
+    nF=fftTools.nextFastLen(2*nChan-1)
+    nT=fftTools.nextFastLen(2*nBins-1)
+    acf=_centre(_autocorrelate(dyn,nF,nT),nChan,nBins)
+    overlap=np.rint(_centre(_autocorrelate(mask.astype(np.float64),nF,nT),
+                            nChan,nBins))
+    acf=np.where(overlap>0,acf/np.maximum(overlap,1),np.nan)
+    return np.arange(-nChan+1,nChan),np.arange(-nBins+1,nBins),acf
+
+def fitWidths(lags,acf,model='lorentzian'):
+    # Fits the half width of each row of 'acf' at positive 'lags',
+    # leaving out the zero lag, which holds the noise. Fits
+    # A/(1+(x/w)^2) ('lorentzian', half width at half maximum) or
+    # A*exp(-(x/w)^2) ('gaussian', half width at 1/e) to all rows at
+    # once, as straight lines in x^2. Returns nan where no width can
+    # be fitted.
+
+    positive=lags>0
+    x2=(lags[positive]**2).astype(np.float64)
+    y=acf[:,positive]
+
+    # Use the lags before the ACF first drops below 'fitFloor' of its
+    # value at the first lag
+    above=y>fitFloor*y[:,:1]
+    use=np.cumprod(above,axis=1).astype(bool)&(y>0)
+    if model=='lorentzian':
+        z=np.where(use,1/np.where(use,y,1.),0.)
+    else:
+        z=np.where(use,np.log(np.where(use,y,1.)),0.)
+
+    # Least squares line z = a + b*x^2 for each row
+    n=use.sum(1).astype(np.float64)
+    sx=(use*x2).sum(1)
+    sxx=(use*x2*x2).sum(1)
+    sz=z.sum(1)
+    sxz=(z*x2).sum(1)
+    denom=n*sxx-sx*sx
+    with np.errstate(divide='ignore',invalid='ignore'):
+        b=(n*sxz-sx*sz)/denom
+        a=(sz-b*sx)/n
+        if model=='lorentzian':
+            widths=np.sqrt(a/b)
+        else:
+            widths=np.sqrt(-1/b)
+    widths[(n<2)|~np.isfinite(widths)]=np.nan
+    return widths
+
+def getScintillation(dyn,chanWidth,binWidth):
+    # Scintillation bandwidth (Lorentzian half width at half maximum of
+    # the frequency ACF, in MHz) and timescale (Gaussian half width at
+    # 1/e of the time ACF, in s) of each dynamic spectrum in 'dyn'.
+    # 'chanWidth' and 'binWidth' are single values or one per pulse.
+
+    freqLags,timeLags,acf=getACF(dyn)
+    zeroF=len(freqLags)//2
+    zeroT=len(timeLags)//2
+    bandwidths=fitWidths(freqLags,acf[:,:,zeroT],'lorentzian')*chanWidth
+    timescales=fitWidths(timeLags,acf[:,zeroF,:],'gaussian')*binWidth
+    return bandwidths,timescales
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: %s cutouts.npz" % sys.argv[0]
+        # Run the code as eg: ./scintillation.py cutouts.npz, with
+        # cut-outs made by cutouts.py
+        sys.exit(1)
+    data=np.load(sys.argv[1])
+    catalog=data['catalog']
+    dyn=getDynamicSpectra(data['pulses'],data['backgrounds'])
+    freqBands=np.array([pf.getFrequencyBand(i)
+                        for i in catalog['telescope']]).reshape((-1,2))
+    chanWidth=(freqBands[:,1]-freqBands[:,0])/dyn.shape[1]
+    bandwidths,timescales=getScintillation(dyn,chanWidth,
+                                           catalog['binWidth'])
+
+    times=pc.getTimes(catalog)
+    print "\nScintillation of "+str(len(catalog))+" pulses:\n"
+    for i in range(len(catalog)):
+        print str(i+1)+'.\t'+catalog['telescope'][i]+'\t'+times[i].iso
+        print '\tBandwidth = '+str(bandwidths[i]*1e3)+' kHz'
+        print '\tTimescale = '+str(timescales[i]*1e6)+' microseconds\n'
+    print "Median bandwidth: ", np.nanmedian(bandwidths)*1e3, "kHz"
+    print "Median timescale: ", np.nanmedian(timescales)*1e6, "microseconds"
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+from scipy.special import erfc,erfcx
+import pulsarAnalysis.GPs.pulseCatalog as pc
+
+# Number of histogram bins used for fitting
+nHistBins=50
+
+# Gauss-Newton iterations and the fractional change in sigma at which
+# a fit is taken to have converged
+maxIter=50
+tolerance=1e-6
+
+def expModGauss(x,sigma):
+    # Exponentially modified gaussian with mean 0 and unit rate.
+    # Written with the scaled complementary error function where its
+    # argument is positive, so that neither form overflows. Broadcasts
+    # over 'x' and 'sigma'.
+
+    x,sigma=np.broadcast_arrays(x,sigma)
+    z=(sigma*sigma-x)/(np.sqrt(2)*sigma)
+    pos=z>=0
+    f=np.empty(z.shape)
+    f[pos]=0.5*np.exp(-0.5*x[pos]**2/sigma[pos]**2)*erfcx(z[pos])
+    f[~pos]=0.5*np.exp(0.5*sigma[~pos]**2-x[~pos])*erfc(z[~pos])
+    return f
+
+def expModGaussDeriv(x,sigma):
+    # Derivative of expModGauss with respect to sigma
+
+    x,sigma=np.broadcast_arrays(x,sigma)
+    z=(sigma*sigma-x)/(np.sqrt(2)*sigma)
+    dz=(1+x/(sigma*sigma))/np.sqrt(2)
+    pos=z>=0
+    d=np.empty(z.shape)
+    xp,sp,zp=x[pos],sigma[pos],z[pos]
+    d[pos]=0.5*np.exp(-0.5*xp*xp/(sp*sp))*(xp*xp/sp**3*erfcx(zp)+
+           (2*zp*erfcx(zp)-2/np.sqrt(np.pi))*dz[pos])
+    xn,sn,zn=x[~pos],sigma[~pos],z[~pos]
+    d[~pos]=0.5*np.exp(0.5*sn*sn-xn)*(sn*erfc(zn)-
+            2/np.sqrt(np.pi)*np.exp(-zn*zn)*dz[~pos])
+    return d
+
+def getBins(spectra,nBins=nHistBins):
+    # Common histogram bin edges for all rows of 'spectra'
+
+    return np.linspace(np.floor(np.nanmin(spectra)),
+                       np.ceil(np.nanmax(spectra)),nBins)
+
+def histogram(spectra,bins):
+    # Normalized histograms of each row of 'spectra' over 'bins', found
+    # for all rows at once with one np.bincount. As for np.histogram,
+    # the last bin includes its upper edge. Returns the densities and
+    # counts, with axes (row, bin).
+
+    nRows=spectra.shape[0]
+    nBins=len(bins)-1
+    index=np.searchsorted(bins,spectra,side='right')-1
+    index[spectra==bins[-1]]=nBins-1
+    valid=(index>=0)&(index<nBins)&~np.isnan(spectra)
+    rows=np.repeat(np.arange(nRows)[:,np.newaxis],spectra.shape[1],axis=1)
+    counts=np.bincount((rows*nBins+index)[valid],minlength=nRows*nBins)
+    counts=counts.reshape(nRows,nBins).astype(np.float64)
+    total=np.maximum(counts.sum(1),1)[:,np.newaxis]
+    return counts/total/np.diff(bins),counts
+
+def estimateSigma(spectra):
+    # Direct estimate of sigma from the variance of each row of
+    # 'spectra' (normalized to unit mean). Nan where the variance is
+    # below 1.
+
+    var=np.nanvar(spectra,axis=1)
+    sigma=np.empty(len(var))
+    sigma.fill(np.nan)
+    sigma[var>1]=np.sqrt(var[var>1]-1)
+    return sigma
+
+def fitSigma(spectra,bins=None,p0=0.1):
+    # Fits expModGauss to the histogram of each row of 'spectra'
+    # (normalized to unit mean) by weighted least squares, with all rows
+    # solved at once by Gauss-Newton iteration using the analytic
+    # derivative. Empty bins are left out and bins are weighted by their
+    # Poisson errors. Returns sigma and its uncertainty for each row,
+    # nan where the fit fails.
+
+    if bins is None:
+        bins=getBins(spectra)
+    density,counts=histogram(spectra,bins)
+    x=0.5*(bins[1:]+bins[:-1])[np.newaxis,:]
+    total=counts.sum(1)[:,np.newaxis]*np.diff(bins)[np.newaxis,:]
+    weights=np.where(counts>0,total*total/np.maximum(counts,1),0.)
+
+    # Start from the direct estimate where there is one
+    sigma=estimateSigma(spectra)
+    sigma[~(sigma>0)]=p0
+    active=np.ones(len(sigma),dtype=bool)
+    for i in range(maxIter):
+        s=sigma[active][:,np.newaxis]
+        w=weights[active]
+        r=density[active]-expModGauss(x,s)
+        J=expModGaussDeriv(x,s)
+        step=(w*J*r).sum(1)/np.maximum((w*J*J).sum(1),1e-300)
+        newSigma=np.maximum(s[:,0]+step,0.5*s[:,0])
+        converged=np.abs(newSigma-s[:,0])<=tolerance*s[:,0]
+        sigma[active]=newSigma
+        active[np.flatnonzero(active)[converged]]=False
+        if not active.any():
+            break
+
+    s=sigma[:,np.newaxis]
+    J=expModGaussDeriv(x,s)
+    with np.errstate(divide='ignore'):
+        errors=1/np.sqrt((weights*J*J).sum(1))
+    failed=active|~np.isfinite(errors)
+    sigma[failed]=np.nan
+    errors[failed]=np.nan
+    return sigma,errors
+
+def getSpectra(pulses,backgrounds,pols=(0,3)):
+    # Background subtracted spectra of polarizations 'pols' of stacked
+    # cut-outs (see cutouts.py), normalized to unit mean, with axes
+    # (pulse, pol, frequency)
+
+    if pulses.shape[-1]!=4:
+        pulses=pulses[...,np.newaxis]
+        backgrounds=backgrounds[...,np.newaxis]
+        pols=(0,)
+    bg=np.nanmean(backgrounds[...,pols],axis=2,dtype=np.float64)
+    spec=np.nansum(pulses[...,pols],axis=2,dtype=np.float64)- \
+        bg*pulses.shape[2]
+    spec=np.swapaxes(spec,1,2)
+    return spec/np.nanmean(spec,axis=2)[...,np.newaxis]
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: %s cutouts.npz" % sys.argv[0]
+        # Run the code as eg: ./spectralStats.py cutouts.npz, with
+        # cut-outs made by cutouts.py
+        sys.exit(1)
+    data=np.load(sys.argv[1])
+    catalog=data['catalog']
+    spectra=getSpectra(data['pulses'],data['backgrounds'])
+    nPulses,nPols,nChan=spectra.shape
+    polList=(0,3) if nPols==2 else (0,)
+    sigma,errors=fitSigma(spectra.reshape(nPulses*nPols,nChan))
+    sigma=sigma.reshape(nPulses,nPols)
+    errors=errors.reshape(nPulses,nPols)
+
+    times=pc.getTimes(catalog)
+    print "\nFitted sigma of "+str(nPulses)+" pulses:\n"
+    for i in range(nPulses):
+        print str(i+1)+'.\t'+catalog['telescope'][i]+'\t'+times[i].iso
+        for j in range(nPols):
+            print '\tPolarization '+str(polList[j])+': '+str(round(sigma[i,j],3))+\
+                ' +/- '+str(round(errors[i,j],3))
+    print "\nMedian sigma: ", np.nanmedian(sigma,axis=0)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import multiprocessing
+import numpy as np
+from pulsarAnalysis.Misc import fftTools
+from pulsarAnalysis.Misc.delaySolver import refinePeak
+import pulsarAnalysis.GPs.pulseCatalog as pc
+import pulsarAnalysis.GPs.cutouts as cutouts
+from pulsarAnalysis.GPs import stokes
+
+# Largest distance in seconds that a pulse peak may be moved from its
+# catalog bin when aligning
+maxShift=0.0001
+
+# Number of processes to stack with
+nProcs=4
+
+class Stacker(object):
+    # Running sums and sums of squares of aligned dynamic spectra with
+    # axes (frequency, time[, pol]), kept in float64 with the number of
+    # values added at each point, so nan values are left out. Memory
+    # does not grow with the number of pulses, and stackers of the same
+    # shape built separately can be merged.
+
+    def __init__(self,shape):
+        self.shape=tuple(shape)
+        self.sum=np.zeros(self.shape)
+        self.sumSq=np.zeros(self.shape)
+        self.count=np.zeros(self.shape,dtype=np.int64)
+
+    def add(self,dyn):
+        if dyn.shape!=self.shape:
+            raise ValueError('dynamic spectrum of shape '+str(dyn.shape)+
+                             ', not '+str(self.shape))
+        valid=~np.isnan(dyn)
+        dyn=np.where(valid,dyn,0.).astype(np.float64)
+        self.sum+=dyn
+        self.sumSq+=dyn*dyn
+        self.count+=valid
+
+    def merge(self,other):
+        if other.shape!=self.shape:
+            raise ValueError('cannot merge stacks of shape '+
+                             str(other.shape)+' and '+str(self.shape))
+        self.sum+=other.sum
+        self.sumSq+=other.sumSq
+        self.count+=other.count
+        return self
+
+    def mean(self):
+        with np.errstate(invalid='ignore',divide='ignore'):
+            return np.where(self.count>0,self.sum/self.count,np.nan)
+
+    def variance(self):
+        # Unbiased variance of the pulses about the mean at each point
+        with np.errstate(invalid='ignore',divide='ignore'):
+            var=(self.sumSq-self.sum*self.sum/self.count)/(self.count-1)
+        return np.where(self.count>1,np.maximum(var,0),np.nan)
+
+    def error(self):
+        # Uncertainty of the mean at each point
+        with np.errstate(invalid='ignore',divide='ignore'):
+            return np.sqrt(self.variance()/self.count)
+
+    def save(self,path):
+        np.savez(path,sum=self.sum,sumSq=self.sumSq,count=self.count)
+
+def loadStack(path):
+    # Loads a stack saved with Stacker.save
+
+    data=np.load(path)
+    stack=Stacker(data['sum'].shape)
+    stack.sum[...]=data['sum']
+    stack.sumSq[...]=data['sumSq']
+    stack.count[...]=data['count']
+    return stack
+
+def mergeStacks(stacks):
+    # Merges a list of stackers into the first
+
+    stack=stacks[0]
+    for i in stacks[1:]:
+        stack.merge(i)
+    return stack
+
+def getPeak(pulse,background):
+    # Peak of the background subtracted intensity profile of a pulse
+    # window, in bins to below one bin
+
+    bg=np.nanmean(stokes.getIntensity(background),axis=1,dtype=np.float64)
+    profile=np.nansum(stokes.getIntensity(pulse)-bg[:,np.newaxis],axis=0)
+    k=np.array([np.argmax(profile)])
+    return k[0]+refinePeak(profile[np.newaxis,:],k)[0]
+
+def alignWindow(window,shift,start,nBins):
+    # Returns 'nBins' bins of 'window' (axes frequency, time[, pol])
+    # starting 'shift' bins after bin 'start'. The fractional part of
+    # the shift is applied with a phase ramp on the zero padded window,
+    # and bins that draw on nan values of 'window' are nan.
+
+    n=int(np.floor(shift))
+    frac=shift-n
+    mask=np.isnan(window)
+    window=np.where(mask,0.,window)
+    if frac!=0:
+        nFFT=fftTools.nextFastLen(2*window.shape[1])
+        omega=2*np.pi*np.arange(nFFT//2+1)/nFFT
+        ramp=np.exp(1j*omega*frac).reshape((1,-1)+(1,)*(window.ndim-2))
+        window=fftTools.irfft(fftTools.rfft(window,n=nFFT,axis=1)*ramp,
+                              n=nFFT,axis=1)[:,:window.shape[1],...]
+    aligned=window[:,start+n:start+n+nBins,...]
+    bad=mask[:,start+n:start+n+nBins,...]
+    if frac!=0:
+        bad=bad|mask[:,start+n+1:start+n+nBins+1,...]
+    return np.where(bad,np.nan,aligned)
+
+def stackPulses(catalog,dataDir,offsets=None,leadWidth=cutouts.leadWidth,
+                trailWidth=cutouts.trailWidth,maxShift=maxShift):
+    # Stacks the background subtracted pulse windows of all pulses in
+    # 'catalog' (see pulseCatalog) from their files (in 'dataDir' unless
+    # stored with absolute paths), reading one pulse at a time. Each
+    # pulse is aligned on the peak of its intensity profile, or on
+    # 'offsets' if given: bins after its catalog bin, as returned by
+    # toas.getCatalogOffsets (not the shifts relative to the template
+    # from toas.getOffsets). Pulses with a nan offset, or in files that
+    # cannot be opened, are left out. Pulses are read file by file so
+    # each file is opened once. Returns a Stacker.
+
+    stack=None
+    order=np.argsort(catalog['file'],kind='mergesort')
+    lastFile=None
+    for i in order:
+        if catalog['file'][i]!=lastFile:
+            lastFile=catalog['file'][i]
+            data=cutouts.tryOpenFile(os.path.join(dataDir,lastFile))
+        if data is None:
+            continue
+        if offsets is not None and not np.isfinite(offsets[i]):
+            continue
+        binWidth=catalog['binWidth'][i]
+        leadBins,trailBins=cutouts.getBins(binWidth,leadWidth,trailWidth)
+        pad=int(maxShift/binWidth)+1
+        index=catalog['index'][i]
+        window=cutouts.readWindow(data,index-2*leadBins-trailBins-pad,
+                                  index+trailBins+pad)
+        start=pad+leadBins+trailBins
+        background=window[:,pad:start,...]
+        if offsets is None:
+            shift=getPeak(window[:,start:start+leadBins+trailBins,...],
+                          background)-leadBins
+        else:
+            shift=offsets[i]
+        if abs(shift)>=pad:
+            print "Error, pulse peak too far from catalog bin in file:"
+            print lastFile
+            continue
+        bg=np.nanmean(background,axis=1,dtype=np.float64)[:,np.newaxis,...]
+        pulse=alignWindow(window-bg,shift,start,leadBins+trailBins)
+        if stack is None:
+            stack=Stacker(pulse.shape)
+        elif pulse.shape!=stack.shape:
+            print "Error, cut-out shape mismatch for pulse in file:"
+            print lastFile
+            continue
+        stack.add(pulse)
+    return stack
+
+def _stackPart(args):
+    return stackPulses(*args)
+
+def stackCatalog(catalog,dataDir,offsets=None,nProcs=nProcs):
+    # Stacks all pulses in 'catalog' with stackPulses in a process
+    # pool, splitting the catalog by file so that each file is read by
+    # one process, and merges the partial stacks
+
+    files=np.unique(catalog['file'])
+    jobs=[]
+    for part in np.array_split(files,min(nProcs,len(files))):
+        sel=np.isin(catalog['file'],part)
+        jobs.append((catalog[sel],dataDir,
+                     None if offsets is None else offsets[sel]))
+    pool=multiprocessing.Pool(len(jobs))
+    try:
+        partials=pool.map(_stackPart,jobs)
+    finally:
+        pool.close()
+        pool.join()
+    partials=[i for i in partials if i is not None]
+    if len(partials)==0:
+        return None
+    return mergeStacks(partials)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print "Usage: %s stack stack.npz catalog.npy dataDir" % sys.argv[0]
+        print "or"
+        print "%s merge stack.npz part1.npz part2.npz ..." % sys.argv[0]
+        # Run the code as eg: ./stacker.py stack stack.npz catalog.npy
+        # /data/session/
+        sys.exit(1)
+    mode=sys.argv[1]
+    outFile=sys.argv[2]
+
+    if mode=='stack':
+        catalog=pc.loadCatalog(sys.argv[3])
+        if len(catalog)==0:
+            print "Error, no pulses in catalog."
+            sys.exit(1)
+        print "Stacking "+str(len(catalog))+" pulses on",
+        print min(nProcs,len(np.unique(catalog['file']))), "workers..."
+        stack=stackCatalog(catalog,sys.argv[4])
+        if stack is None:
+            print "Error, no pulses could be stacked."
+            sys.exit(1)
+    elif mode=='merge':
+        stack=mergeStacks([loadStack(i) for i in sys.argv[3:]])
+    else:
+        print "Error, unrecognized mode: "+mode
+        sys.exit(1)
+    stack.save(outFile)
+    print "Saved to:"
+    print outFile
+    print "\tShape: ", stack.shape
+    print "\tPulses: ", stack.count.max()
@@ -0,0 +1,88 @@
+import numpy as np
+
+# Data with a polarization axis of length 4 holds the products (AA,
+# Re AB*, Im AB*, BB) of the two recorded polarizations A and B (see
+# Misc/channelize.py). 'basis' is 'circular' (A, B = R, L) or 'linear'
+# (A, B = X, Y).
+basis='circular'
+
+# Number of time bins computed at once when finding several Stokes
+# parameters in one pass
+chunkBins=2**14
+
+def getIntensity(w,pols=(0,3)):
+    # Sum of the products 'pols' of 'w' (total intensity by default) as
+    # a contiguous array, without the copy made by w[...,pols].sum(-1).
+    # Returns 'w' if it has no polarization axis.
+
+    if w.shape[-1]!=4:
+        return w
+    intensity=np.array(w[...,pols[0]])
+    for i in pols[1:]:
+        intensity+=w[...,i]
+    return intensity
+
+def getStokes(w,param,basis=None):
+    # Returns Stokes parameter 'param' ('I', 'Q', 'U' or 'V') of 'w'.
+    # Signs follow U = 2 Im(A* B) for circular and V = 2 Im(X* Y) for
+    # linear polarizations.
+
+    if basis is None:
+        basis=globals()['basis']
+    aa,re,im,bb=[w[...,i] for i in range(4)]
+    if param=='I':
+        return aa+bb
+    if basis=='circular':
+        stokes={'Q':lambda: 2*re,'U':lambda: -2*im,'V':lambda: aa-bb}
+    else:
+        stokes={'Q':lambda: aa-bb,'U':lambda: 2*re,'V':lambda: -2*im}
+    return stokes[param]()
+
+class Stokes(object):
+    # Stokes parameters of data 'w' with axes (..., time, pol=4), found
+    # once when first needed and kept as contiguous arrays. The
+    # parameters are read as s.I, s.Q, s.U and s.V, or with get().
+
+    def __init__(self,w,basis=None):
+        if w.shape[-1]!=4:
+            raise ValueError('polarization axis of length 4 required')
+        self.w=w
+        self.basis=basis
+        self.cache={}
+
+    def compute(self,params='IQUV'):
+        # Finds 'params' in one pass over the time axis, reading each
+        # chunk of 'w' once
+
+        params=[i for i in params if not i in self.cache]
+        if len(params)==0:
+            return
+        nBins=self.w.shape[-2]
+        out=dict([(i,np.empty(self.w.shape[:-1],dtype=self.w.dtype))
+                  for i in params])
+        for j in xrange(0,nBins,chunkBins):
+            chunk=self.w[...,j:j+chunkBins,:]
+            for i in params:
+                out[i][...,j:j+chunkBins]=getStokes(chunk,i,self.basis)
+        self.cache.update(out)
+
+    def get(self,param):
+        if not param in self.cache:
+            self.compute(param)
+        return self.cache[param]
+
+    @property
+    def I(self):
+        return self.get('I')
+
+    @property
+    def Q(self):
+        return self.get('Q')
+
+    @property
+    def U(self):
+        return self.get('U')
+
+    @property
+    def V(self):
+        return self.get('V')
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+import pulsarAnalysis.GPs.pulseFinder as pf
+from pulsarAnalysis.GPs import stokes
+
+# Set noise threshold in number of standard deviations
+threshold=5
+
+# Resolution to use for searching in seconds. Pulses are found in the
+# time series smoothed to this resolution, then resolved to the full
+# resolution within 'searchRadius'.
+searchRes=1.0/10000
+searchRadius=1.0/10000
+
+# Time in seconds covered by the running median and rms of each channel
+noiseTime=1.0
+
+# Number of time bins to read per chunk when streaming from a file
+chunkBins=2**14
+
+class RingBuffer(object):
+    # Fixed size buffer of the most recent samples of a stream,
+    # addressed by absolute sample index. Each sample is a value, or an
+    # array of shape 'shape' (eg one value per channel).
+
+    def __init__(self,size,shape=()):
+        self.size=size
+        self.data=np.zeros((size,)+tuple(shape))
+        self.total=0
+
+    def append(self,values):
+        values=values[-self.size:]
+        pos=np.arange(self.total,self.total+len(values))%self.size
+        self.data[pos]=values
+        self.total+=len(values)
+
+    def get(self,start,stop):
+        # Returns samples 'start' to 'stop', which must still be held
+        start=max(start,self.total-self.size,0)
+        return self.data[np.arange(start,stop)%self.size]
+
+    def recent(self):
+        # Returns all samples still held
+        return self.get(self.total-self.size,self.total)
+
+class StreamFinder(object):
+    # Online giant pulse search over waterfall chunks with axes (time,
+    # frequency[, pol]) or time series chunks, as they arrive. The
+    # median and rms of each channel in every chunk are kept in ring
+    # buffers covering 'noiseTime', and each channel is normalized by
+    # the median of these before the channels are summed. A pulse is
+    # reported once it is the largest within half a period on either
+    # side (see pulseFinder.getPeriod), so the latency is about half a
+    # period plus the length of a chunk.
+
+    def __init__(self,binWidth,startTime=None,threshold=threshold,
+                 searchRes=searchRes,searchRadius=searchRadius,
+                 noiseTime=noiseTime):
+        self.binWidth=binWidth
+        self.startTime=startTime
+        self.threshold=threshold
+        self.noiseTime=noiseTime
+        self.halfPeriod=int(1/pf.crabFreq/binWidth)//2
+        self.boxcar=max(1,int(round(searchRes/binWidth)))
+        self.radius=int(round(searchRadius/binWidth))
+        self.margin=self.halfPeriod+self.radius+self.boxcar
+        self.maxChunk=self.margin
+        self.series=RingBuffer(3*self.margin+self.maxChunk)
+        self.nStats=max(1,int(round(noiseTime/(self.maxChunk*binWidth))))
+        self.medians=None
+        self.rmss=None
+        self.nextCheck=0
+
+    def _intensity(self,chunk):
+        # Returns intensity with axes (time, frequency)
+
+        chunk=np.asarray(chunk,dtype=np.float64)
+        if chunk.ndim==1:
+            return chunk[:,np.newaxis]
+        return stokes.getIntensity(chunk,pf.pol_select)
+
+    def _update(self,n):
+        # Adds the median and rms of each channel of one chunk to the
+        # running statistics, and returns the chunk normalized by them
+        # and summed over channels, in units of the noise
+
+        if self.medians is None:
+            self.medians=RingBuffer(self.nStats,n.shape[1:])
+            self.rmss=RingBuffer(self.nStats,n.shape[1:])
+        chunkMedian=np.nanmedian(n,axis=0)
+        self.medians.append(chunkMedian[np.newaxis])
+        self.rmss.append(1.4826*np.nanmedian(np.abs(n-chunkMedian),
+                                             axis=0)[np.newaxis])
+        median=np.nanmedian(self.medians.recent(),axis=0)
+        rms=np.nanmedian(self.rmss.recent(),axis=0)
+
+        # Leave out channels without a usable noise level
+        good=np.isfinite(median)&(rms>0)
+        if not good.any():
+            return np.zeros(n.shape[0])
+        norm=(n[:,good]-median[good])/rms[good]
+        return np.nansum(norm,axis=1)/np.sqrt(good.sum())
+
+    def _search(self,stop):
+        # Searches positions from 'nextCheck' up to 'stop' for pulses
+
+        if stop<=self.nextCheck:
+            return []
+        start=self.nextCheck
+        lo=max(start-self.margin,self.series.total-self.series.size,0)
+        hi=min(stop+self.margin,self.series.total)
+        raw=self.series.get(lo,hi)
+
+        # Smooth to the search resolution
+        kernel=np.ones(self.boxcar)/np.sqrt(self.boxcar)
+        smooth=np.convolve(raw,kernel,mode='same')
+
+        candidates=[]
+        above=np.flatnonzero(smooth[start-lo:stop-lo]>self.threshold)+start
+        for i in above:
+            window=smooth[max(i-self.halfPeriod,lo)-lo:
+                          min(i+self.halfPeriod+1,hi)-lo]
+            if smooth[i-lo]<np.amax(window):
+                continue
+            # Resolve the pulse at full resolution
+            a=max(i-self.radius,lo)
+            b=min(i+self.radius+1,hi)
+            peak=np.argmax(raw[a-lo:b-lo])+a
+            candidates.append(self._candidate(peak,smooth[i-lo]))
+        self.nextCheck=stop
+        return candidates
+
+    def _candidate(self,index,height):
+        if self.startTime is None:
+            return (index,height,None)
+        return (index,height,pf.getTime(index,self.binWidth,self.startTime))
+
+    def push(self,chunk):
+        # Adds a chunk to the stream, returning a list of (index,
+        # height, time) for each newly found pulse
+
+        candidates=[]
+        n=self._intensity(chunk)
+        for i in xrange(0,n.shape[0],self.maxChunk):
+            self.series.append(self._update(n[i:i+self.maxChunk]))
+            candidates+=self._search(self.series.total-self.margin)
+        return candidates
+
+    def flush(self):
+        # Searches the end of the stream
+
+        return self._search(self.series.total)
+
+def iterChunks(path,chunkBins=chunkBins):
+    # Yields chunks of a waterfall file as if they arrived in real time
+
+    w=np.load(path,mmap_mode='r')
+    for i in xrange(0,w.shape[0],chunkBins):
+        yield np.asarray(w[i:i+chunkBins])
+
+def printCandidate(j,index,height,time):
+    print str(j)+'.\tIndex = '+str(index)
+    print '\tTime = '+str(time.iso)
+    print '\tPeak pulse height = '+str(round(height,1))+' sigma\n'
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: %s waterfall" % sys.argv[0]
+        # Run the code as eg: ./streamFinder.py waterfall.npy.
+        sys.exit(1)
+    path=sys.argv[1]
+    telescope=pf.getTelescope(path)
+    startTime=pf.getStartTime(path)
+    nChan=np.load(path,mmap_mode='r').shape[1]
+    binWidth=pf.getWaterfallBinWidth(telescope,nChan)
+
+    finder=StreamFinder(binWidth,startTime)
+    print "Streaming", path
+    print "\tLatency: ", finder.margin*binWidth, "s plus one chunk\n"
+    nFound=0
+    for chunk in iterChunks(path):
+        for index,height,time in finder.push(chunk):
+            nFound+=1
+            printCandidate(nFound,index,height,time)
+    for index,height,time in finder.flush():
+        nFound+=1
+        printCandidate(nFound,index,height,time)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+from astropy.time import TimeDelta
+from pulsarAnalysis.Misc import fftTools
+from pulsarAnalysis.Misc.delaySolver import refinePeak
+import pulsarAnalysis.GPs.pulseCatalog as pc
+import pulsarAnalysis.GPs.cutouts as cutouts
+from pulsarAnalysis.GPs.scattering import getProfiles
+from pulsarAnalysis.GPs import stokes
+
+# Newton iterations used to refine each offset after the
+# cross-correlation peak
+nNewton=5
+
+# Times the template is rebuilt from the profiles aligned to it
+nTemplateIter=2
+
+def getSpectra(profiles,nFFT):
+    # Real FFTs of all rows of 'profiles', zero padded to 'nFFT' so
+    # that shifts do not wrap around. Nan bins are set to zero.
+
+    return fftTools.rfft(np.nan_to_num(profiles),n=nFFT)
+
+def fitOffsets(spec,tempSpec,nFFT,maxLag):
+    # Fourier domain template match (as FFTFIT). Finds the shift (in
+    # bins) of each profile, given by its spectrum in each row of
+    # 'spec', relative to the template with spectrum 'tempSpec' by
+    # maximizing their cross-correlation over lags up to 'maxLag'. The
+    # peak of the cross-correlation from one inverse FFT of all
+    # profiles seeds Newton iterations on the phase gradient. Returns
+    # the shifts and the cross-correlation and its (negated) second
+    # derivative at each shift.
+
+    cross=spec*np.conj(tempSpec)[np.newaxis,:]
+    corr=fftTools.irfft(cross,n=nFFT)
+    lags=np.concatenate((np.arange(nFFT-maxLag,nFFT),np.arange(maxLag+1)))
+    k=np.argmax(corr[:,lags],axis=1)
+    shifts=(lags[k]-np.where(lags[k]>maxLag,nFFT,0)+
+            refinePeak(corr[:,lags],k)).astype(np.float64)
+
+    # Each term of the correlation, a*cos(phi+omega*shift), with DC and
+    # Nyquist terms counted once
+    omega=2*np.pi*np.arange(cross.shape[1])/nFFT
+    weight=np.ones(cross.shape[1])*2
+    weight[0]=1
+    if nFFT%2==0:
+        weight[-1]=1
+    a=weight*np.abs(cross)/nFFT
+    phi=np.angle(cross)
+    for i in range(nNewton):
+        phase=phi+omega*shifts[:,np.newaxis]
+        d1=-(a*omega*np.sin(phase)).sum(1)
+        d2=-(a*omega*omega*np.cos(phase)).sum(1)
+        step=np.where(d2<0,-d1/np.where(d2<0,d2,-1.),0.)
+        shifts+=np.clip(step,-0.5,0.5)
+    phase=phi+omega*shifts[:,np.newaxis]
+    return (shifts,(a*np.cos(phase)).sum(1),
+            (a*omega*omega*np.cos(phase)).sum(1))
+
+def shiftProfiles(spec,shifts,nFFT,nBins):
+    # Shifts each profile earlier by 'shifts' bins with a phase ramp on
+    # its spectrum
+
+    omega=2*np.pi*np.arange(spec.shape[1])/nFFT
+    ramp=np.exp(1j*omega[np.newaxis,:]*shifts[:,np.newaxis])
+    return fftTools.irfft(spec*ramp,n=nFFT)[:,:nBins]
+
+def getTemplate(profiles,noise,nIter=nTemplateIter):
+    # Builds a template from the profiles themselves, starting from the
+    # signal-to-noise weighted mean of the profiles (whose peaks are at
+    # the catalog bins) and then averaging the profiles aligned to the
+    # previous template. The template is normalized to unit peak.
+
+    nBins=profiles.shape[1]
+    nFFT=fftTools.nextFastLen(2*nBins)
+    spec=getSpectra(profiles,nFFT)
+    with np.errstate(divide='ignore'):
+        weight=(1/noise)[:,np.newaxis]
+    valid=isMeasurable(profiles,noise)
+    template=np.nansum(profiles[valid]*weight[valid],axis=0)
+    for i in range(nIter):
+        shifts,amp,curv=fitOffsets(spec[valid],getSpectra(template,nFFT),
+                                   nFFT,nBins//2)
+        aligned=shiftProfiles(spec[valid],shifts,nFFT,nBins)
+        template=(aligned*weight[valid]).sum(0)
+    return template/template.max()
+
+def getReference(template):
+    # Peak of the template, in bins to below one bin
+
+    k=np.array([np.argmax(template)])
+    return k[0]+refinePeak(template[np.newaxis,:],k)[0]
+
+def isMeasurable(profiles,noise):
+    # True for profiles that are finite throughout with a positive
+    # noise level. Cut-outs past the edge of a file, or left nan by
+    # cutouts.py, cannot be timed.
+
+    with np.errstate(invalid='ignore'):
+        return np.isfinite(profiles).all(1)&(noise>0)
+
+def getOffsets(profiles,noise,template,maxLag=None):
+    # Shifts of all 'profiles' (axes pulse, time) relative to
+    # 'template' in bins, with their uncertainties and the fitted
+    # amplitude of each profile. Profiles and template share one FFT
+    # length, so the transforms of all pulses are made in one call.
+    # The uncertainty comes from the curvature of the cross-correlation
+    # at its peak, for white noise of rms 'noise' in each profile.
+    # Shifts and uncertainties are nan for profiles that cannot be
+    # measured (see isMeasurable) or show no positive match.
+
+    nBins=profiles.shape[1]
+    if maxLag is None:
+        maxLag=nBins//2
+    nFFT=fftTools.nextFastLen(2*nBins)
+    shifts,corr,curv=fitOffsets(getSpectra(profiles,nFFT),
+                                getSpectra(template,nFFT),nFFT,maxLag)
+    amplitude=corr/np.sum(template*template)
+    errors=np.empty(len(shifts))
+    errors.fill(np.nan)
+    valid=isMeasurable(profiles,noise)&(amplitude>0)&(curv>0)
+    errors[valid]=noise[valid]/np.sqrt(amplitude[valid]*curv[valid])
+    shifts[~valid]=np.nan
+    return shifts,errors,amplitude
+
+def getCatalogOffsets(catalog,shifts,template):
+    # Bins after each pulse's catalog bin at which the template peak
+    # falls, from the shifts relative to the template of cut-outs made
+    # with the default windows of cutouts.py. These are the offsets
+    # taken by stacker.stackPulses.
+
+    leadBins=np.array([cutouts.getBins(b)[0] for b in catalog['binWidth']])
+    return shifts+getReference(template)-leadBins
+
+def getTOAs(catalog,shifts,template):
+    # Arrival times of the template peak for each pulse, from the
+    # shifts relative to the template (see getCatalogOffsets)
+
+    offset=getCatalogOffsets(catalog,shifts,template)*catalog['binWidth']
+    return pc.getTimes(catalog)+TimeDelta(offset,format='sec')
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: %s cutouts.npz [template.npy]" % sys.argv[0]
+        # Run the code as eg: ./toas.py cutouts.npz, with cut-outs made
+        # by cutouts.py. Without a template, one is built from the
+        # pulses.
+        sys.exit(1)
+    data=np.load(sys.argv[1])
+    catalog=data['catalog']
+    profiles,noise=getProfiles(data['pulses'],data['backgrounds'])
+
+    # Bins missing from every channel (eg past the end of a file) are
+    # summed to zero above, so mark those profiles as unmeasurable
+    gaps=np.isnan(stokes.getIntensity(data['pulses'])).all(1).any(1)
+    profiles[gaps]=np.nan
+    if len(sys.argv) > 2:
+        template=np.load(sys.argv[2])
+        if len(template)!=profiles.shape[1]:
+            print "Error, template has "+str(len(template))+" bins but"+\
+                " pulses have "+str(profiles.shape[1])+"."
+            sys.exit(1)
+    else:
+        template=getTemplate(profiles,noise)
+    shifts,errors,amplitude=getOffsets(profiles,noise,template)
+    measured=np.isfinite(shifts)
+    toas=getTOAs(catalog[measured],shifts[measured],template)
+    toas.precision=9
+    binWidth=catalog['binWidth']
+
+    print "\nTimes of arrival of "+str(measured.sum())+" of "+\
+        str(len(catalog))+" pulses:\n"
+    for j,i in enumerate(np.flatnonzero(measured)):
+        print str(i+1)+'.\t'+catalog['telescope'][i]+'\t'+toas[j].iso+\
+            '\t+/- '+str(round(errors[i]*binWidth[i]*1e9,1))+' ns'
+    if not measured.all():
+        print "\nUnmeasured pulses: "+\
+            ', '.join([str(i+1) for i in np.flatnonzero(~measured)])
+    print "\nMedian uncertainty: ", np.nanmedian(errors*binWidth)*1e9, "ns"
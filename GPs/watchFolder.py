@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import time
+import threading
+import Queue
+import pulsarAnalysis.GPs.pulseFinder as pf
+import pulsarAnalysis.GPs.pulseCatalog as pc
+
+# Seconds between scans of the watched directories
+pollInterval=10.
+
+# Seconds a file's size must stay unchanged before it is processed
+settleTime=30.
+
+# Maximum number of files processed at once
+maxWorkers=2
+
+# Maximum number of ready files waiting for a worker. Scanning pauses
+# while the queue is full.
+queueDepth=4
+
+# Set noise threshold in number of standard deviations
+threshold=5
+
+class FolderWatcher(object):
+    # Watches directories for foldspec (with matching icount) and
+    # waterfall files, and searches each one for giant pulses once it
+    # has finished being written, adding the pulses to a catalog.
+    # Files are searched by a fixed pool of 'maxWorkers' threads, fed
+    # from a bounded queue. Searched files are listed in a .done file
+    # and files that could not be searched in a .failed file next to
+    # the catalog, and neither is searched again (remove the .failed
+    # file to retry failures).
+
+    def __init__(self,dirList,catalogPath,maxWorkers=maxWorkers,
+                 queueDepth=queueDepth):
+        self.dirList=dirList
+        self.catalogPath=catalogPath
+        self.donePath=catalogPath+'.done'
+        self.failedPath=catalogPath+'.failed'
+        self.queue=Queue.Queue(maxsize=queueDepth)
+        self.catalogLock=threading.Lock()
+        self.stopEvent=threading.Event()
+        self.sizes={}
+        self.done=set()
+        for iPath in (self.donePath,self.failedPath):
+            if os.path.exists(iPath):
+                self.done|=set(open(iPath).read().split())
+        self.workers=[threading.Thread(target=self._work)
+                      for i in range(maxWorkers)]
+
+    def _isStable(self,path,now):
+        # Records the size of 'path', returning True if it has not
+        # changed for 'settleTime' seconds
+
+        size=os.path.getsize(path)
+        lastSize,since=self.sizes.get(path,(None,now))
+        if size!=lastSize:
+            self.sizes[path]=(size,now)
+            return False
+        return now-since>=settleTime
+
+    def scan(self):
+        # Queues every file that is newly ready, blocking while the
+        # queue is full
+
+        now=time.time()
+        for iDir in self.dirList:
+            for iFile in sorted(os.listdir(iDir)):
+                path=os.path.join(iDir,iFile)
+                if path in self.done or self.stopEvent.is_set():
+                    continue
+                if 'foldspec' in iFile:
+                    icount=path.replace('foldspec','icount')
+                    if not os.path.exists(icount):
+                        continue
+                    ready=self._isStable(path,now) and \
+                        self._isStable(icount,now)
+                elif 'waterfall' in iFile:
+                    ready=self._isStable(path,now)
+                else:
+                    continue
+                if ready:
+                    self.done.add(path)
+                    self._put(path)
+
+    def _put(self,path):
+        # Waits for room in the queue, checking regularly for a stop
+        while not self.stopEvent.is_set():
+            try:
+                self.queue.put(path,timeout=1.)
+                return
+            except Queue.Full:
+                continue
+
+    def _work(self):
+        while True:
+            path=self.queue.get()
+            if path is None:
+                break
+            try:
+                self.process(path)
+            except (Exception,SystemExit) as e:
+                # loadFiles exits on files it cannot use
+                print "Error, could not process "+path+": "+str(e)
+                with self.catalogLock:
+                    with open(self.failedPath,'a') as f:
+                        f.write(path+'\n')
+            finally:
+                self.queue.task_done()
+
+    def process(self,path):
+        # Searches one file and adds its pulses to the catalog
+
+        w,runInfo=pf.loadFiles([path])
+        pulseList=pf.findPulses(w,runInfo['binWidth'],runInfo['deltat'],
+                                threshold=threshold)
+        entries=pc.makeEntries(pulseList,runInfo,path)
+        with self.catalogLock:
+            catalog=pc.loadCatalog(self.catalogPath)
+            pc.saveCatalog(self.catalogPath,pc.addEntries(catalog,entries))
+            with open(self.donePath,'a') as f:
+                f.write(path+'\n')
+        print "Found "+str(len(pulseList))+" pulses in "+path
+
+    def run(self):
+        # Scans until interrupted, then finishes the queued files
+
+        for worker in self.workers:
+            worker.start()
+        try:
+            while not self.stopEvent.is_set():
+                self.scan()
+                self.stopEvent.wait(pollInterval)
+        except KeyboardInterrupt:
+            print "Stopping, finishing queued files..."
+        finally:
+            self.stopEvent.set()
+            for worker in self.workers:
+                self.queue.put(None)
+            for worker in self.workers:
+                worker.join()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print "Usage: %s catalog.npy dir1 dir2 ..." % sys.argv[0]
+        # Run the code as eg: ./watchFolder.py catalog.npy /data/session/
+        sys.exit(1)
+    watcher=FolderWatcher(sys.argv[2:],sys.argv[1])
+    print "Watching", ', '.join(sys.argv[2:])
+    print "\tWorkers: ", maxWorkers
+    print "\tQueue depth: ", queueDepth
+    watcher.run()
@@ -1,5 +1,9 @@
 import sys
+import numpy as np
 from pulsarAnalysis.Misc.GMRTNaming import getNodeVolt
+
+# Version of the calibration table format written by delaySolver
+calVersion=1
 delayDict={
     'C00R':None, 'C00L':94,
     'C01R':None, 'C01L':39,
@@ -73,6 +77,22 @@ def getDelay(dish):
 def getPhase(dish):
     return phaseDict[dish]
 
+def loadCalibration(path):
+    # Replaces the delays and phases of all dishes in the calibration
+    # table 'path' (see delaySolver.py). Returns the table's epoch.
+
+    cal=np.load(path)
+    if int(cal['version'])>calVersion:
+        print "Warning, calibration table version "+str(cal['version'])+\
+            " is newer than supported version "+str(calVersion)+"."
+    for name,delay,phase in zip(cal['names'],cal['delays'],cal['phases']):
+        name=str(name)
+        delayDict[name]=int(round(delay))
+        phaseDict[name]=float(phase)
+        delayDict[getNodeVolt(name)]=delayDict[name]
+        phaseDict[getNodeVolt(name)]=phaseDict[name]
+    return str(cal['epoch'])
+
 if __name__ == '__main__':
     if len(sys.argv)==2:
         try:
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import numpy as np
+from astropy.time import Time
+from pulsarAnalysis.Misc import GMRTNaming,GMRTStatus,GMRTDelay
+
+# Directory holding calibration tables written by delaySolver.py
+calDir='.'
+
+# Structured array layout, one entry per polarization stream
+dishDtype=[('name','U4'),('dish','U3'),('pol','U1'),('node','i4'),
+           ('stream','i4'),('status','U1'),('delay','f8'),('phase','f8')]
+
+def _toFloat(value):
+    return np.nan if value is None else value
+
+def buildRegistry():
+    # Builds the registry array from GMRTNaming, GMRTStatus and
+    # GMRTDelay. Missing delays and phases are stored as nan.
+
+    registry=np.zeros(len(GMRTNaming.telList),dtype=dishDtype)
+    for i,(name,(node,stream)) in enumerate(GMRTNaming.telList):
+        registry[i]=(name,name[:3],name[3],node,stream,
+                     GMRTStatus.getStatus(name),
+                     _toFloat(GMRTDelay.delayDict[name]),
+                     _toFloat(GMRTDelay.phaseDict[name]))
+    return registry
+
+registry=buildRegistry()
+
+def refresh():
+    # Rebuilds the registry after the GMRT tables have changed
+
+    registry[...]=buildRegistry()
+
+def select(status=None,pol=None,dishes=None,requirePhase=False):
+    # Returns a boolean mask of registry entries with the given status
+    # ('g', 'b' or 'm', or a string of several), polarization ('R' or
+    # 'L') and dish names (eg. 'C04'), with a phase if 'requirePhase'
+
+    mask=np.ones(len(registry),dtype=bool)
+    if status is not None:
+        mask&=np.isin(registry['status'],list(status))
+    if pol is not None:
+        mask&=registry['pol']==pol
+    if dishes is not None:
+        mask&=np.isin(registry['dish'],dishes)
+    if requirePhase:
+        mask&=~np.isnan(registry['phase'])
+    return mask
+
+def getStreams(status='g',pol=None,requirePhase=True):
+    # Returns the names, nodes, voltage streams and phasors of all
+    # matching streams, eg. getStreams('g','R') for all good R-pol
+    # dishes
+
+    entries=registry[select(status,pol,requirePhase=requirePhase)]
+    return (entries['name'],entries['node'],entries['stream'],
+            np.exp(1j*entries['phase']))
+
+def getIndices(names):
+    # Returns the registry index of each stream name
+
+    names=np.asarray(names)
+    order=np.argsort(registry['name'])
+    pos=np.searchsorted(registry['name'],names,sorter=order)
+    pos=np.clip(pos,0,len(order)-1)
+    indices=order[pos]
+    if not np.all(registry['name'][indices]==names):
+        raise KeyError("Telescope name not recognized.")
+    return indices
+
+def getPhasors(names):
+    # Returns the phasors of the given streams, with nan for streams
+    # without a phase
+
+    return np.exp(1j*registry['phase'][getIndices(names)])
+
+def getDelays(names):
+    # Returns the delays of the given streams, with nan for streams
+    # without a delay
+
+    return registry['delay'][getIndices(names)]
+
+def getNamesInFile(fileName):
+    # Returns the names of all streams that appear in 'fileName'
+
+    found=np.char.find(os.path.basename(fileName),registry['name'])>=0
+    return [str(i) for i in registry['name'][found]]
+
+def findCalibration(time,path=None):
+    # Returns the calibration table in directory 'path' (default
+    # 'calDir') with the latest epoch at or before 'time', or None if
+    # there is none
+
+    if path is None:
+        path=calDir
+    time=Time(time)
+    best=None
+    bestEpoch=None
+    for iFile in os.listdir(path):
+        if not iFile.endswith('.npz'):
+            continue
+        iPath=os.path.join(path,iFile)
+        try:
+            epoch=Time(str(np.load(iPath)['epoch']))
+        except (KeyError,ValueError):
+            continue
+        if epoch<=time and (bestEpoch is None or epoch>bestEpoch):
+            best,bestEpoch=iPath,epoch
+    return best
+
+def loadCalibration(path):
+    # Loads a calibration table into GMRTDelay and the registry.
+    # Returns the table's epoch.
+
+    epoch=GMRTDelay.loadCalibration(path)
+    refresh()
+    return epoch
+
+def loadEpoch(time,path=None):
+    # Loads the calibration table for the epoch of 'time' from
+    # directory 'path' (default 'calDir'). Returns the table's path,
+    # or None if no table is found.
+
+    path=findCalibration(time,path)
+    if path is None:
+        print "Warning, no calibration found for "+str(time)+"."
+        return None
+    loadCalibration(path)
+    return path
+
+if __name__ == '__main__':
+    status=sys.argv[1] if len(sys.argv)>1 else 'g'
+    pol=sys.argv[2] if len(sys.argv)>2 else None
+    names,nodes,streams,phasors=getStreams(status,pol)
+    print "Streams with status '"+status+"'"+(
+        " and polarization "+pol if pol else "")+":\n"
+    for i in range(len(names)):
+        print "\t"+names[i]+"\tNode "+str(nodes[i])+"\tStream "+str(
+            streams[i])+"\tPhase "+str(np.angle(phasors[i]))
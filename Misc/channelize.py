@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+from pulsarAnalysis.Misc import fftTools
+
+# Number of taps per channel for the polyphase filterbank
+nTaps=4
+
+# Number of spectra to produce per block when streaming from disk
+blockSpectra=4096
+
+# Sample type of raw (non .npy) voltage files
+rawDtype=np.int8
+
+# Cache of polyphase filterbank windows, keyed by (frame length, taps)
+_windowCache={}
+
+def getPFBWindow(frameLength,nTaps=nTaps):
+    # Returns the polyphase filterbank window for frames of
+    # 'frameLength' samples as an array of shape (nTaps,frameLength)
+
+    key=(frameLength,nTaps)
+    if not key in _windowCache:
+        nSamples=frameLength*nTaps
+        x=np.arange(nSamples)/float(frameLength)-nTaps/2.
+        window=np.sinc(x)*np.hamming(nSamples)
+        _windowCache[key]=window.reshape(nTaps,frameLength).astype(np.float32)
+    return _windowCache[key]
+
+class Channelizer(object):
+    # Streaming FFT or polyphase filterbank channelizer. Voltage
+    # blocks of shape (nSamples,) or (nSamples,nPol) are passed to
+    # 'process', which returns a waterfall chunk with axes (time,
+    # frequency) for a single polarization, or (time, frequency,
+    # pol=4 (XX, XY, YX, YY)) for two polarizations. Samples that do
+    # not fill a complete spectrum are kept for the next block.
+    #
+    # The returned chunk is a view of an internal buffer, which is
+    # overwritten by the next call. Copy it if it needs to be kept.
+
+    def __init__(self,nChan,real=True,pfb=False,nTaps=nTaps):
+        self.nChan=nChan
+        self.real=real
+        self.pfb=pfb
+        self.nTaps=nTaps if pfb else 1
+        self.frameLength=2*nChan if real else nChan
+        self._carry=None
+        self._history=None
+        self._out=None
+
+    def _getOut(self,nSpec,nPol):
+        # Reuse the output buffer if it has the right shape
+        shape=(nSpec,self.nChan,4) if nPol==2 else (nSpec,self.nChan)
+        if self._out is None or self._out.shape!=shape:
+            self._out=np.empty(shape,dtype=np.float32)
+        return self._out
+
+    def channelise(self,x):
+        # Returns the complex spectra of the voltages 'x', with axes
+        # (time, frequency, pol)
+
+        x=np.asarray(x)
+        if x.ndim==1:
+            x=x[:,np.newaxis]
+        nPol=x.shape[1]
+        if not nPol in (1,2):
+            print "Error, channelizer only supports one or two polarizations."
+            return None
+
+        # Prepend samples left over from the previous block
+        if self._carry is not None and len(self._carry):
+            x=np.concatenate((self._carry,x))
+        L=self.frameLength
+        nFrames=x.shape[0]//L
+        self._carry=x[nFrames*L:].copy()
+        dtype=np.complex64 if np.iscomplexobj(x) else np.float32
+        frames=x[:nFrames*L].reshape(nFrames,L,nPol).astype(dtype)
+
+        # Weight and sum the taps of the polyphase filterbank, keeping
+        # the last nTaps-1 frames as history for the next block
+        if self.pfb:
+            if self._history is None:
+                self._history=np.zeros((self.nTaps-1,L,nPol),
+                                       dtype=frames.dtype)
+            frames=np.concatenate((self._history,frames))
+            self._history=frames[frames.shape[0]-(self.nTaps-1):].copy()
+            window=getPFBWindow(L,self.nTaps)
+            weighted=frames[:nFrames]*window[0][:,np.newaxis]
+            for i in range(1,self.nTaps):
+                weighted+=frames[i:i+nFrames]*window[i][:,np.newaxis]
+            frames=weighted
+
+        # Channelise, keeping channels in increasing frequency order
+        if self.real:
+            spec=fftTools.rfft(frames,axis=1)[:,:self.nChan,:]
+        else:
+            spec=np.fft.fftshift(fftTools.fft(frames,axis=1),axes=1)
+        return spec
+
+    def process(self,x):
+        spec=self.channelise(x)
+        if spec is None:
+            return None
+        nFrames,_,nPol=spec.shape
+        out=self._getOut(nFrames,nPol)
+        if nPol==1:
+            np.abs(spec[...,0],out=out)
+            np.square(out,out=out)
+        else:
+            np.abs(spec[...,0],out=out[...,0])
+            np.square(out[...,0],out=out[...,0])
+            np.abs(spec[...,1],out=out[...,3])
+            np.square(out[...,3],out=out[...,3])
+            cross=spec[...,0]*spec[...,1].conj()
+            out[...,1]=cross.real
+            out[...,2]=cross.imag
+        return out
+
+def iterWaterfall(blocks,nChan,real=True,pfb=False):
+    # Channelises an iterable of voltage blocks, yielding waterfall
+    # chunks. Chunks share a buffer, see 'Channelizer'.
+
+    channelizer=Channelizer(nChan,real=real,pfb=pfb)
+    for block in blocks:
+        chunk=channelizer.process(block)
+        if chunk is not None and chunk.shape[0]>0:
+            yield chunk
+
+def iterBlocks(x,blockSize):
+    # Yields consecutive blocks of 'blockSize' samples from array 'x'
+
+    for i in xrange(0,x.shape[0],blockSize):
+        yield x[i:i+blockSize]
+
+def openVoltages(path):
+    # Memory maps a voltage file without reading it into memory
+
+    if path.endswith('.npy'):
+        return np.load(path,mmap_mode='r')
+    return np.memmap(path,dtype=rawDtype,mode='r')
+
+def channelizeFile(path,outPath,nChan,real=True,pfb=False):
+    # Channelises the voltages in 'path' in blocks, writing the
+    # waterfall to 'outPath' without holding either in memory
+
+    x=openVoltages(path)
+    frameLength=2*nChan if real else nChan
+    nSpec=x.shape[0]//frameLength
+    if x.ndim==2 and x.shape[1]==2:
+        shape=(nSpec,nChan,4)
+    else:
+        shape=(nSpec,nChan)
+    out=np.lib.format.open_memmap(outPath,mode='w+',dtype=np.float32,
+                                  shape=shape)
+    i=0
+    for chunk in iterWaterfall(iterBlocks(x,blockSpectra*frameLength),
+                               nChan,real=real,pfb=pfb):
+        out[i:i+chunk.shape[0]]=chunk
+        i+=chunk.shape[0]
+    out.flush()
+    return shape
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print "Usage: %s nChan voltageFile waterfallFile [pfb]" % sys.argv[0]
+        # Run the code as eg: ./channelize.py 512 raw_voltage waterfall.npy
+        sys.exit(1)
+    nChan=int(sys.argv[1])
+    pfb=len(sys.argv)>4 and sys.argv[4]=='pfb'
+    real=not sys.argv[2].endswith('.npy') or np.load(
+        sys.argv[2],mmap_mode='r').dtype.kind!='c'
+    print "Channelising", sys.argv[2]
+    shape=channelizeFile(sys.argv[2],sys.argv[3],nChan,real=real,pfb=pfb)
+    print "Saved waterfall of shape", shape, "to:"
+    print sys.argv[3]
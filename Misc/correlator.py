@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+from multiprocessing.pool import ThreadPool
+from pulsarAnalysis.Misc import channelize,voltToInt
+
+# Number of channels to form from raw (real) voltages. Voltage files
+# that are already channelised are correlated as they are.
+nChan=512
+
+# Number of spectra per block. Each block is channelised and
+# correlated independently.
+blockSpectra=1024
+
+# Number of blocks to correlate in parallel
+nThreads=4
+
+def openDishVoltages(fileList):
+    # Memory maps the voltage file of each dish, returning the dish
+    # names and voltage arrays
+
+    dishList=[]
+    voltList=[]
+    for iFile in fileList:
+        dishes=voltToInt.getDishes(iFile)
+        if len(dishes)!=1:
+            print "Error, could not identify a single dish in file:"
+            print iFile
+            continue
+        dishList.append(dishes[0])
+        voltList.append(channelize.openVoltages(iFile))
+    return dishList,voltList
+
+def getBlockLength(voltList):
+    # Number of samples per block and number of complete blocks
+    # common to all dishes
+
+    if np.iscomplexobj(voltList[0]):
+        blockLength=blockSpectra
+    else:
+        blockLength=blockSpectra*2*nChan
+    nSamples=min([v.shape[0] for v in voltList])
+    return blockLength,nSamples//blockLength
+
+def channeliseBlock(voltList,start,length):
+    # Returns the complex spectra of one block for all dishes, with
+    # axes (dish, time, frequency)
+
+    specList=[]
+    for v in voltList:
+        block=np.asarray(v[start:start+length])
+        if np.iscomplexobj(block):
+            spec=block.astype(np.complex64)
+        else:
+            spec=channelize.Channelizer(nChan,real=True).channelise(
+                block)[...,0]
+        specList.append(spec)
+    return np.array(specList)
+
+def correlateBlock(spec):
+    # Forms all baseline cross products of the spectra 'spec' with
+    # axes (dish, time, frequency). Returns the visibilities summed
+    # over time, with axes (frequency, dish, dish), as one batched
+    # matrix product per channel.
+
+    v=np.ascontiguousarray(spec.transpose(2,0,1))
+    return np.matmul(v,v.conj().transpose(0,2,1))
+
+def correlate(voltList,nBlocks=None,nThreads=nThreads):
+    # Correlates the memory mapped voltages of all dishes, block by
+    # block in parallel. Returns the visibilities averaged over time
+    # and the number of spectra used.
+
+    blockLength,nAvailable=getBlockLength(voltList)
+    if nBlocks is None or nBlocks>nAvailable:
+        nBlocks=nAvailable
+
+    def work(i):
+        spec=channeliseBlock(voltList,i*blockLength,blockLength)
+        return correlateBlock(spec),spec.shape[1]
+
+    vis=None
+    nSpec=0
+    pool=ThreadPool(nThreads)
+    try:
+        for blockVis,blockSpec in pool.imap_unordered(work,xrange(nBlocks)):
+            if vis is None:
+                vis=blockVis.astype(np.complex128)
+            else:
+                vis+=blockVis
+            nSpec+=blockSpec
+    finally:
+        pool.close()
+        pool.join()
+    if nSpec==0:
+        return None,0
+    return vis/nSpec,nSpec
+
+def getPhases(vis,refIndex):
+    # Returns the phase of each dish relative to dish 'refIndex', such
+    # that rotating each dish's voltages by its phase aligns it with
+    # the reference (see voltToInt.rotateVoltage)
+
+    return np.angle(vis[:,refIndex,:].sum(0))
+
+def getCoherence(vis):
+    # Normalises visibilities by the autocorrelations
+
+    auto=np.sqrt(np.abs(np.einsum('cii->ci',vis)))
+    return vis/(auto[:,:,np.newaxis]*auto[:,np.newaxis,:])
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print "Usage: %s refDish voltage1 voltage2 ..." % sys.argv[0]
+        # Run the code as eg: ./correlator.py C04R path/to/voltages/
+        sys.exit(1)
+    refDish=sys.argv[1]
+    dishList,voltList=openDishVoltages(
+        voltToInt.getVoltageFiles(sys.argv[2:]))
+    if not refDish in dishList:
+        print "Error, reference dish "+refDish+" not found."
+        sys.exit(1)
+
+    vis,nSpec=correlate(voltList)
+    if vis is None:
+        print "Error, not enough data to correlate."
+        sys.exit(1)
+    phases=getPhases(vis,dishList.index(refDish))
+    coherence=np.abs(getCoherence(vis).mean(0))
+
+    print "\nCorrelated", nSpec, "spectra in", vis.shape[0], "channels."
+    print "Phases relative to "+refDish+":\n"
+    for i,iDish in enumerate(dishList):
+        print "\t"+iDish+"\t"+str(phases[i])+"\tCoherence: "+str(
+            round(coherence[dishList.index(refDish),i],3))
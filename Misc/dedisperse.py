@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+from pulsarAnalysis.Misc import fftTools
+import pulsarAnalysis.GPs.pulseFinder as pf
+
+# Crab dispersion measure in pc/cm^3
+crabDM=56.7702
+
+# Dispersion constant in s MHz^2 cm^3/pc
+dispConst=4.148808e3
+
+# Sign of the chirp phase. Use -1 for lower sideband data, for which
+# frequency decreases with channel index.
+chirpSign=1
+
+# Smallest FFT length to use, and FFT length as a multiple of the
+# dispersive smearing within a channel
+minFFTLength=1024
+fftSmearFactor=4
+
+# Number of samples to read per block when streaming from disk
+blockSamples=2**18
+
+# Cache of chirp kernels, keyed by DM, FFT length, band and channels
+_chirpCache={}
+
+def getChannelFreqs(freqBand,nChan):
+    # Returns the centre frequency of each channel in MHz
+
+    chanWidth=(freqBand[1]-freqBand[0])/float(nChan)
+    return freqBand[0]+(np.arange(nChan)+0.5)*chanWidth
+
+def getSmearing(DM,freqBand,nChan):
+    # Returns the number of samples by which the dispersive delay at
+    # the bottom and top of each channel leads and lags its centre,
+    # as the largest (lead, lag) over all channels
+
+    chanWidth=(freqBand[1]-freqBand[0])/float(nChan)
+    fCentre=getChannelFreqs(freqBand,nChan)
+    fLow=fCentre-chanWidth/2.
+    fHigh=fCentre+chanWidth/2.
+    lead=dispConst*DM*(fLow**-2-fCentre**-2)*chanWidth*1e6
+    lag=dispConst*DM*(fCentre**-2-fHigh**-2)*chanWidth*1e6
+    return int(np.ceil(lead.max())),int(np.ceil(lag.max()))
+
+def getChirp(DM,nFFT,freqBand,nChan,sign=chirpSign):
+    # Returns the dedispersion chirp for complex voltages with 'nChan'
+    # channels spanning 'freqBand' (MHz), as an array of shape
+    # (nFFT,nChan) in FFT order. Kernels are cached.
+
+    key=(DM,nFFT,tuple(freqBand),nChan,sign)
+    if not key in _chirpCache:
+        chanWidth=(freqBand[1]-freqBand[0])/float(nChan)
+        f0=getChannelFreqs(freqBand,nChan)[np.newaxis,:]
+        f=sign*fftTools.fftfreq(nFFT,1./chanWidth)[:,np.newaxis]
+        phase=2*np.pi*dispConst*1e6*DM*f*f/(f0*f0*(f0+f))
+        _chirpCache[key]=np.exp(-1j*phase).astype(np.complex64)
+    return _chirpCache[key]
+
+class Dedisperser(object):
+    # Coherently dedisperses a stream of complex voltages with axes
+    # (time, frequency[, pol]) by overlap-save with a chirp filter,
+    # removing the dispersive smearing within each channel. Delays
+    # between channels are left in place, relative to each channel's
+    # centre frequency.
+    #
+    # Blocks of any length are passed to 'process', which returns all
+    # output samples that are complete so far, aligned with the input
+    # samples. 'flush' returns the remainder at the end of the stream.
+
+    def __init__(self,DM,freqBand,nChan,nFFT=None,sign=chirpSign):
+        self.lead,self.lag=getSmearing(DM,freqBand,nChan)
+        if nFFT is None:
+            nFFT=fftTools.nextFastLen(
+                max(minFFTLength,fftSmearFactor*(self.lead+self.lag)))
+        if nFFT<=self.lead+self.lag:
+            print "Error, FFT length is shorter than the dispersive smearing."
+            nFFT=fftTools.nextFastLen(2*(self.lead+self.lag))
+        self.nFFT=nFFT
+        self.step=nFFT-self.lead-self.lag
+        self.chirp=getChirp(DM,nFFT,freqBand,nChan,sign)
+        self.nChan=nChan
+        self._buffer=None
+
+    def _filter(self,frame):
+        # Dedisperse one FFT frame, keeping only uncorrupted samples
+
+        chirp=self.chirp
+        if frame.ndim==3:
+            chirp=chirp[...,np.newaxis]
+        spec=fftTools.fft(frame,axis=0)
+        spec*=chirp
+        out=fftTools.ifft(spec,axis=0)
+        return out[self.lag:self.nFFT-self.lead].astype(np.complex64)
+
+    def process(self,x):
+        x=np.asarray(x,dtype=np.complex64)
+
+        # Pad the start of the stream so output is aligned with input
+        if self._buffer is None:
+            pad=np.zeros((self.lag,)+x.shape[1:],dtype=np.complex64)
+            self._buffer=pad
+        buf=np.concatenate((self._buffer,x))
+
+        nFrames=max(0,(buf.shape[0]-self.lead-self.lag)//self.step)
+        outList=[]
+        for i in xrange(nFrames):
+            frame=buf[i*self.step:i*self.step+self.nFFT]
+            outList.append(self._filter(frame))
+        self._buffer=buf[nFrames*self.step:]
+        if len(outList)==0:
+            return np.zeros((0,)+x.shape[1:],dtype=np.complex64)
+        return np.concatenate(outList)
+
+    def flush(self):
+        # Returns the remaining output, padding the end of the stream.
+        # Empty if nothing was processed.
+
+        if self._buffer is None:
+            return np.zeros((0,self.nChan),dtype=np.complex64)
+        nRemaining=self._buffer.shape[0]-self.lag
+        pad=np.zeros((self.lead+self.step,)+self._buffer.shape[1:],
+                     dtype=np.complex64)
+        out=self.process(pad)
+        self._buffer=None
+        return out[:nRemaining]
+
+def dedisperse(w,DM,freqBand,nFFT=None,sign=chirpSign):
+    # Coherently dedisperses the voltages 'w' with axes (time,
+    # frequency[, pol]) in memory
+
+    dd=Dedisperser(DM,freqBand,w.shape[1],nFFT=nFFT,sign=sign)
+    return np.concatenate((dd.process(w),dd.flush()))
+
+def iterDedispersed(w,dd):
+    # Passes the voltages 'w' (eg. memory mapped) through Dedisperser
+    # 'dd' in blocks of 'blockSamples', yielding the index of the first
+    # output sample and the dedispersed samples of each block
+
+    i=0
+    for j in xrange(0,w.shape[0],blockSamples):
+        block=dd.process(w[j:j+blockSamples])
+        yield i,block
+        i+=block.shape[0]
+    yield i,dd.flush()
+
+def dedisperseFile(path,outPath,DM,freqBand,nFFT=None,sign=chirpSign):
+    # Coherently dedisperses the voltages in 'path' block by block,
+    # writing the result to 'outPath'. Memory use is set by
+    # 'blockSamples' and the FFT length, not by the file size.
+
+    w=np.load(path,mmap_mode='r')
+    out=np.lib.format.open_memmap(outPath,mode='w+',dtype=np.complex64,
+                                  shape=w.shape)
+    dd=Dedisperser(DM,freqBand,w.shape[1],nFFT=nFFT,sign=sign)
+    for i,block in iterDedispersed(w,dd):
+        out[i:i+block.shape[0]]=block
+    out.flush()
+    return dd
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print "Usage: %s voltageFile outputFile [DM]" % sys.argv[0]
+        # Run the code as eg: ./dedisperse.py voltage.npy voltage_dd.npy
+        sys.exit(1)
+    DM=float(sys.argv[3]) if len(sys.argv)>3 else crabDM
+    telescope=pf.getTelescope(sys.argv[1])
+    freqBand=pf.getFrequencyBand(telescope)
+    print "Dedispersing", sys.argv[1], "to DM =", DM
+    dd=dedisperseFile(sys.argv[1],sys.argv[2],DM,freqBand)
+    print "\tFFT length: ", dd.nFFT
+    print "\tSmearing: ", dd.lead+dd.lag, "samples"
+    print "Saved to:"
+    print sys.argv[2]
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+from astropy.time import Time
+from pulsarAnalysis.Misc import fftTools,channelize,voltToInt,GMRTDelay
+import pulsarAnalysis.GPs.pulseFinder as pf
+
+# Number of samples to cut out around the pulse in each dish, as a
+# multiple of the largest delay in GMRTDelay, so the correlation peak
+# of every dish lies well inside the cut-out
+cutoutFactor=4
+
+def getCutoutLength(factor=cutoutFactor):
+    # Cut-out length in samples, from the largest expected delay
+
+    delays=[abs(i) for i in GMRTDelay.delayDict.values() if i is not None]
+    return fftTools.nextFastLen(factor*max(delays))
+
+def openDishes(fileList):
+    # Memory maps the voltage file of each dish without reading it.
+    # Returns the dish names and voltage arrays.
+
+    dishList=[]
+    voltList=[]
+    for iFile in fileList:
+        dishes=voltToInt.getDishes(iFile)
+        if len(dishes)!=1:
+            print "Error, could not identify a single dish in file:"
+            print iFile
+            continue
+        v=channelize.openVoltages(iFile)
+        if len(voltList) and v.shape[1:]!=voltList[0].shape[1:]:
+            print "Error, shape mismatch in file:"
+            print iFile
+            continue
+        dishList.append(dishes[0])
+        voltList.append(v)
+    return dishList,voltList
+
+def refinePeak(y,k):
+    # Fits a parabola through the maximum 'k' of each row of 'y' and
+    # its neighbours, returning the fractional offset of the peak
+
+    n=y.shape[1]
+    rows=np.arange(y.shape[0])
+    y0=y[rows,(k-1)%n]
+    y1=y[rows,k]
+    y2=y[rows,(k+1)%n]
+    denom=y0-2*y1+y2
+    offset=np.zeros(len(k))
+    valid=denom!=0
+    offset[valid]=0.5*(y0[valid]-y2[valid])/denom[valid]
+    return np.clip(offset,-0.5,0.5)
+
+def getCutout(v,start,length):
+    # Reads 'length' samples of voltages 'v' from 'start', with axes
+    # (time, frequency)
+
+    cutout=np.asarray(v[start:start+length],dtype=np.complex64)
+    if cutout.ndim==1:
+        cutout=cutout[:,np.newaxis]
+    return cutout
+
+def solveDelays(voltList,refIndex,start,length=None):
+    # Finds the delay and phase of each dish in 'voltList' (arrays with
+    # axes time, and optionally frequency for channelised voltages)
+    # relative to dish 'refIndex', by FFT cross-correlation of
+    # 'length' samples from 'start'. The reference is transformed once
+    # and the other dishes are read and correlated with it one at a
+    # time, so memory does not grow with the number of dishes. A
+    # positive delay means the signal arrives later in that dish, and
+    # rotating the voltages of each dish by its phase aligns it with
+    # the reference. Returns delays (in samples), phases and the
+    # signal-to-noise of each correlation peak.
+
+    if length is None:
+        length=getCutoutLength()
+    ref=getCutout(voltList[refIndex],start,length)
+    nFFT=fftTools.nextFastLen(2*ref.shape[0])
+
+    # Cross-correlate with zero padding to avoid wrapping
+    refSpec=fftTools.fft(ref,n=nFFT,axis=0).conj()
+    nDish=len(voltList)
+    delays=np.zeros(nDish)
+    phases=np.zeros(nDish)
+    snr=np.zeros(nDish)
+    for i,v in enumerate(voltList):
+        spec=fftTools.fft(getCutout(v,start,length),n=nFFT,axis=0)
+        spec*=refSpec
+        crossCorr=fftTools.ifft(spec,axis=0)
+
+        # Find the correlation peak, summing power over channels
+        power=np.abs(crossCorr).sum(-1)
+        k=np.argmax(power)
+        lag=k if k<nFFT//2 else k-nFFT
+        delays[i]=lag+refinePeak(power[np.newaxis,:],np.array([k]))[0]
+        phases[i]=-np.angle(crossCorr[k,:].sum())
+        noise=np.median(power)
+        snr[i]=power[k]/(noise if noise>0 else 1.)
+    return delays,phases,snr
+
+def saveCalibration(path,dishList,delays,phases,snr,refDish,epoch):
+    # Writes a versioned calibration table that can be loaded with
+    # GMRTDelay.loadCalibration
+
+    np.savez(path,version=GMRTDelay.calVersion,epoch=str(epoch),
+             refDish=refDish,created=Time.now().isot,names=np.array(dishList),
+             delays=delays,phases=phases,snr=snr)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5:
+        print "Usage: %s refDish startSample calFile voltage1 voltage2 ..." % sys.argv[0]
+        # Run the code as eg: ./delaySolver.py C04R 1200000 cal.npz voltages/
+        sys.exit(1)
+    refDish=sys.argv[1]
+    start=int(sys.argv[2])
+    calFile=sys.argv[3]
+    fileList=voltToInt.getVoltageFiles(sys.argv[4:])
+
+    dishList,voltList=openDishes(fileList)
+    if not refDish in dishList:
+        print "Error, reference dish "+refDish+" not found."
+        sys.exit(1)
+    length=getCutoutLength()
+    print "Correlating "+str(length)+" samples of "+str(len(dishList))+\
+        " dishes..."
+    delays,phases,snr=solveDelays(voltList,dishList.index(refDish),start,
+                                  length)
+
+    try:
+        epoch=pf.getStartTime(fileList[0]).isot
+    except (ValueError,IndexError):
+        epoch='unknown'
+
+    print "\nDelays and phases relative to "+refDish+":\n"
+    for i,iDish in enumerate(dishList):
+        print "\t"+iDish+"\t"+str(round(delays[i],2))+" samples\t"+str(
+            phases[i])+"\tS/N: "+str(round(snr[i],1))
+    saveCalibration(calFile,dishList,delays,phases,snr,refDish,epoch)
+    print "\nSaved calibration to:"
+    print calFile
@@ -0,0 +1,41 @@
+import numpy as np
+
+try:
+    import scipy.fft as _fftlib
+    _hasWorkers=True
+except ImportError:
+    import numpy.fft as _fftlib
+    _hasWorkers=False
+
+# Number of threads to use for each transform. Use -1 for all
+# available cores. Ignored if scipy.fft is not available.
+fftWorkers=-1
+
+def _kwargs(workers):
+    # Keyword arguments for the underlying transform
+    if not _hasWorkers:
+        return {}
+    if workers==None:
+        workers=fftWorkers
+    return {'workers':workers}
+
+def fft(x,n=None,axis=-1,workers=None):
+    return _fftlib.fft(x,n=n,axis=axis,**_kwargs(workers))
+
+def ifft(x,n=None,axis=-1,workers=None):
+    return _fftlib.ifft(x,n=n,axis=axis,**_kwargs(workers))
+
+def rfft(x,n=None,axis=-1,workers=None):
+    return _fftlib.rfft(x,n=n,axis=axis,**_kwargs(workers))
+
+def irfft(x,n=None,axis=-1,workers=None):
+    return _fftlib.irfft(x,n=n,axis=axis,**_kwargs(workers))
+
+def fftfreq(n,d=1.0):
+    return np.fft.fftfreq(n,d)
+
+def nextFastLen(n):
+    # Smallest length >= 'n' that the transform handles efficiently
+    if _hasWorkers:
+        return _fftlib.next_fast_len(int(n))
+    return 2**int(np.ceil(np.log2(n)))
@@ -0,0 +1,68 @@
+import sys
+import os
+import numpy as np
+
+# Waterfall and voltage files are written with axes (time, frequency[,
+# pol]), but analysed with axes (frequency, time[, pol]). Converted
+# copies are cached in this directory next to each file, so that they
+# are not listed with the original files.
+cacheDirName='.layout'
+
+# Number of time bins converted at once
+chunkBins=2**16
+
+def getCachePath(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)),cacheDirName,
+                        os.path.basename(path))
+
+def isCached(path):
+    # True if a converted copy of 'path' exists and is newer than it
+
+    cachePath=getCachePath(path)
+    return os.path.exists(cachePath) and \
+        os.path.getmtime(cachePath)>=os.path.getmtime(path)
+
+def convert(path,chunkBins=chunkBins):
+    # Writes a copy of the (time, frequency[, pol]) array in 'path' with
+    # axes (frequency, time[, pol]), contiguous in time for each
+    # channel. The file is converted in chunks of 'chunkBins' time bins
+    # to limit memory use. Returns the path of the copy.
+
+    cachePath=getCachePath(path)
+    if not os.path.isdir(os.path.dirname(cachePath)):
+        os.makedirs(os.path.dirname(cachePath))
+    src=np.load(path,mmap_mode='r')
+    shape=(src.shape[1],src.shape[0])+src.shape[2:]
+
+    # Write to a temporary file first, so a partial copy is never used
+    tmpPath=cachePath+'.tmp.npy'
+    out=np.lib.format.open_memmap(tmpPath,mode='w+',dtype=src.dtype,
+                                  shape=shape)
+    for i in xrange(0,src.shape[0],chunkBins):
+        out[:,i:i+chunkBins,...]=np.swapaxes(src[i:i+chunkBins,...],0,1)
+    out.flush()
+    del out
+    os.rename(tmpPath,cachePath)
+    return cachePath
+
+def load(path,mmap_mode=None):
+    # Loads a waterfall or voltage file with axes (frequency, time[,
+    # pol]) as a contiguous array, using the converted copy when there
+    # is an up to date one
+
+    if isCached(path):
+        return np.load(getCachePath(path),mmap_mode=mmap_mode)
+    w=np.load(path,mmap_mode=mmap_mode)
+    return np.ascontiguousarray(np.swapaxes(w,0,1))
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: %s waterfall1 waterfall2 ..." % sys.argv[0]
+        # Run the code as eg: ./layout.py /data/session/*waterfall*.npy
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        if isCached(path):
+            print "Already converted:", path
+            continue
+        print "Converting", path
+        print "\tto", convert(path)
@@ -0,0 +1,104 @@
+import os
+import sys
+import threading
+import Queue
+import ctypes
+import ctypes.util
+import numpy as np
+
+# Number of files or chunks to read ahead of the one being processed.
+# Up to queueDepth+2 loaded items are held at once: those waiting in
+# the queue, one being handed over by the reader and one in use.
+queueDepth=2
+
+# Advice value asking the kernel to read a file into the page cache
+# (POSIX_FADV_WILLNEED on Linux)
+fadviseWillNeed=3
+
+def _getFadvise():
+    # posix_fadvise from the C library, taking 64-bit offsets, or None
+    # where it is not available
+
+    name=ctypes.util.find_library('c')
+    if name is None:
+        return None
+    try:
+        libc=ctypes.CDLL(name,use_errno=True)
+    except OSError:
+        return None
+    for symbol in ('posix_fadvise64','posix_fadvise'):
+        if hasattr(libc,symbol):
+            fadvise=getattr(libc,symbol)
+            fadvise.argtypes=[ctypes.c_int,ctypes.c_int64,ctypes.c_int64,
+                              ctypes.c_int]
+            fadvise.restype=ctypes.c_int
+            return fadvise
+    return None
+
+_fadvise=_getFadvise()
+
+def readahead(path):
+    # Asks the kernel to start reading 'path' into the page cache, with
+    # posix_fadvise called through ctypes (os.posix_fadvise is missing
+    # in Python 2). Does nothing where it is not available.
+
+    if _fadvise is None:
+        return
+    fd=os.open(path,os.O_RDONLY)
+    try:
+        _fadvise(fd,0,0,fadviseWillNeed)
+    finally:
+        os.close(fd)
+
+def loadMmap(path):
+    # Memory maps a .npy file, hinting that it will be read soon
+
+    readahead(path)
+    return np.load(path,mmap_mode='r')
+
+def prefetch(items,loader=np.load,depth=None):
+    # Yields (item, loader(item)) for each of 'items', running
+    # 'loader' on a background thread up to 'depth' items ahead, so
+    # that reading the next item overlaps with processing the current
+    # one. Errors raised by 'loader' are raised here, with their
+    # traceback. Up to 'depth'+2 loaded items are held at once.
+
+    if depth is None:
+        depth=queueDepth
+    readQueue=Queue.Queue(maxsize=max(1,depth))
+    stop=threading.Event()
+    done=object()
+
+    def work():
+        for item in items:
+            if stop.is_set():
+                return
+            try:
+                result=(item,loader(item),None)
+            except Exception:
+                result=(item,None,sys.exc_info())
+            readQueue.put(result)
+            if result[2] is not None:
+                return
+        readQueue.put(done)
+
+    thread=threading.Thread(target=work)
+    thread.daemon=True
+    thread.start()
+    try:
+        while True:
+            result=readQueue.get()
+            if result is done:
+                break
+            item,data,excInfo=result
+            if excInfo is not None:
+                raise excInfo[0],excInfo[1],excInfo[2]
+            yield item,data
+    finally:
+        # Let the reader finish if the consumer stops early
+        stop.set()
+        while thread.is_alive():
+            try:
+                readQueue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import subprocess
+import tempfile
+import multiprocessing
+import numpy as np
+from pulsarAnalysis.Misc import GMRTNaming,GMRTRegistry,channelize
+
+# Number of channels to form from raw (real) voltages
+nChan=512
+
+# Number of spectra to phase and sum per block on each worker
+blockSpectra=4096
+
+# Directory on each node to write partial beams to
+remoteTmp='/tmp'
+
+# Python interpreter to run workers with on remote nodes
+remotePython='python'
+
+def getHost(path):
+    # Returns the host name of a 'host:/path' location
+
+    return path.split(':')[0]
+
+def planJobs(status='g',pol='R'):
+    # Assigns each dish with a phase and delay to the node holding its
+    # raw voltages. Delays are whole samples relative to the earliest
+    # dish in the plan, so that partial sums from all nodes line up.
+    # Returns a dictionary of host to a list of (dish, path, phase,
+    # delay) jobs.
+
+    names,_,_,phasors=GMRTRegistry.getStreams(status,pol)
+    delays=GMRTRegistry.registry['delay'][GMRTRegistry.getIndices(names)]
+    hasDelay=~np.isnan(delays)
+    for name in names[~hasDelay]:
+        print "Warning, no delay for "+str(name)+", leaving it out."
+    names,phasors,delays=names[hasDelay],phasors[hasDelay],delays[hasDelay]
+    if len(names)==0:
+        raise ValueError('no '+str(pol)+'-pol streams with status '+
+                         str(status)+' have both a phase and a delay')
+    delays=np.rint(delays-delays.min()).astype(int)
+
+    plan={}
+    for name,phasor,delay in zip(names,phasors,delays):
+        filename,path=GMRTNaming.getFileName(str(name))
+        host=getHost(path)
+        plan.setdefault(host,[]).append(
+            (str(name),path.split(':')[1]+filename,float(np.angle(phasor)),
+             int(delay)))
+    return plan
+
+def partialSum(fileList,phases,delays=None):
+    # Phases and sums the voltages of the files in 'fileList' block by
+    # block, reading each file 'delays' samples later (see planJobs)
+    # so the streams are aligned. Returns the partial beam with axes
+    # (time, frequency), covering the samples all streams share.
+
+    vList=[channelize.openVoltages(i) for i in fileList]
+    phasors=np.exp(1j*np.array(phases)).astype(np.complex64)
+    if delays is None:
+        delays=[0]*len(vList)
+    nSamples=min([v.shape[0]-delay for v,delay in zip(vList,delays)])
+    if nSamples<=0:
+        raise ValueError('delays are longer than the voltage files')
+    if np.iscomplexobj(vList[0]):
+        blockLength=blockSpectra
+        nOut=nSamples
+        channelizers=[None]*len(vList)
+    else:
+        blockLength=blockSpectra*2*nChan
+        nOut=nSamples//(2*nChan)
+        # One channelizer per stream, as each carries its own samples
+        # over to the next block
+        channelizers=[channelize.Channelizer(nChan,real=True)
+                      for v in vList]
+
+    beam=None
+    i=0
+    for start in xrange(0,nSamples,blockLength):
+        stop=min(start+blockLength,nSamples)
+        blockSum=None
+        for v,phasor,delay,channelizer in zip(vList,phasors,delays,
+                                              channelizers):
+            block=np.asarray(v[start+delay:stop+delay])
+            if channelizer is None:
+                spec=block.astype(np.complex64)
+            else:
+                spec=channelizer.channelise(block)[...,0]
+            if blockSum is None:
+                blockSum=spec*phasor
+            else:
+                blockSum+=spec*phasor
+        if beam is None:
+            beam=np.empty((nOut,)+blockSum.shape[1:],dtype=np.complex64)
+        beam[i:i+blockSum.shape[0]]=blockSum
+        i+=blockSum.shape[0]
+    return beam[:i]
+
+def reducePartials(partials):
+    # Sums partial beams from all nodes, trimming to the shortest
+
+    nOut=min([p.shape[0] for p in partials])
+    beam=partials[0][:nOut].copy()
+    for p in partials[1:]:
+        beam+=p[:nOut]
+    return beam
+
+def getLocalPath(host,path,localRoot):
+    # Location of a node's file in a local stand-in directory tree,
+    # with one subdirectory per node
+
+    return os.path.join(localRoot,host,os.path.basename(path))
+
+def runLocal(plan,localRoot,nProcs=None):
+    # Runs every node's jobs in a local process pool, reading files
+    # from 'localRoot'/host/, and reduces the partial beams
+
+    if len(plan)==0:
+        raise ValueError('no jobs to run')
+    pool=multiprocessing.Pool(nProcs or len(plan))
+    try:
+        results=[]
+        for host,jobs in sorted(plan.items()):
+            fileList=[getLocalPath(host,path,localRoot)
+                      for _,path,_,_ in jobs]
+            phases=[phase for _,_,phase,_ in jobs]
+            delays=[delay for _,_,_,delay in jobs]
+            results.append(pool.apply_async(partialSum,
+                                            (fileList,phases,delays)))
+        partials=[r.get() for r in results]
+    finally:
+        pool.close()
+        pool.join()
+    return reducePartials(partials)
+
+def runRemote(plan):
+    # Runs every node's jobs on that node over ssh, copies back only
+    # the partial beams, and reduces them
+
+    if len(plan)==0:
+        raise ValueError('no jobs to run')
+    procs=[]
+    for host,jobs in sorted(plan.items()):
+        remoteOut=remoteTmp+'/partial_'+host+'.npy'
+        args=['ssh',host,remotePython,'-m','pulsarAnalysis.Misc.scheduler',
+              'partial',remoteOut]
+        args+=[path+':'+repr(phase)+':'+str(delay)
+               for _,path,phase,delay in jobs]
+        procs.append((host,remoteOut,subprocess.Popen(args)))
+
+    localTmp=tempfile.mkdtemp()
+    partials=[]
+    for host,remoteOut,proc in procs:
+        if proc.wait()!=0:
+            print "Error, partial sum failed on "+host+"."
+            continue
+        localOut=os.path.join(localTmp,os.path.basename(remoteOut))
+        if subprocess.call(['scp','-q',host+':'+remoteOut,localOut])!=0:
+            print "Error, could not copy partial sum from "+host+"."
+            continue
+        partials.append(np.load(localOut))
+    if len(partials)<len(procs):
+        print "Warning, only "+str(len(partials))+" of "+str(len(procs))+\
+            " nodes returned partial sums."
+    return reducePartials(partials)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print "Usage: %s local outFile /path/to/localRoot [pol]" % sys.argv[0]
+        print "or"
+        print "%s remote outFile [pol]" % sys.argv[0]
+        print "or"
+        print "%s partial outFile file1:phase1:delay1 file2:phase2:delay2 ..." % sys.argv[0]
+        sys.exit(1)
+    mode=sys.argv[1]
+    outFile=sys.argv[2]
+
+    if mode=='partial':
+        jobs=[i.rsplit(':',2) for i in sys.argv[3:]]
+        beam=partialSum([i[0] for i in jobs],[float(i[1]) for i in jobs],
+                        [int(i[2]) for i in jobs])
+    elif mode in ('local','remote'):
+        pol=sys.argv[-1] if len(sys.argv)>(4 if mode=='local' else 3) \
+            else 'R'
+        try:
+            plan=planJobs(pol=pol)
+        except ValueError as e:
+            print "Error, "+str(e)+"."
+            sys.exit(1)
+        if mode=='local':
+            print "Running", sum([len(i) for i in plan.values()]),
+            print "dishes on", len(plan), "local workers..."
+            beam=runLocal(plan,sys.argv[3])
+        else:
+            for host,jobs in sorted(plan.items()):
+                print host+":", ' '.join([dish for dish,_,_,_ in jobs])
+            beam=runRemote(plan)
+    else:
+        print "Error, unrecognized mode: "+mode
+        sys.exit(1)
+    np.save(outFile,beam)
+    print "Saved to:"
+    print outFile
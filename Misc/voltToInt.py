@@ -1,29 +1,49 @@
 import sys
 import numpy as np
-from pulsarAnalysis.Misc import GMRTNaming,GMRTDelay
+from pulsarAnalysis.Misc import GMRTRegistry
 import os
 import pulsarAnalysis.GPs.pulseFinder as pf
+from pulsarAnalysis.Misc import dedisperse,prefetch,layout
+
+# Dispersion measure to coherently dedisperse the summed voltages to
+# before detection. Use None to skip dedispersion.
+DM=None
+
+# Calibration table (see delaySolver.py) to take dish phases from. Use
+# None for the phases in GMRTDelay.
+calibrationFile=None
+
+def getComplexType():
+    # Complex type matching pulseFinder.floatType, eg. complex64 for
+    # float32
+    return np.result_type(pf.floatType,np.complex64)
 
 def rotateVoltage(w,theta):
-    return w*np.exp(1J*theta)
+    return w*getComplexType().type(np.exp(1J*theta))
 
 def getIntensity(w,keepdims=False):
     return np.abs(w)**2
 
 def getDishes(filename):
-    dishlist=[]
-    for i,_ in GMRTNaming.telList:
-        if i in filename:
-            dishlist.append(i)
-            
-    return dishlist
+    return GMRTRegistry.getNamesInFile(filename)
+
+def getVoltageFiles(pathList):
+    # Returns all voltage files in 'pathList', expanding directories
+
+    fileList=[]
+    for iPath in pathList:
+        if os.path.isdir(iPath):
+            iFileList=[os.path.join(iPath,i) for i in sorted(os.listdir(iPath))]
+        else:
+            iFileList=[iPath]
+        fileList+=[i for i in iFileList if 'voltage' in os.path.basename(i)]
+    return fileList
 
 def getVoltage(path):
     runInfo={}
     print "Opening file:", path
     if 'voltage' in path:
-        w=np.load(path)
-        w=np.swapaxes(w,0,1)
+        w=layout.load(path)
         deltat=pf.getDeltaT(path)
         telescope=pf.getTelescope(path)
         startTime=pf.getStartTime(path)
@@ -45,15 +65,19 @@ def getVoltage(path):
     #runInfo['fullList']=fullList
     return w, runInfo
 
-def getSummedVoltages(pathList,rotation=True):
+def getSummedVoltages(pathList,rotation=True,calFile=None):
     if len(pathList)==0:
         print "Usage: %s foldspec" % sys.argv[0]
         # Run the code as: ./script.py data_foldspec.npy.
         sys.exit(1) 
+    if calFile is not None:
+        epoch=GMRTRegistry.loadCalibration(calFile)
+        print "Using calibration for epoch", epoch
     runInfo={}
     fulldishlist=[]
     goodFileFound=False
     print "Opening files..."
+    fileList=[]
     for iPath in pathList:
         if os.path.isdir(iPath):
             iFileList=os.listdir(iPath)
@@ -64,38 +88,49 @@ def getSummedVoltages(pathList,rotation=True):
                 iFile=os.path.join(iPath,jFile)
             else:
                 iFile=jFile
-            print "Reading",iFile 
-            if 'voltage' in iFile:
-                w=np.load(iFile)
-                if not goodFileFound:
-                    deltat=pf.getDeltaT(iFile)
-                    telescope=pf.getTelescope(iFile)
-                    startTime=pf.getStartTime(iFile)
-                    binWidth=pf.getWaterfallBinWidth(telescope,w.shape[0])
-                    outfileName=jFile.replace('voltage','waterfall')
-            else:
-                print "Error, the following file name is not recognized:"
-                print iFile
-                continue
-            dishlist=getDishes(jFile)
-            if len(dishlist)==1:
-                fulldishlist=fulldishlist+dishlist
-            else:
-                print "Error, multiple dishes found in file:"
-                print iFile
-                continue
+            fileList.append((jFile,iFile))
 
-            phase=GMRTDelay.getPhase(dishlist[-1]) if rotation else 0.
-            w=rotateVoltage(w,phase)
+    # Read the next file in the background while summing this one
+    loader=lambda x: np.asarray(np.load(x[1]),dtype=getComplexType()) \
+        if 'voltage' in x[1] else None
+    for (jFile,iFile),data in prefetch.prefetch(fileList,loader):
+        print "Reading",iFile 
+        if 'voltage' in iFile:
+            w=data
             if not goodFileFound:
-                n=w
-                outfileName=outfileName.replace(dishlist[0],'Phased')
-                goodFileFound=True
-            elif n.shape==w.shape:
-                n=n+w
-            else:
-                print "Error, shape mismatch in file:"
-                print iFile
+                deltat=pf.getDeltaT(iFile)
+                telescope=pf.getTelescope(iFile)
+                startTime=pf.getStartTime(iFile)
+                binWidth=pf.getWaterfallBinWidth(telescope,w.shape[0])
+                outfileName=jFile.replace('voltage','waterfall')
+        else:
+            print "Error, the following file name is not recognized:"
+            print iFile
+            continue
+        dishlist=getDishes(jFile)
+        if len(dishlist)==1:
+            fulldishlist=fulldishlist+dishlist
+        else:
+            print "Error, multiple dishes found in file:"
+            print iFile
+            continue
+
+        phase=GMRTRegistry.registry['phase'][
+            GMRTRegistry.getIndices(dishlist)[0]] if rotation else 0.
+        if np.isnan(phase):
+            print "Error, no phase available for dish in file:"
+            print iFile
+            continue
+        w=rotateVoltage(w,phase)
+        if not goodFileFound:
+            n=w
+            outfileName=outfileName.replace(dishlist[0],'Phased')
+            goodFileFound=True
+        elif n.shape==w.shape:
+            n+=w
+        else:
+            print "Error, shape mismatch in file:"
+            print iFile
 
     #isNotNan=~np.isnan(n.sum(0))
     #fullList=np.flatnonzero(isNotNan)
@@ -110,8 +145,20 @@ def getSummedVoltages(pathList,rotation=True):
     return n, runInfo
 
 if __name__ == "__main__":
-    w,runInfo=getSummedVoltages(sys.argv[1:],rotation=True)
-    I=getIntensity(w,keepdims=True)
+    w,runInfo=getSummedVoltages(sys.argv[1:],rotation=True,
+                                calFile=calibrationFile)
     print "Saving to:"
     print runInfo['outfileName']
-    np.save(runInfo['outfileName'],I)
+    if DM is not None:
+        # Dedisperse and detect block by block, writing straight to the
+        # output file
+        freqBand=pf.getFrequencyBand(runInfo['telescope'])
+        dd=dedisperse.Dedisperser(DM,freqBand,w.shape[1])
+        I=np.lib.format.open_memmap(runInfo['outfileName'],mode='w+',
+                                    dtype=np.abs(w[:0]).dtype,shape=w.shape)
+        for i,block in dedisperse.iterDedispersed(w,dd):
+            I[i:i+block.shape[0]]=getIntensity(block)
+        I.flush()
+    else:
+        I=getIntensity(w,keepdims=True)
+        np.save(runInfo['outfileName'],I)